@@ -0,0 +1,69 @@
+import datetime
+import pytest
+import yaml
+import zoneinfo
+
+from pydomotic.sensors import AQISensor, TimeSensor, WeatherSensor
+
+_timezone = 'America/New_York'
+_now = datetime.datetime(2023, 6, 15, 8, 0,
+        tzinfo=zoneinfo.ZoneInfo(_timezone))  # thursday
+
+class _FixedTimeSensor(TimeSensor):
+    def get_current_datetime(self):
+        return _now
+
+class _FixedAQISensor(AQISensor):
+    def get_aqi(self):
+        return 42
+
+class _FixedWeatherSensor(WeatherSensor):
+    def current_temperature(self):
+        return 72.5
+
+@pytest.fixture(autouse=True)
+def patch_sensors(monkeypatch):
+    monkeypatch.setattr('pydomotic.context.TimeSensor', _FixedTimeSensor)
+    monkeypatch.setattr('pydomotic.context.AQISensor', _FixedAQISensor)
+    monkeypatch.setattr('pydomotic.context.WeatherSensor', _FixedWeatherSensor)
+
+_device_count = 20
+
+def _ifs(i):
+    hour, minute = i % 11 + 1, i * 7 % 60
+    return (
+        {'weekday': 'monday,tuesday,wednesday,thursday,friday',
+            'time': f'{hour}:{minute:02d}am'},
+        {'time': f'{hour}:00am-{hour}:30pm'},
+        {'cron': f'*/{i % 10 + 5} {hour}-17 * * 1-5'},
+        {'sunset': -(i % 120)},
+        {'aqi': f'>{i % 150}', 'time': f'{hour}:00am-10:00pm'},
+        {'temp': f'<{i % 40 + 50}', 'weekday': 'thursday,friday'},
+        {'date': f'2023-06-{i % 28 + 1:02d}', 'time': f'{hour}:{minute:02d}am'},
+    )[i % 7]
+
+def make_config(automations):
+    conf = {
+        'triggers': {
+            'location': {'latitude': 40.689, 'longitude': -74.044},
+            'aqi': {'api_key': '123abc'},
+            'weather': {'api_key': '123abc'},
+            'timezone': _timezone,
+        },
+        'devices': {f'device-{i}': {'provider': 'noop', 'id': f'{i:03d}'}
+            for i in range(_device_count)},
+        'automations': {},
+    }
+    for i in range(automations):
+        component = {
+            'if': _ifs(i),
+            'then': {'turn-on': f'device-{i % _device_count}'},
+        }
+        if i % 5 == 0:
+            component['else'] = {'turn-off': f'device-{i % _device_count}'}
+        conf['automations'][f'automation-{i}'] = {'components': [component]}
+    return yaml.safe_dump(conf)
+
+@pytest.fixture(params=(10, 100, 1000), ids=lambda n: f'{n}-automations')
+def raw_conf(request):
+    return make_config(request.param)
@@ -0,0 +1,21 @@
+import pytest
+
+from pydomotic.handlers import Handler
+from pydomotic.parsers import parse_raw_yaml
+
+@pytest.fixture
+def handler(raw_conf, request):
+    handler = Handler(max_workers=getattr(request, 'param', None),
+            reload=False)
+    handler.components, handler.context = parse_raw_yaml(raw_conf)
+    return handler
+
+def test_run_components(benchmark, handler):
+    handler.run_components()  # warm up lazy sensors and schedule
+    benchmark(handler.run_components)
+
+@pytest.mark.parametrize('handler', (4,), indirect=True,
+        ids=('4-workers',))
+def test_run_components_max_workers(benchmark, handler):
+    handler.run_components()
+    benchmark(handler.run_components)
@@ -0,0 +1,39 @@
+import gc
+import tracemalloc
+
+from pydomotic.handlers import Handler
+from pydomotic.parsers import parse_raw_yaml
+from pydomotic.schedule import Schedule
+
+def _traced(fn):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = fn()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, retained, peak
+
+def test_parse_memory(benchmark, raw_conf):
+    (components, _), retained, peak = benchmark.pedantic(
+            _traced, args=(lambda: parse_raw_yaml(raw_conf),), rounds=1)
+    benchmark.extra_info['retained_bytes'] = retained
+    benchmark.extra_info['peak_bytes'] = peak
+    benchmark.extra_info['bytes_per_component'] = retained // len(components)
+
+def test_schedule_memory(benchmark, raw_conf):
+    components, _ = parse_raw_yaml(raw_conf)
+    _, retained, peak = benchmark.pedantic(
+            _traced, args=(lambda: Schedule(components),), rounds=1)
+    benchmark.extra_info['retained_bytes'] = retained
+    benchmark.extra_info['peak_bytes'] = peak
+
+def test_run_components_memory(benchmark, raw_conf):
+    handler = Handler(reload=False)
+    handler.components, handler.context = parse_raw_yaml(raw_conf)
+    handler.run_components()
+    _, retained, peak = benchmark.pedantic(
+            _traced, args=(handler.run_components,), rounds=1)
+    benchmark.extra_info['retained_bytes'] = retained
+    benchmark.extra_info['peak_bytes'] = peak
@@ -0,0 +1,15 @@
+import copy
+import yaml
+
+from pydomotic.parsers import parse_raw_yaml, _parse_conf
+
+def test_parse_raw_yaml(benchmark, raw_conf):
+    components, _ = benchmark(parse_raw_yaml, raw_conf)
+    assert components, 'no components parsed'
+
+def test_parse_conf(benchmark, raw_conf):
+    # excludes yaml loading, parsing modifies the conf so copy it every round
+    conf = yaml.safe_load(raw_conf)
+    components, _ = benchmark.pedantic(_parse_conf,
+            setup=lambda: ((copy.deepcopy(conf),), {}), rounds=20)
+    assert components, 'no components parsed'
@@ -0,0 +1,32 @@
+import pytest
+import yaml
+
+from pydomotic.parsers import parse_raw_yaml
+from pydomotic.schedule import Schedule
+
+def test_schedule(benchmark, raw_conf):
+    # built on the first run of every process, so cron and lambda pay for it
+    # on every run
+    components, _ = parse_raw_yaml(raw_conf)
+    schedule = benchmark(Schedule, components)
+    assert schedule.candidates(), 'no candidates scheduled'
+
+def _all_day_config(automations):
+    return yaml.safe_dump({
+        'triggers': {'timezone': 'America/New_York'},
+        'devices': {'device': {'provider': 'noop', 'id': '000'}},
+        'automations': {f'automation-{i}': {'components': [{
+            'if': {'time': '12:00am-11:59pm'},
+            'then': {'turn-on': 'device'},
+        }]} for i in range(automations)},
+    })
+
+@pytest.fixture(params=(10, 100, 1000), ids=lambda n: f'{n}-automations')
+def all_day_components(request):
+    components, _ = parse_raw_yaml(_all_day_config(request.param))
+    return components
+
+def test_schedule_all_day(benchmark, all_day_components):
+    schedule = benchmark(Schedule, all_day_components)
+    assert len(schedule.candidates()) == len(all_day_components), (
+            'all components should be candidates')
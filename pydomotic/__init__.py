@@ -1,9 +1,10 @@
 from .exceptions import (PyDomoticConfigParsingError,
         PyDomoticComponentRunError, PyDomoticMethodImportError)
-from .handlers import Handler, LambdaHandler
+from .handlers import AsyncHandler, Handler, LambdaHandler
 from .version import version
 
 __all__ = [
+        'AsyncHandler',
         'Handler',
         'LambdaHandler',
         'PyDomoticConfigParsingError',
@@ -1,6 +1,6 @@
 import abc
 
-from .utils import ObjectMetaclass, import_method
+from .utils import ObjectMetaclass, import_method, run_in_thread
 
 class _Action(metaclass=ObjectMetaclass):
 
@@ -8,6 +8,9 @@ class _Action(metaclass=ObjectMetaclass):
     def run(self):
         pass
 
+    async def run_async(self):
+        await run_in_thread(self.run)
+
 class _DeviceAction(_Action):
 
     required_class_attrs = ['device_action_method_name']
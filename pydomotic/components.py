@@ -1,27 +1,39 @@
 import logging
+import time
+
+from .utils import run_in_thread
 
 logger = logging.getLogger(__name__)
 
 class Component(object):
 
-    def __init__(self, name, ifs, thens, elses, enabled=True):
+    def __init__(self, name, ifs, thens, elses, enabled=True, edge=False):
         self.name = name or 'unknown'
         self.ifs = ifs
         self.thens = thens
         self.elses = elses
         self.enabled = enabled
+        self.edge = edge
+        self._passed = None
+        self._trigger_stats = {}
 
     def run(self):
         logger.debug('running component %s', self.name)
         checked = True
         for trigger in self.ifs:
             logger.debug('checking trigger %s', trigger.name)
-            if not trigger.check():
+            start = time.monotonic()
+            passes = trigger.check()
+            self._record_check(trigger, passes, time.monotonic() - start)
+            if not passes:
                 logger.debug('trigger failed')
                 checked = False
                 break
             logger.debug('trigger passes')
+        self._sort_triggers()
 
+        if self._unchanged(checked):
+            return
         if checked:
             logger.debug('all triggers passed')
             exception = self._run_actions(self.thens)
@@ -30,6 +42,31 @@ class Component(object):
 
         if exception:
             raise exception
+        self._passed = checked
+
+    def _unchanged(self, checked):
+        # edge triggered components only run actions when their triggers
+        # start or stop passing, not every time they are checked
+        if self.edge and checked == self._passed:
+            logger.debug('triggers unchanged, skipping actions')
+            return True
+        return False
+
+    def _record_check(self, trigger, passes, seconds):
+        stats = self._trigger_stats.get(id(trigger))
+        if stats is None:
+            stats = self._trigger_stats[id(trigger)] = _TriggerStats()
+        stats.record(passes, seconds)
+
+    def _sort_triggers(self):
+        # triggers are and-ed together so the order they are checked in only
+        # changes how much work is done, within a cost class the triggers
+        # which are quickest and most often fail are checked first
+        def _key(trigger):
+            stats = self._trigger_stats.get(id(trigger))
+            rank = stats.rank() if stats else 0
+            return getattr(trigger, 'cost', 1), rank
+        self.ifs.sort(key=_key)
 
     def _run_actions(self, actions):
         exception = None
@@ -41,3 +78,83 @@ class Component(object):
                 logger.exception(f'failure running action {action.name}')
                 exception = e
         return exception
+
+    async def run_async(self):
+        # same order and short circuiting as run, so triggers calling 3rd
+        # party apis are only awaited once the cheaper triggers pass
+        logger.debug('running component %s', self.name)
+        checked = True
+        for trigger in self.ifs:
+            logger.debug('checking trigger %s', trigger.name)
+            start = time.monotonic()
+            if getattr(trigger, 'local', False):
+                passes = trigger.check()
+            else:
+                passes = await _check_async(trigger)
+            self._record_check(trigger, passes, time.monotonic() - start)
+            if not passes:
+                logger.debug('trigger failed')
+                checked = False
+                break
+            logger.debug('trigger passes')
+        self._sort_triggers()
+
+        if self._unchanged(checked):
+            return
+        if checked:
+            logger.debug('all triggers passed')
+            exception = await self._run_actions_async(self.thens)
+        else:
+            exception = await self._run_actions_async(self.elses)
+
+        if exception:
+            raise exception
+        self._passed = checked
+
+    async def _run_actions_async(self, actions):
+        # actions run one after another in the order they are configured,
+        # they often act on the same device
+        exception = None
+        for action in actions:
+            logger.debug('running action %s', action.name)
+            try:
+                await _run_async(action)
+            except Exception as e:
+                logger.exception(f'failure running action {action.name}')
+                exception = e
+        return exception
+
+class _TriggerStats(object):
+
+    # weight of the latest check when averaging check durations
+    alpha = 0.2
+
+    def __init__(self):
+        self.checks = 0
+        self.passes = 0
+        self.seconds = 0
+
+    def record(self, passes, seconds):
+        self.checks += 1
+        self.passes += bool(passes)
+        if self.checks == 1:
+            self.seconds = seconds
+        else:
+            self.seconds += self.alpha * (seconds - self.seconds)
+
+    def rank(self):
+        # expected time spent per failed check
+        fail_rate = 1 - self.passes / self.checks
+        return max(self.seconds, 1e-6) / max(fail_rate, 0.01)
+
+async def _check_async(trigger):
+    check_async = getattr(trigger, 'check_async', None)
+    if check_async is None:
+        return await run_in_thread(trigger.check)
+    return await check_async()
+
+async def _run_async(action):
+    run_async = getattr(action, 'run_async', None)
+    if run_async is None:
+        return await run_in_thread(action.run)
+    return await run_async()
@@ -1,8 +1,10 @@
+import copy
 import logging
 
 from .exceptions import PyDomoticConfigParsingError
 from .sensors import (TimeSensor, WebhookSensor, DeviceSensor, WeatherSensor,
-        AQISensor, SunSensor)
+        AQISensor, SunSensor, SensorReadings)
+from .utils import HTTPSession
 
 logger = logging.getLogger(__name__)
 
@@ -26,7 +28,13 @@ class Context(object):
 
         self._context = None
         self._sensors = None
+        self._session = None
+        self.cache_store = None
+        self.conf = {}
+        self.config_version = None
         self.devices = {}
+        self.providers = {}
+        self.readings = SensorReadings()
 
     @staticmethod
     def from_yaml(triggers):
@@ -137,11 +145,22 @@ class Context(object):
                     f'{self._weather_data_cache_seconds.__class__.__name__}')
         return self._weather_data_cache_seconds
 
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = HTTPSession()
+        return self._session
+
+    @session.setter
+    def session(self, session):
+        self._session = session
+
     @property
     def aqi_sensor(self):
         if self._aqi_sensor is None:
             self._aqi_sensor = AQISensor(
-                    self.aqi_api_key, self.latitude, self.longitude)
+                    self.aqi_api_key, self.latitude, self.longitude,
+                    session=self.session, cache_store=self.cache_store)
         return self._aqi_sensor
 
     @property
@@ -169,7 +188,8 @@ class Context(object):
         if self._weather_sensor is None:
             self._weather_sensor = WeatherSensor(
                     self.weather_api_key, self.latitude, self.longitude,
-                    data_cache_seconds=self.weather_data_cache_seconds)
+                    data_cache_seconds=self.weather_data_cache_seconds,
+                    cache_store=self.cache_store)
         return self._weather_sensor
 
     @property
@@ -178,6 +198,27 @@ class Context(object):
             self._webhook_sensor = WebhookSensor()
         return self._webhook_sensor
 
+    def freeze_time(self, now=None):
+        # one tick shared by every time based trigger for the whole run
+        if self._time_sensor is not None:
+            return self._time_sensor.freeze(now)
+
+    def unfreeze_time(self):
+        if self._time_sensor is not None:
+            self._time_sensor.unfreeze()
+
+    def copy(self):
+        # configuration is reloaded into a copy so that a failed reload leaves
+        # this context untouched, sensors and readings are shared by both
+        context = copy.copy(self)
+        context._device_sensors = dict(self._device_sensors)
+        return context
+
+    def reset_devices(self):
+        # called after devices are replaced while reloading configuration
+        self._device_sensors = {}
+        self._context = None
+
     def device_sensor(self, name):
         device = self.devices.get(name, None)
         if device is None:
@@ -1,45 +1,410 @@
+import asyncio
+import datetime
+import itertools
 import logging
+import os
+import queue
 import time
 import traceback
 
 from .exceptions import PyDomoticComponentRunError
-from .parsers import parse_yaml
+from .parsers import parse_yaml, reparse_yaml, compile_yaml
+from .poller import SensorPoller
+from .schedule import Schedule
+from .utils import run_in_thread
 
 logger = logging.getLogger(__name__)
 
 class Handler(object):
 
-    def __init__(self, config_file=None):
-        self.components, _ = parse_yaml(config_file=config_file)
+    poller = None
+    _changes = None
+    _event_driven = frozenset()
+    _retry = ()
+
+    def __init__(self, config_file=None, max_workers=None, reload=None,
+            catch_up=None):
+        self.components, self.context = parse_yaml(config_file=config_file)
+        self._init_executor(max_workers)
+        self._init_reload(config_file, None, reload)
+        self._init_catch_up(catch_up)
 
     def __call__(self):
         self.run_components()
 
+    @property
+    def components(self):
+        return self._components
+
+    @components.setter
+    def components(self, components):
+        self._components = components
+        self._schedule = None
+
+    @property
+    def schedule(self):
+        if self._schedule is None:
+            self._schedule = Schedule(self._components)
+        return self._schedule
+
+    def _init_executor(self, max_workers):
+        if max_workers is None:
+            max_workers = os.environ.get('PYDOMOTIC_MAX_WORKERS')
+        self.max_workers = int(max_workers or 1)
+        self._executor = None
+
+    def _init_reload(self, config_file, s3, reload):
+        if reload is None:
+            reload = os.environ.get('PYDOMOTIC_CONFIG_RELOAD', '').lower() in (
+                    '1', 'true', 'yes')
+        self.reload = reload
+        self.config_file = config_file
+        self.s3 = s3
+
+    def _init_catch_up(self, catch_up):
+        if catch_up is None:
+            catch_up = os.environ.get('PYDOMOTIC_CATCH_UP_MINUTES')
+        self.catch_up = int(catch_up or 0)
+        self._last_tick = None
+        if (self.catch_up and self.context.cache_store is None and
+                not getattr(self, 'daemon', False)):
+            # without a cache store the last run is only kept in memory
+            logger.warning('catch up is enabled but no cache directory is '
+                    'configured, runs missed between separate processes will '
+                    'not be caught up, set cache.directory to keep the time '
+                    'of the last run between processes')
+
+    def reload_config(self):
+        try:
+            parsed = reparse_yaml(self.components, self.context,
+                    config_file=self.config_file, s3=self.s3)
+        except Exception as e:
+            logger.error(f'failed to reload configuration, keeping previous '
+                    f'configuration: [{e.__class__.__name__}] {e}')
+            return False
+        if parsed is None:
+            return False
+        self.components, self.context = parsed
+        if self.poller is not None:
+            self.stop_polling()
+            self.start_polling()
+        return True
+
+    def start_polling(self):
+        # changed readings are queued by the poller thread and their
+        # dependent components are run by run_changed
+        if self._changes is None:
+            self._changes = queue.Queue()
+        self.poller = SensorPoller(self.context.readings,
+                self.schedule.sensor_reads(), on_change=self._sensor_changed)
+        self._event_driven = _event_driven_components(self.components,
+                self.poller)
+        self.poller.start()
+
+    def stop_polling(self):
+        if self.poller is not None:
+            self.poller.stop()
+            self.poller = None
+            self._event_driven = frozenset()
+            self._retry = ()
+
+    def _sensor_changed(self, sensor, method_name):
+        self._changes.put((sensor, method_name))
+
+    def run_changed(self, timeout=None):
+        # runs the event driven components which read any sensor whose polled
+        # value changed, waiting up to timeout seconds for the first change.
+        # other dependents are left to the minute loop, so clock gated
+        # components do not run again on every change
+        try:
+            changes = [self._changes.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                changes.append(self._changes.get_nowait())
+            except queue.Empty:
+                break
+        components = []
+        for sensor, method_name in changes:
+            for component in self.schedule.dependents(sensor, method_name):
+                if (component.enabled and id(component) in self._event_driven
+                        and component not in components):
+                    components.append(component)
+        if components:
+            logger.debug(f'sensor readings changed, running '
+                    f'{len(components)} components')
+            self._run_candidates(components)
+        return components
+
+    def next_run(self, now=None):
+        return self.schedule.next_run(now)
+
+    @property
+    def executor(self):
+        if self._executor is None and self.max_workers > 1:
+            import concurrent.futures
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='pydomotic')
+        return self._executor
+
     def run_components(self):
-        components, failed = [c for c in self.components if c.enabled], []
-        attempts = 3
+        if self.reload:
+            self.reload_config()
+        self._run_candidates()
+
+    def _run_candidates(self, components=None):
+        tick = self.context.freeze_time()
+        try:
+            if components is None:
+                if self.catch_up and tick is not None:
+                    self._catch_up(tick)
+                # components only reading polled sensors run when they change
+                # or when they failed to run last time
+                components = [c for c in self.schedule.candidates()
+                        if c.enabled and id(c) not in self._event_driven]
+                components.extend(c for c in self._retry
+                        if id(c) in self._event_driven)
+            self.context.readings.prefetch(
+                    _component_sensor_reads(components),
+                    executor=self.executor)
+            self._run_components(components)
+        finally:
+            self.context.readings.clear()
+            self.context.unfreeze_time()
+
+    def _catch_up(self, tick):
+        # clock gated components whose minute passed since the last run are
+        # run once each, in order, as of the last minute they would have fired
+        last = self._load_last_tick()
+        self._save_last_tick(tick.datetime)
+        if last is None:
+            return
+        minute = datetime.timedelta(minutes=1)
+        now = _utc_minute(tick.datetime)
+        start = max(_utc_minute(last) + minute,
+                now - self.catch_up * minute)
+
+        fired = {}
+        while start < now:
+            local = start.astimezone(tick.datetime.tzinfo)
+            self.context.freeze_time(local)
+            for component in self.schedule.candidates(now=local):
+                if _is_clock_gated(component) and all(
+                        trigger.check() for trigger in component.ifs):
+                    fired[component] = local
+            start += minute
+
+        order = {component: i for i, component in enumerate(self.components)}
+        missed = sorted(fired, key=lambda c: (fired[c], order.get(c, 0)))
+        try:
+            for local, components in itertools.groupby(missed, key=fired.get):
+                components = list(components)
+                logger.info(f'catching up {len(components)} components missed '
+                        f'at {local.isoformat()}')
+                self.context.freeze_time(local)
+                try:
+                    self._run_components(components)
+                except PyDomoticComponentRunError as e:
+                    logger.error(f'failure catching up components: {e}')
+        finally:
+            self.context.freeze_time(tick.datetime)
+
+    def _load_last_tick(self):
+        store = self.context.cache_store
+        if self._last_tick is None and store is not None:
+            stored = store.get(_last_tick_key)
+            if stored is not None:
+                self._last_tick = stored[1]
+        return self._last_tick
+
+    def _save_last_tick(self, now):
+        self._last_tick = now
+        store = self.context.cache_store
+        if store is not None:
+            store.set(_last_tick_key, time.time(), now)
+
+    def _run_components(self, components):
+        ran, failed, attempts = components, [], 3
 
         while components and attempts:
             attempts -= 1
-            for component in components:
-                try:
-                    component.run()
-                except Exception:
-                    exc = ''.join(traceback.format_exc())
-                    logger.error(
-                        f'failure running component {component.name}, '
-                        f'{attempts} remaining attempts\n{exc}')
-                    failed.append(component)
+            if self.executor is None:
+                failed = self._run_serially(components, attempts)
+            else:
+                groups = _group_dependent_components(components)
+                futures = [self.executor.submit(
+                    self._run_serially, group, attempts) for group in groups]
+                failed = [c for f in futures for c in f.result()]
+                failed.sort(key=components.index)
 
             if failed and attempts:
                 time.sleep(0.25)
             components, failed = failed, []
 
+        self._retry_failed(ran, components)
+        if components:
+            raise PyDomoticComponentRunError(
+                    f'one or more components failed after 3 attempts: '
+                    f'{", ".join(c.name for c in components)}')
+
+    def _retry_failed(self, ran, failed):
+        # event driven components are not run again until a sensor changes,
+        # so those which failed are run every minute until they succeed
+        self._retry = [c for c in self._retry if c not in ran] + [
+                c for c in failed if id(c) in self._event_driven]
+
+    def _run_serially(self, components, attempts):
+        failed = []
+        for component in components:
+            try:
+                component.run()
+            except Exception:
+                exc = ''.join(traceback.format_exc())
+                logger.error(
+                    f'failure running component {component.name}, '
+                    f'{attempts} remaining attempts\n{exc}')
+                failed.append(component)
+        return failed
+
+    async def run_components_async(self):
+        if self.reload:
+            await run_in_thread(self.reload_config)
+        tick = self.context.freeze_time()
+        try:
+            if self.catch_up and tick is not None:
+                await run_in_thread(self._catch_up, tick)
+            components = [c for c in self.schedule.candidates() if c.enabled]
+            await self.context.readings.prefetch_async(
+                    _component_sensor_reads(components))
+            await self._run_components_async(components)
+        finally:
+            self.context.readings.clear()
+            self.context.unfreeze_time()
+
+    async def _run_components_async(self, components):
+        failed, attempts = [], 3
+
+        while components and attempts:
+            attempts -= 1
+            groups = _group_dependent_components(components)
+            results = await asyncio.gather(*(self._run_group_async(
+                group, attempts) for group in groups))
+            failed = [c for result in results for c in result]
+            failed.sort(key=components.index)
+
+            if failed and attempts:
+                await asyncio.sleep(0.25)
+            components, failed = failed, []
+
         if components:
             raise PyDomoticComponentRunError(
                     f'one or more components failed after 3 attempts: '
                     f'{", ".join(c.name for c in components)}')
 
+    async def _run_group_async(self, components, attempts):
+        failed = []
+        for component in components:
+            try:
+                run_async = getattr(component, 'run_async', None)
+                if run_async is None:
+                    await run_in_thread(component.run)
+                else:
+                    await run_async()
+            except Exception:
+                exc = ''.join(traceback.format_exc())
+                logger.error(
+                    f'failure running component {component.name}, '
+                    f'{attempts} remaining attempts\n{exc}')
+                failed.append(component)
+        return failed
+
+class AsyncHandler(Handler):
+
+    def run_components(self):
+        asyncio.run(self.run_components_async())
+
+_last_tick_key = 'handler:last_tick'
+
+def _utc_minute(now):
+    return now.astimezone(datetime.timezone.utc).replace(second=0,
+            microsecond=0)
+
+def _is_clock_gated(component):
+    # only components which do nothing but wait for a time are caught up,
+    # sensor readings and webhook requests from the past are not known
+    ifs = getattr(component, 'ifs', None)
+    return bool(getattr(component, 'enabled', True) and ifs and
+            not getattr(component, 'elses', None) and
+            not getattr(component, 'edge', False) and
+            all(getattr(trigger, 'clock', False) for trigger in ifs))
+
+def _event_driven_components(components, poller):
+    # components whose every trigger reads a polled sensor cannot change
+    # without a sensor changing, so they are not run every minute
+    event_driven = set()
+    for component in components:
+        ifs = getattr(component, 'ifs', None)
+        if not ifs:
+            continue
+        for trigger in ifs:
+            reads = getattr(trigger, 'sensor_reads', tuple)()
+            if getattr(trigger, 'clock', False) or not reads or not all(
+                    poller.polls(*read) for read in reads):
+                break
+        else:
+            event_driven.add(id(component))
+    return frozenset(event_driven)
+
+def _component_sensor_reads(components):
+    # sensors are only read for components whose local triggers pass, this
+    # keeps clock gated components from calling 3rd party apis every minute
+    reads = []
+    for component in components:
+        for trigger in getattr(component, 'ifs', []):
+            if getattr(trigger, 'local', False):
+                try:
+                    if not trigger.check():
+                        break
+                except Exception:
+                    break
+                continue
+            sensor_reads = getattr(trigger, 'sensor_reads', None)
+            if sensor_reads is not None:
+                reads.extend(sensor_reads())
+    return reads
+
+def _group_dependent_components(components):
+    # components sharing a device must run in order on the same thread,
+    # everything else is free to run concurrently
+    parents, owners = list(range(len(components))), {}
+    def _find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+    for i, component in enumerate(components):
+        for key in _component_device_keys(component):
+            parents[_find(i)] = _find(owners.setdefault(key, i))
+    groups = {}
+    for i, component in enumerate(components):
+        groups.setdefault(_find(i), []).append(component)
+    return list(groups.values())
+
+def _component_device_keys(component):
+    keys = set()
+    actions = getattr(component, 'thens', []) + getattr(component, 'elses', [])
+    for action in actions:
+        device = getattr(action, 'device', None)
+        if device is None:
+            # custom code may touch any device, keep it serialized
+            keys.add(action.__class__.__name__)
+            continue
+        for device in getattr(device, 'devices', None) or [device]:
+            keys.add(id(device))
+    return keys
+
 class LambdaHandler(Handler):
 
     ok_response = {
@@ -47,21 +412,134 @@ class LambdaHandler(Handler):
             'body': '{"status":"ok"}',
     }
 
-    def __init__(self, config_file=None, s3=None):
-        self.components, context = parse_yaml(config_file=config_file, s3=s3)
-        self.webhook_sensor = context.webhook_sensor
+    def __init__(self, config_file=None, s3=None, max_workers=None,
+            reload=None, catch_up=None):
+        # built once per container, everything here including provider
+        # sessions and sensor caches is reused by warm invocations
+        start = time.perf_counter()
+        self.components, self.context = parse_yaml(
+                config_file=config_file, s3=s3)
+        self._init_executor(max_workers)
+        self._init_reload(config_file, s3, reload)
+        self._init_catch_up(catch_up)
+        self.init_seconds = time.perf_counter() - start
+        self.invocations = 0
+
+    @property
+    def webhook_sensor(self):
+        return self.context.webhook_sensor
 
     def __call__(self, event, context):
         # TODO: test webhook triggers
-        self.webhook_sensor.set_webhook_request(event)
-        self.run_components()
+        start = time.perf_counter()
+        self.invocations += 1
+        try:
+            # reload first so the request is set on the current context
+            if self.reload:
+                self.reload_config()
+            self.webhook_sensor.set_webhook_request(event)
+            self._run_candidates()
+        finally:
+            # only the incoming request is specific to a single invocation
+            self.webhook_sensor.reset()
+            self._log_invocation(context, time.perf_counter() - start)
         return self.ok_response
 
+    def _log_invocation(self, context, run_seconds):
+        if self.invocations == 1:
+            start = f'cold start (init {self.init_seconds:.3f}s)'
+        else:
+            start = 'warm start'
+        memory = getattr(context, 'memory_limit_in_mb', None)
+        memory = f', {memory}MB memory' if memory else ''
+        logger.info(f'invocation {self.invocations}: {start}, '
+                f'run {run_seconds:.3f}s{memory}')
+
 class CommandLineHandler(Handler):
 
     def __init__(self):
         args = self.parse_args()
-        super().__init__(config_file=args.config_file)
+        self.command = args.command
+        self.config_file = args.config_file
+        self.daemon = args.daemon
+        self.sleep = args.sleep
+        self.poll = args.poll
+        if self.command == 'run':
+            super().__init__(config_file=args.config_file,
+                    max_workers=args.max_workers, reload=args.reload or None,
+                    catch_up=args.catch_up)
+
+    def __call__(self):
+        if self.command == 'compile':
+            compile_yaml(config_file=self.config_file)
+        elif self.daemon:
+            self.run_forever()
+        else:
+            self.run_components()
+
+    # longest time slept at once, in case the clock is changed
+    max_sleep_seconds = 3600
+
+    def run_forever(self):
+        if self.sleep:
+            logger.info('running components when next scheduled, ctrl-c to '
+                    'exit')
+        else:
+            logger.info('running components once per minute, ctrl-c to exit')
+        if self.poll:
+            self.start_polling()
+        try:
+            while True:
+                if self.sleep:
+                    self.sleep_until_next_run()
+                else:
+                    self.sleep_until_next_minute()
+                try:
+                    self.run_components()
+                except Exception as e:
+                    logger.error(f'failure running components: '
+                            f'[{e.__class__.__name__}] {e}')
+        except KeyboardInterrupt:
+            logger.info('exiting')
+        finally:
+            self.stop_polling()
+
+    def sleep_until_next_minute(self):
+        self._sleep(60 - time.time() % 60)
+
+    def _sleep(self, seconds):
+        # while polling, components reading a changed sensor are run as soon
+        # as the change is seen instead of waiting for the next minute
+        if self.poller is None:
+            time.sleep(seconds)
+            return
+        deadline = time.time() + seconds
+        while (remaining := deadline - time.time()) > 0:
+            try:
+                self.run_changed(timeout=remaining)
+            except Exception as e:
+                logger.error(f'failure running components: '
+                        f'[{e.__class__.__name__}] {e}')
+
+    def sleep_until_next_run(self):
+        # with reload enabled the config file is still checked every minute,
+        # a changed config may need to run sooner
+        next_run = self.next_run()
+        logger.debug(f'next run at {next_run}')
+        while True:
+            if next_run is None:
+                seconds = self.max_sleep_seconds
+            else:
+                seconds = min(next_run.timestamp() - time.time(),
+                        self.max_sleep_seconds)
+            if self.reload:
+                seconds = min(seconds, 60 - time.time() % 60)
+            self._sleep(max(seconds, 0))
+            if next_run is not None and time.time() >= next_run.timestamp():
+                return
+            if self.reload and self.reload_config():
+                next_run = self.next_run()
+                logger.debug(f'next run at {next_run}')
 
     def parse_args(self):
         import argparse
@@ -69,9 +547,55 @@ class CommandLineHandler(Handler):
                 prog='python -m pydomotic',
                 description='run pydomotic components',
         )
+        parser.add_argument(
+                'command',
+                nargs='?',
+                choices=('run', 'compile'),
+                default='run',
+                help=('run components (default) or compile the config file '
+                        'into a snapshot which is loaded faster on startup'),
+        )
         parser.add_argument(
                 '-c', '--config-file',
                 help=('path to config file, will default to pydomotic.yaml '
                         'if no other config setting is found'),
         )
+        parser.add_argument(
+                '-d', '--daemon',
+                action='store_true',
+                help=('keep running and execute components at the start of '
+                        'every minute instead of only once'),
+        )
+        parser.add_argument(
+                '-s', '--sleep',
+                action='store_true',
+                help=('with --daemon, sleep until the next minute any '
+                        'component could run instead of waking every minute'),
+        )
+        parser.add_argument(
+                '-p', '--poll',
+                action='store_true',
+                help=('with --daemon, read network sensors in the background '
+                        'at their own intervals instead of while running '
+                        'components'),
+        )
+        parser.add_argument(
+                '-r', '--reload',
+                action='store_true',
+                help=('reload the config file before running components '
+                        'whenever it changes, most useful with --daemon'),
+        )
+        parser.add_argument(
+                '-u', '--catch-up',
+                type=int,
+                metavar='MINUTES',
+                help=('run time based components missed since the last run, '
+                        'looking back at most this many minutes'),
+        )
+        parser.add_argument(
+                '-w', '--max-workers',
+                type=int,
+                help=('number of threads used to run independent components '
+                        'concurrently, defaults to 1'),
+        )
         return parser.parse_args()
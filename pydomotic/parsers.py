@@ -1,8 +1,15 @@
+import copy
 import datetime
 import croniter
+import hashlib
+import importlib.util
+import itertools
+import json
 import logging
 import os
+import pickle
 import re
+import tempfile
 import yaml
 
 from .actions import (TurnOnAction, TurnOffAction, SwitchAction, SetModeAction,
@@ -15,23 +22,163 @@ from .providers.noop import NoopProvider
 from .triggers import (AQITrigger, TimeTrigger, IsoWeekdayTrigger, DateTrigger,
         CronTrigger, RandomTrigger, SunriseTrigger, SunsetTrigger,
         TemperatureTrigger, RadonTrigger, WebhookTrigger)
+from .utils import FileCacheStore, HTTPSession, private_directory
 
 logger = logging.getLogger(__name__)
 
 def parse_yaml(config_file=None, s3=None):
     reader = _get_config_reader(config_file, s3)
     data = reader.read() if reader else None
-    return parse_raw_yaml(data)
+    components, context = parse_raw_yaml(data, snapshot_file=reader.snapshot_file)
+    context.config_version = reader.read_version
+    return components, context
+
+def reparse_yaml(components, context, config_file=None, s3=None):
+    # returns None when the configuration has not changed since it was parsed
+    reader = _get_config_reader(config_file, s3)
+    version = reader.version()
+    if version is None or version == context.config_version:
+        return None
+    logger.info('configuration changed, reloading')
+    # a broken configuration is not parsed again until it changes again
+    context.config_version = version
+    data = reader.read()
+    components, context = reparse_raw_yaml(data, components, context,
+            snapshot_file=reader.snapshot_file)
+    context.config_version = reader.read_version
+    return components, context
+
+def parse_raw_yaml(raw_conf, snapshot_file=None):
+    conf = _load_raw_yaml(raw_conf, snapshot_file) if raw_conf else {}
+    return _parse_conf(conf)
 
-def parse_raw_yaml(raw_conf):
-    conf = yaml.safe_load(raw_conf) if raw_conf else {}
+def _parse_conf(conf):
     context = Context.from_yaml(conf.get('triggers', {}))
-    context.providers = _parse_providers(conf.get('providers', {}))
+    # parsing modifies some values, keep a copy to compare when reloading
+    context.conf = copy.deepcopy(conf)
+    context.session = _parse_http_session(conf.get('http') or {})
+    context.cache_store = _parse_cache_store(conf.get('cache') or {})
+    context.providers = _parse_providers(conf.get('providers', {}),
+            session=context.session, cache_store=context.cache_store)
     context.devices = _parse_devices(conf.get('devices', {}), context.providers)
     _parse_aliases(conf.get('aliases', {}), context)
     components = _parse_components(conf.get('automations', {}), context)
     return components, context
 
+_global_sections = ('triggers', 'http', 'cache')
+
+def reparse_raw_yaml(raw_conf, components, context, snapshot_file=None):
+    # only parse the providers, devices and automations which changed,
+    # unchanged providers keep their authenticated sessions. the given
+    # context is never modified, so it is still usable if parsing fails
+    conf = _load_raw_yaml(raw_conf, snapshot_file) if raw_conf else {}
+    old_conf = context.conf
+    if any(conf.get(key) != old_conf.get(key) for key in _global_sections):
+        logger.info('global settings changed, parsing all configuration')
+        return _parse_conf(conf)
+    new_conf = copy.deepcopy(conf)
+    context = context.copy()
+
+    providers_conf = conf.get('providers', {})
+    old_providers_conf = old_conf.get('providers', {})
+    reused_providers = {name: context.providers[name]
+            for name, provider in providers_conf.items()
+            if name in context.providers and
+                provider == old_providers_conf.get(name)}
+    if 'noop' in context.providers:
+        reused_providers['noop'] = context.providers['noop']
+    providers = _parse_providers({name: provider
+            for name, provider in providers_conf.items()
+            if name not in reused_providers},
+            session=context.session, cache_store=context.cache_store)
+    providers.update(reused_providers)
+
+    devices_conf = conf.get('devices', {})
+    old_devices_conf = old_conf.get('devices', {})
+    reused_devices = {name: context.devices[name]
+            for name, device in devices_conf.items()
+            if name in context.devices and
+                device == old_devices_conf.get(name) and
+                device.get('provider') in reused_providers}
+    devices_changed = (len(reused_devices) != len(old_devices_conf) or
+            len(reused_devices) != len(devices_conf) or
+            conf.get('aliases') != old_conf.get('aliases'))
+
+    context.conf = new_conf
+    context.providers = providers
+    if devices_changed:
+        logger.info('devices changed, parsing all automations')
+        devices = _parse_devices({name: device
+                for name, device in devices_conf.items()
+                if name not in reused_devices}, providers)
+        devices.update(reused_devices)
+        context.devices = devices
+        context.reset_devices()
+        _parse_aliases(conf.get('aliases', {}), context)
+        return _parse_components(conf.get('automations', {}), context), context
+
+    old_automations = old_conf.get('automations', {})
+    old_components = {}
+    for component in components:
+        name = component.name.rsplit(' ', 1)[0]
+        old_components.setdefault(name, []).append(component)
+    components = []
+    for name, automation in conf.get('automations', {}).items():
+        if automation == old_automations.get(name):
+            components.extend(old_components.get(name, []))
+        else:
+            components.extend(_parse_automation(name, automation, context))
+    return components, context
+
+_snapshot_version = 1
+
+def compile_yaml(config_file=None, s3=None):
+    reader = _get_config_reader(config_file, s3)
+    if not reader.snapshot_file:
+        raise PyDomoticConfigParsingError(
+                'compiling is only supported for local config files')
+    raw_conf = reader.read()
+    if not raw_conf:
+        raise PyDomoticConfigParsingError('no configuration found to compile')
+    _write_snapshot(reader.snapshot_file, raw_conf, yaml.safe_load(raw_conf))
+    logger.info(f'configuration compiled to {reader.snapshot_file}')
+    return reader.snapshot_file
+
+def _write_snapshot(snapshot_file, raw_conf, conf):
+    snapshot = {
+            'version': _snapshot_version,
+            'hash': _hash_raw_yaml(raw_conf),
+            'conf': conf or {},
+    }
+    tmp_file = f'{snapshot_file}.{os.getpid()}.tmp'
+    with open(tmp_file, 'wb') as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, snapshot_file)
+
+def _load_raw_yaml(raw_conf, snapshot_file):
+    if snapshot_file and os.path.isfile(snapshot_file):
+        try:
+            with open(snapshot_file, 'rb') as f:
+                snapshot = pickle.load(f)
+            if snapshot.get('version') != _snapshot_version:
+                logger.debug(f'compiled config {snapshot_file} has wrong '
+                        'version, ignoring')
+            elif snapshot.get('hash') != _hash_raw_yaml(raw_conf):
+                logger.debug(f'compiled config {snapshot_file} is out of '
+                        'date, ignoring')
+            else:
+                logger.debug(f'loading compiled config {snapshot_file}')
+                return snapshot['conf']
+        except Exception as e:
+            logger.debug(f'unable to load compiled config {snapshot_file}, '
+                    f'ignoring: [{e.__class__.__name__}] {e}')
+    return yaml.safe_load(raw_conf) or {}
+
+def _hash_raw_yaml(raw_conf):
+    if isinstance(raw_conf, str):
+        raw_conf = raw_conf.encode()
+    return hashlib.sha256(raw_conf).hexdigest()
+
 def _get_config_reader(config_file, s3):
     conf_env = os.environ.get('PYDOMOTIC_CONFIG_FILE')
     s3_env = os.environ.get('PYDOMOTIC_CONFIG_S3')
@@ -56,16 +203,33 @@ def _get_config_reader(config_file, s3):
         return _file_reader('pydomotic.yml')
 
 class _reader(object):
+    snapshot_file = None
+    read_version = None
     def __init__(self, data):
         self.data = data
 
+    def version(self):
+        return None
+
 class _file_reader(_reader):
+    @property
+    def snapshot_file(self):
+        if self.data:
+            return f'{self.data}.compiled'
+
+    def version(self):
+        try:
+            return os.stat(self.data).st_mtime_ns
+        except Exception:
+            return None
+
     def read(self):
         if not self.data:
             logger.warning('no config file or s3 data provided, skipping')
         elif not os.path.isfile(self.data):
             logger.warning(f'configuration file {self.data} does not exist, skipping')
         else:
+            self.read_version = self.version()
             with open(self.data) as f:
                 return f.read()
 
@@ -81,21 +245,156 @@ class _s3_reader(_reader):
             raise PyDomoticConfigParsingError('malformed s3 object: '
                     'expecting tuple like (bucket, key) or string like "bucket/key"')
 
+    def version(self):
+        bucket, key = self.parse()
+        try:
+            import boto3
+            client = boto3.client('s3')
+            return client.head_object(Bucket=bucket, Key=key).get('ETag')
+        except Exception as e:
+            logger.debug('unable to fetch configuration version from s3: '
+                    f'[{e.__class__.__name__}] {e}')
+            return None
+
     def read(self):
         bucket, key = self.parse()
+        cached = self._read_cache()
 
         try:
             import boto3
             client = boto3.client('s3')
-            response = client.get_object(Bucket=bucket, Key=key)
+            kwargs = {'IfNoneMatch': cached['etag']} if cached else {}
+            try:
+                response = client.get_object(Bucket=bucket, Key=key, **kwargs)
+            except Exception as e:
+                if cached and _s3_not_modified(e):
+                    logger.debug('configuration unchanged in s3, using cached '
+                            'copy')
+                    self.read_version = cached['etag']
+                    return cached['body'].encode()
+                raise
+            body = response['Body'].read()
+            self.read_version = response.get('ETag')
             logger.debug('configuration successfully fetched from s3')
-            return response['Body'].read()
+            self._write_cache(body)
+            return body
         except Exception as e:
             logger.error('unable to fetch configuration from s3: '
                     f'[{e.__class__.__name__}] {e}')
             return None
 
-def _parse_providers(providers_conf):
+    # a copy of the configuration is kept so unchanged configuration is not
+    # downloaded again. it is loaded as configuration, so it is only kept in
+    # a directory private to the current user
+    cache_directory = None
+
+    @property
+    def cache_file(self):
+        if not hasattr(os, 'getuid'):
+            return None
+        directory = self.cache_directory or os.path.join(
+                tempfile.gettempdir(), f'pydomotic-{os.getuid()}')
+        try:
+            private = private_directory(directory)
+        except OSError as e:
+            logger.debug('unable to create s3 configuration cache directory, '
+                    f'ignoring: [{e.__class__.__name__}] {e}')
+            return None
+        if not private:
+            logger.warning(f'directory {directory} is not private to the '
+                    'current user, not caching s3 configuration')
+            return None
+        bucket, key = self.parse()
+        digest = hashlib.sha256(f'{bucket}/{key}'.encode()).hexdigest()[:16]
+        return os.path.join(directory, f'pydomotic-s3-{digest}.json')
+
+    def _read_cache(self):
+        cache_file = self.cache_file
+        if cache_file is None:
+            return None
+        try:
+            with open(cache_file) as f:
+                cached = json.load(f)
+            if (isinstance(cached, dict) and
+                    isinstance(cached.get('etag'), str) and
+                    isinstance(cached.get('body'), str)):
+                return cached
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.debug('unable to load cached s3 configuration, ignoring: '
+                    f'[{e.__class__.__name__}] {e}')
+        return None
+
+    def _write_cache(self, body):
+        cache_file = self.cache_file
+        if not self.read_version or cache_file is None:
+            return
+        try:
+            if isinstance(body, bytes):
+                body = body.decode()
+            tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+            fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                    0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'etag': self.read_version, 'body': body}, f)
+            os.replace(tmp_file, cache_file)
+        except Exception as e:
+            logger.debug('unable to cache s3 configuration: '
+                    f'[{e.__class__.__name__}] {e}')
+
+def _s3_not_modified(e):
+    response = getattr(e, 'response', None) or {}
+    code = response.get('Error', {}).get('Code')
+    status = response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return str(code) in ('304', 'NotModified') or status == 304
+
+def _parse_http_session(http_conf):
+    if not isinstance(http_conf, dict):
+        raise PyDomoticConfigParsingError(
+                'http settings must be a dict, not '
+                f'{http_conf.__class__.__name__}')
+    kwargs = {}
+    for key, kwarg, typ in (
+            ('pool_size', 'pool_size', int),
+            ('retries', 'retries', int),
+            ('backoff_seconds', 'backoff_seconds', (int, float)),
+            ('timeout_seconds', 'timeout', (int, float))):
+        value = http_conf.get(key)
+        if value is None:
+            continue
+        if not isinstance(value, typ) or isinstance(value, bool):
+            raise PyDomoticConfigParsingError(
+                    f'http {key} must be a number, not '
+                    f'{value.__class__.__name__}')
+        kwargs[kwarg] = value
+    return HTTPSession(**kwargs)
+
+def _parse_cache_store(cache_conf):
+    if not isinstance(cache_conf, dict):
+        raise PyDomoticConfigParsingError(
+                'cache settings must be a dict, not '
+                f'{cache_conf.__class__.__name__}')
+    directory = cache_conf.get('directory')
+    if directory is None:
+        return None
+    if not isinstance(directory, str):
+        raise PyDomoticConfigParsingError(
+                'cache directory must be a string, not '
+                f'{directory.__class__.__name__}')
+    directory = _parse_string(directory)
+    try:
+        if not private_directory(directory):
+            logger.warning(f'cache directory {directory} is not private to '
+                    'the current user, not caching')
+            return None
+        return FileCacheStore(directory)
+    except Exception as e:
+        raise PyDomoticConfigParsingError(
+                f'unable to open cache directory "{directory}": '
+                f'[{e.__class__.__name__}] {e}')
+
+def _parse_providers(providers_conf, session=None, cache_store=None):
     providers = {
             'noop': NoopProvider(),
     }
@@ -108,11 +407,13 @@ def _parse_providers(providers_conf):
         elif name == 'fujitsu':
             providers['fujitsu'] = _parse_fujitsu_provider(provider)
         elif name == 'airthings':
-            providers['airthings'] = _parse_airthings_provider(provider)
+            providers['airthings'] = _parse_airthings_provider(
+                    provider, session=session, cache_store=cache_store)
         elif name == 'moen':
             providers['moen'] = _parse_moen_provider(provider)
         elif name == 'ecobee':
-            providers['ecobee'] = _parse_ecobee_provider(provider)
+            providers['ecobee'] = _parse_ecobee_provider(
+                    provider, session=session, cache_store=cache_store)
         else:
             raise PyDomoticConfigParsingError(f'unknown provider "{name}"')
     return providers
@@ -131,6 +432,7 @@ def _parse_tuya_provider(provider):
     cache_secs = provider.get('device_status_cache_seconds')
     timeout = provider.get('timeout_seconds')
 
+    _require_module('tuya', 'gosundpy')
     from .providers.tuya import TuyaProvider
     return TuyaProvider(username, password, access_id, access_key,
             status_cache_seconds=cache_secs, timeout=timeout)
@@ -144,10 +446,11 @@ def _parse_fujitsu_provider(provider):
     username = _parse_string(provider['username'])
     password = _parse_string(provider['password'])
 
+    _require_module('fujitsu', 'pyfujitseu')
     from .providers.fujitsu import FujitsuProvider
     return FujitsuProvider(username, password)
 
-def _parse_airthings_provider(provider):
+def _parse_airthings_provider(provider, session=None, cache_store=None):
     for key in ('client_id', 'client_secret'):
         if key not in provider:
             raise PyDomoticConfigParsingError(
@@ -158,10 +461,14 @@ def _parse_airthings_provider(provider):
 
     cache_secs = provider.get('data_cache_seconds')
     timeout = provider.get('timeout_seconds')
+    location_id = provider.get('location_id')
+    if location_id is not None:
+        location_id = _parse_string(str(location_id))
 
     from .providers.airthings import AirthingsProvider
     return AirthingsProvider(client_id, client_secret, data_cache_seconds=cache_secs,
-            timeout=timeout)
+            timeout=timeout, location_id=location_id, session=session,
+            cache_store=cache_store)
 
 def _parse_moen_provider(provider):
     for key in ('username', 'password'):
@@ -172,10 +479,11 @@ def _parse_moen_provider(provider):
     username = _parse_string(provider['username'])
     password = _parse_string(provider['password'])
 
+    _require_module('moen', 'pyflowater')
     from .providers.moen import MoenProvider
     return MoenProvider(username, password)
 
-def _parse_ecobee_provider(provider):
+def _parse_ecobee_provider(provider, session=None, cache_store=None):
     for key in ('app_key', 'refresh_token'):
         if key not in provider:
             raise PyDomoticConfigParsingError(
@@ -184,8 +492,23 @@ def _parse_ecobee_provider(provider):
     app_key = _parse_string(provider['app_key'])
     refresh_token = _parse_string(provider['refresh_token'])
 
+    cache_secs = provider.get('data_cache_seconds')
+
     from .providers.ecobee import EcobeeProvider
-    return EcobeeProvider(app_key, refresh_token)
+    return EcobeeProvider(app_key, refresh_token, data_cache_seconds=cache_secs,
+            session=session, cache_store=cache_store)
+
+def _require_module(provider_name, module_name):
+    # the sdk is only imported when the provider first connects, make sure it
+    # is installed so that a missing dependency is reported at load time
+    try:
+        spec = importlib.util.find_spec(module_name)
+    except Exception:
+        spec = None
+    if spec is None:
+        raise PyDomoticConfigParsingError(
+                f'provider {provider_name} requires package "{module_name}", '
+                f'install it with "pip install pydomotic[{provider_name}]"')
 
 _env_re = re.compile(r'\$\{env:(.*?)\}')
 def _parse_string(string):
@@ -215,6 +538,11 @@ def _parse_devices(devices_conf, providers):
         if device_id is None:
             raise PyDomoticConfigParsingError(
                     f'no id given for device "{name}"')
+        if (not isinstance(device_id, (str, int)) or
+                isinstance(device_id, bool) or device_id == ''):
+            raise PyDomoticConfigParsingError(
+                    f'id for device "{name}" must be a string or number, not '
+                    f'{device_id!r}')
         try:
             description = device.get('description')
             devices[name] = provider.get_device(device_id, name, description)
@@ -226,22 +554,33 @@ def _parse_devices(devices_conf, providers):
 def _parse_components(automations, context):
     components = []
     for name, automation in automations.items():
-        logger.info(f'preparing automation {name}')
-        if not automation.get('enabled', True):
-            continue
-        for num, component in enumerate(automation.get('components', [])):
-            component_name = f'{name} {num}'
-            ifs = component.get('if') or {}
-            thens = component.get('then') or {}
-            elses = component.get('else') or {}
-            logger.info(f'adding component {component_name}')
-            components.append(Component(
-                name=component_name,
-                ifs=_parse_triggers(ifs, context),
-                thens=_parse_actions(thens, context),
-                elses=_parse_actions(elses, context),
-                enabled=True,
-            ))
+        components.extend(_parse_automation(name, automation, context))
+    return components
+
+def _parse_automation(name, automation, context):
+    components = []
+    logger.info(f'preparing automation {name}')
+    if not automation.get('enabled', True):
+        return components
+    for num, component in enumerate(automation.get('components', [])):
+        component_name = f'{name} {num}'
+        ifs = component.get('if') or {}
+        thens = component.get('then') or {}
+        elses = component.get('else') or {}
+        edge = component.get('edge', False)
+        if not isinstance(edge, bool):
+            raise PyDomoticConfigParsingError(
+                    f'component edge setting must be a boolean, not '
+                    f'{edge.__class__.__name__}')
+        logger.info(f'adding component {component_name}')
+        components.append(Component(
+            name=component_name,
+            ifs=_parse_triggers(ifs, context),
+            thens=_parse_actions(thens, context),
+            elses=_parse_actions(elses, context),
+            enabled=True,
+            edge=edge,
+        ))
     return components
 
 def _parse_triggers(ifs, context):
@@ -249,7 +588,7 @@ def _parse_triggers(ifs, context):
     for trigger_type, trigger_value in ifs.items():
         logger.debug(f'adding {trigger_type} trigger')
         triggers.append(_parse_trigger(trigger_type, trigger_value, context))
-    return triggers
+    return sorted(triggers, key=lambda trigger: trigger.cost)
 
 def _parse_trigger(typ, value, context, sensor=None):
     if typ == 'aqi':
@@ -357,7 +696,7 @@ def _parse_ranged_values(value, typ, context):
 def _parse_aqi_trigger(value, context, sensor=None):
     _check_func = _parse_ranged_values(value, 'aqi', context)
     sensor = sensor or context.aqi_sensor
-    return AQITrigger(_check_func, sensor)
+    return AQITrigger(_check_func, sensor, readings=context.readings)
 
 _time_re = re.compile(r'(10|11|12|[1-9]):([0-5][0-9])\s*([ap]m)')
 def _parse_time_trigger(value, context, sensor=None):
@@ -373,7 +712,7 @@ def _parse_time_trigger(value, context, sensor=None):
             hour += 12
         return 60*hour + minute
 
-    times = []
+    ranges = []
     for time in value.split(','):
         time = time.strip().lower()
         ranged_time = time.split('-')
@@ -386,9 +725,9 @@ def _parse_time_trigger(value, context, sensor=None):
             raise PyDomoticConfigParsingError(
                     f'unknown time "{time}", expecting time like '
                     '"HH:MMam-HH:MMam"')
-        for minute in range(start_time, end_time):
-            times.append(minute)
-    return TimeTrigger(times, time_sensor=sensor or context.time_sensor)
+        ranges.append(range(start_time, end_time))
+    return TimeTrigger(itertools.chain.from_iterable(ranges),
+            time_sensor=sensor or context.time_sensor)
 
 _isoweekdays = {
         'monday': 1,
@@ -488,14 +827,15 @@ def _parse_temp_trigger(value, context, sensor=None):
     _check_func = _parse_ranged_values(value, 'temp', context)
     # TODO: test weather sensor singleton
     sensor = sensor or context.weather_sensor
-    return TemperatureTrigger(_check_func, sensor)
+    return TemperatureTrigger(_check_func, sensor,
+            readings=context.readings)
 
 def _parse_radon_trigger(value, context, sensor=None):
     if not sensor:
         raise PyDomoticConfigParsingError(
                 'radon trigger requires a radon sensor')
     _check_func = _parse_ranged_values(value, 'radon', context)
-    return RadonTrigger(_check_func, sensor)
+    return RadonTrigger(_check_func, sensor, readings=context.readings)
 
 def _parse_webhook_trigger(value, context, sensor=None):
     # TODO: test _parse_webhook_trigger
@@ -0,0 +1,110 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class SensorPoller(object):
+
+    # reads sensors in a background thread at each sensor's own interval and
+    # pushes the values into the shared readings, so triggers checked during
+    # a run use the latest value instead of waiting on a 3rd party api
+
+    def __init__(self, readings, reads=(), on_change=None):
+        self.readings = readings
+        self.on_change = on_change
+        self._due = []
+        self._keys = set()
+        self._budgets = {}
+        self._counter = itertools.count()
+        self._stop = threading.Event()
+        self._thread = None
+        for sensor, method_name in reads:
+            self.add(sensor, method_name)
+
+    def add(self, sensor, method_name):
+        key = (id(sensor), method_name)
+        if poll_interval(sensor) is None or key in self._keys:
+            return False
+        self._keys.add(key)
+        budget = _rate_limit_key(sensor)
+        self._budgets[budget] = self._budgets.get(budget, 0) + 1
+        heapq.heappush(self._due,
+                (0, next(self._counter), sensor, method_name))
+        return True
+
+    def interval(self, sensor):
+        # every read sharing a rate limit is polled, so each gets its share
+        return poll_interval(sensor,
+                reads=self._budgets.get(_rate_limit_key(sensor), 1))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def polls(self, sensor, method_name):
+        return (id(sensor), method_name) in self._keys
+
+    def run_pending(self, now=None):
+        # polls every sensor which is due, returns seconds until the next one
+        if now is None:
+            now = time.monotonic()
+        while self._due and self._due[0][0] <= now:
+            _, _, sensor, method_name = heapq.heappop(self._due)
+            interval = self.interval(sensor)
+            self._poll(sensor, method_name, interval)
+            heapq.heappush(self._due, (now + interval, next(self._counter),
+                sensor, method_name))
+        if self._due:
+            return self._due[0][0] - now
+
+    def _poll(self, sensor, method_name, interval):
+        try:
+            value = getattr(sensor, method_name)()
+        except Exception as e:
+            name = getattr(sensor, 'name', sensor)
+            logger.warning(f'failed to poll {method_name} from {name}, '
+                    f'ignoring: [{e.__class__.__name__}] {e}')
+            return
+        # a value is trusted until two polls in a row have failed
+        changed = self.readings.push(sensor, method_name, value,
+                max_age=2*interval)
+        if changed and self.on_change is not None:
+            self.on_change(sensor, method_name)
+
+    def start(self):
+        if self._thread is None and self._due:
+            logger.info(f'polling {len(self)} sensor readings in the '
+                    'background')
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run,
+                    name='pydomotic-poller', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._stop.wait(self.run_pending())
+
+def poll_interval(sensor, reads=1):
+    # seconds between polls, slowed down so that this many reads sharing the
+    # rate limit stay under it
+    interval = getattr(sensor, 'poll_interval', None)
+    if interval is None:
+        return None
+    rate_limit = getattr(sensor, 'rate_limit', None)
+    if rate_limit:
+        interval = max(interval, 3600 * reads / rate_limit)
+    return interval
+
+def _rate_limit_key(sensor):
+    key = getattr(sensor, 'rate_limit_key', None)
+    if key is None:
+        return id(sensor)
+    return key
@@ -1,4 +1,7 @@
+import hashlib
 import requests
+import threading
+import time
 
 from .base import Provider, Device
 from ..utils import cache_value
@@ -10,28 +13,61 @@ class AirthingsAPI(object):
             'grant_type': 'client_credentials',
             'scope': 'read:device:current_values',
     }
-    _auth_headers = {}
     _samples_url = 'https://ext-api.airthings.com/v1/devices/{}/latest-samples'
-
-    def __init__(self, client_id, client_secret, data_cache_seconds=None, timeout=None):
+    _location_samples_url = (
+            'https://ext-api.airthings.com/v1/locations/{}/latest-samples')
+
+    # refresh access tokens this many seconds before they expire
+    _auth_refresh_seconds = 60
+
+    # samples for a location are shared by all its devices for the remainder
+    # of the minute
+    default_location_cache_seconds = 30
+
+    def __init__(self, client_id, client_secret, data_cache_seconds=None,
+            timeout=None, location_id=None, session=None, cache_store=None):
+        self._session = session or requests
+        self.cache_store = cache_store
+        self.cache_key = 'airthings:' + hashlib.sha256(
+                client_id.encode()).hexdigest()[:16]
         self._auth_credentials = (client_id, client_secret)
+        self._auth_headers = {}
+        self._auth_lock = threading.Lock()
+        self._expires_at = 0
         self._timeout = timeout
+        self._location_id = location_id
         if data_cache_seconds:
             self.fetch_data = cache_value(seconds=data_cache_seconds)(self.fetch_data)
+        if location_id:
+            if data_cache_seconds is None:
+                data_cache_seconds = self.default_location_cache_seconds
+            self.fetch_location_data = cache_value(seconds=data_cache_seconds)(
+                    self.fetch_location_data)
 
     def _get_auth_headers(self):
-        resp = requests.post(
-                self._auth_token_url,
-                data=self._auth_token_data,
-                auth=self._auth_credentials,
-                timeout=self._timeout,
-        )
-        resp.raise_for_status()
-        self._auth_headers['Authorization'] = f'Bearer {resp.json().get("access_token")}'
-        return self._auth_headers
+        with self._auth_lock:
+            if time.time() < self._expires_at - self._auth_refresh_seconds:
+                return self._auth_headers
+            resp = self._session.post(
+                    self._auth_token_url,
+                    data=self._auth_token_data,
+                    auth=self._auth_credentials,
+                    timeout=self._timeout,
+            )
+            resp.raise_for_status()
+            data = resp.json()
+            self._expires_at = time.time() + (data.get('expires_in') or 0)
+            self._auth_headers['Authorization'] = f'Bearer {data.get("access_token")}'
+            return self._auth_headers
 
     def fetch_data(self, device_id):
-        resp = requests.get(
+        if self._location_id:
+            data = self.fetch_location_data().get(str(device_id))
+            if data is None:
+                raise AirthingsError(f'device "{device_id}" not found in '
+                        f'location "{self._location_id}"')
+            return data
+        resp = self._session.get(
                 url=self._samples_url.format(device_id),
                 headers=self._get_auth_headers(),
                 timeout=self._timeout,
@@ -39,6 +75,16 @@ class AirthingsAPI(object):
         resp.raise_for_status()
         return resp.json().get('data')
 
+    def fetch_location_data(self):
+        resp = self._session.get(
+                url=self._location_samples_url.format(self._location_id),
+                headers=self._get_auth_headers(),
+                timeout=self._timeout,
+        )
+        resp.raise_for_status()
+        return {str(d.get('id')): d.get('data')
+                for d in resp.json().get('devices') or []}
+
     def get_device(self, device_id):
         return self.device(device_id, self)
 
@@ -63,11 +109,17 @@ class AirthingsAPI(object):
         def get_battery(self):
             return self.fetch_data()['battery']
 
+class AirthingsError(Exception):
+    pass
+
 class AirthingsProvider(Provider):
 
-    def __init__(self, client_id, client_secret, data_cache_seconds=None, timeout=None):
+    def __init__(self, client_id, client_secret, data_cache_seconds=None,
+            timeout=None, location_id=None, session=None, cache_store=None):
         self.api = AirthingsAPI(client_id, client_secret,
-                data_cache_seconds=data_cache_seconds, timeout=timeout)
+                data_cache_seconds=data_cache_seconds, timeout=timeout,
+                location_id=location_id, session=session,
+                cache_store=cache_store)
 
     def get_device(self, device_id, device_name, device_description):
         device = self.api.get_device(device_id)
@@ -75,6 +127,15 @@ class AirthingsProvider(Provider):
 
 class AirthingsDevice(Device):
 
+    # devices report every 5 minutes, the api allows 120 requests per hour
+    # for each account
+    poll_interval = 5 * 60
+    rate_limit = 120
+
+    @property
+    def rate_limit_key(self):
+        return self.device.api.cache_key
+
     def current_radon(self):
         return self.device.get_radon()
 
@@ -1,25 +1,38 @@
 import abc
 
-from ..utils import ObjectMetaclass
+from ..utils import AsyncMixin, ObjectMetaclass, lazy_value
 
-class Provider(metaclass=ObjectMetaclass):
+class Provider(AsyncMixin, metaclass=ObjectMetaclass):
 
     @abc.abstractmethod
     def get_device(self, device_id, device_name, device_description):
         pass
 
-class Device(metaclass=ObjectMetaclass):
+class Device(AsyncMixin, metaclass=ObjectMetaclass):
+
+    # seconds between background polls of sensor readings and most calls
+    # allowed per hour, None when the device is not worth polling. devices
+    # with the same rate limit key share one rate limit
+    poll_interval = None
+    rate_limit = None
+    rate_limit_key = None
 
     def __init__(self, device, name, description):
-        self.device = device
+        self._device = device
         self.device_name = name
         self.device_description = description
 
+    @property
+    def device(self):
+        if isinstance(self._device, lazy_value):
+            return self._device.get()
+        return self._device
+
     @property
     def name(self):
         return f'{super().name} {self.device_name}'
 
-class DeviceGroup(metaclass=ObjectMetaclass):
+class DeviceGroup(AsyncMixin, metaclass=ObjectMetaclass):
 
     def __init__(self, devices, name):
         self.devices = devices
@@ -1,15 +1,21 @@
+import hashlib
 import logging
 import requests
+import threading
 import time
 
 from pydomotic.providers.base import Provider, Device
+from pydomotic.utils import cache_value
 
 logger = logging.getLogger(__name__)
 
 class EcobeeProvider(Provider):
 
-    def __init__(self, app_key, refresh_token):
-        self.api = EcobeeAPI(app_key, refresh_token)
+    def __init__(self, app_key, refresh_token, data_cache_seconds=None,
+            session=None, cache_store=None):
+        self.api = EcobeeAPI(app_key, refresh_token,
+                data_cache_seconds=data_cache_seconds, session=session,
+                cache_store=cache_store)
 
     def get_device(self, device_id, device_name, device_description):
         device = self.api.get_device(device_id)
@@ -17,6 +23,9 @@ class EcobeeProvider(Provider):
 
 class EcobeeDevice(Device):
 
+    # ecobee asks that thermostats are polled no more than every 3 minutes
+    poll_interval = 3 * 60
+
     def turn_on(self):
         self.device.turn_fan_on()
         logger.debug('device "%s" turned on', self.name)
@@ -34,14 +43,28 @@ class EcobeeAPI(object):
     token_url = api_url + '/token'
     thermostat_url = api_url + '/1/thermostat'
 
-    headers = {
-        'Content-Type': 'application/json;charset=UTF-8',
-    }
+    # all sensors are read from a single thermostat request, which is then
+    # shared by every device for the remainder of the minute
+    default_data_cache_seconds = 30
 
-    def __init__(self, app_key, refresh_token):
+    def __init__(self, app_key, refresh_token, data_cache_seconds=None,
+            session=None, cache_store=None):
+        self._session = session or requests
+        self.cache_store = cache_store
+        self.cache_key = 'ecobee:' + hashlib.sha256(
+                app_key.encode()).hexdigest()[:16]
         self._refresh_token = refresh_token
         self._app_key = app_key
         self._expires_at = 0
+        self._auth_lock = threading.Lock()
+        self.headers = {
+            'Content-Type': 'application/json;charset=UTF-8',
+        }
+        if data_cache_seconds is None:
+            data_cache_seconds = self.default_data_cache_seconds
+        if data_cache_seconds:
+            self.get_sensors = cache_value(seconds=data_cache_seconds)(
+                    self.get_sensors)
 
     def get_device(self, device_id):
         return self.device(device_id, self)
@@ -58,12 +81,18 @@ class EcobeeAPI(object):
             }""",
         })
 
-    def get_sensor_data(self, sensor_id):
+    def get_sensors(self):
+        sensors = {}
         for thermostat in self.get_thermostat()['thermostatList']:
             for sensor in thermostat['remoteSensors']:
-                if sensor['id'] == sensor_id:
-                    return sensor
-        raise EcobeeError(f'sensor "{sensor_id}" not found')
+                sensors[sensor['id']] = sensor
+        return sensors
+
+    def get_sensor_data(self, sensor_id):
+        sensor = self.get_sensors().get(sensor_id)
+        if sensor is None:
+            raise EcobeeError(f'sensor "{sensor_id}" not found')
+        return sensor
 
     def set_fan_hold(self, mode):
         self._make_request('POST', self.thermostat_url, params={
@@ -95,10 +124,17 @@ class EcobeeAPI(object):
         access_token, token_type = resp.get('access_token'), resp.get('token_type')
         self.headers['Authorization'] = f'{token_type} {access_token}'
 
+    def _ensure_authenticated(self):
+        # devices are read concurrently, only one of them refreshes the token
+        with self._auth_lock:
+            if time.time() > self._expires_at:
+                self._authenticate()
+
     def _make_request(self, method, url, params=None):
         if time.time() > self._expires_at and url != self.token_url:
-            self._authenticate()
-        resp = requests.request(method, url, params=params, headers=self.headers)
+            self._ensure_authenticated()
+        resp = self._session.request(method, url, params=params,
+                headers=self.headers)
         resp.raise_for_status()
         return resp.json()
 
@@ -1,9 +1,7 @@
 import logging
 
-import pyfujitseu.api
-import pyfujitseu.splitAC
-
 from .base import Provider, Device
+from ..utils import lazy_value
 
 logger = logging.getLogger(__name__)
 
@@ -12,10 +10,20 @@ logger = logging.getLogger(__name__)
 class FujitsuProvider(Provider):
 
     def __init__(self, username, password, tokenpath='/tmp/token.txt'):
-        self.fujitsu = pyfujitseu.api.Api(username, password, tokenpath=tokenpath)
+        def _connect():
+            import pyfujitseu.api
+            return pyfujitseu.api.Api(username, password, tokenpath=tokenpath)
+        self._fujitsu = lazy_value(_connect)
+
+    @property
+    def fujitsu(self):
+        return self._fujitsu.get()
 
     def get_device(self, device_id, device_name, device_description):
-        device = pyfujitseu.splitAC.splitAC(dsn=device_id, api=self.fujitsu)
+        def _get_device():
+            import pyfujitseu.splitAC
+            return pyfujitseu.splitAC.splitAC(dsn=device_id, api=self.fujitsu)
+        device = lazy_value(_get_device)
         return FujitsuDevice(device, device_name, device_description)
 
 class FujitsuDevice(Device):
@@ -1,15 +1,23 @@
-import pyflowater
-
 from .base import Provider, Device
+from ..utils import lazy_value
 
 class MoenProvider(Provider):
 
     def __init__(self, username, password):
-        self.flo = pyflowater.PyFlo(username, password)
+        def _connect():
+            import pyflowater
+            return pyflowater.PyFlo(username, password)
+        self._flo = lazy_value(_connect)
+
+    @property
+    def flo(self):
+        return self._flo.get()
 
     def get_device(self, device_id, device_name, device_description):
-        location_id = self._get_location_id(device_id)
-        device = MoenDevice.API(self.flo, location_id, device_id)
+        def _get_device():
+            location_id = self._get_location_id(device_id)
+            return MoenDevice.API(self.flo, location_id, device_id)
+        device = lazy_value(_get_device)
         return MoenDevice(device, device_name, device_description)
 
     def _get_location_id(self, device_id):
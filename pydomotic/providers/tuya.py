@@ -1,7 +1,7 @@
-import gosundpy
 import logging
 
 from .base import Provider, Device
+from ..utils import lazy_value
 
 logger = logging.getLogger(__name__)
 
@@ -9,11 +9,18 @@ class TuyaProvider(Provider):
 
     def __init__(self, username, password, access_id, access_key,
             status_cache_seconds=None, timeout=None):
-        self.tuya = gosundpy.Gosund(username, password, access_id, access_key,
-                status_cache_seconds=status_cache_seconds, timeout=timeout)
+        def _connect():
+            import gosundpy
+            return gosundpy.Gosund(username, password, access_id, access_key,
+                    status_cache_seconds=status_cache_seconds, timeout=timeout)
+        self._tuya = lazy_value(_connect)
+
+    @property
+    def tuya(self):
+        return self._tuya.get()
 
     def get_device(self, device_id, device_name, device_description):
-        device = self.tuya.get_device(device_id)
+        device = lazy_value(lambda: self.tuya.get_device(device_id))
         return TuyaDevice(device, device_name, device_description)
 
 class TuyaDevice(Device):
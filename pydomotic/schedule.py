@@ -0,0 +1,162 @@
+import datetime
+import heapq
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Schedule(object):
+
+    # index of components by minute of the week, so each run only checks the
+    # components which could possibly pass their time based triggers. each
+    # component's minutes are kept as one bitmap, components allowed to run
+    # at only a few minutes are also bucketed by minute
+
+    # most minutes a component is bucketed for, the rest are checked against
+    # their bitmap every run
+    max_bucketed_minutes = 32
+
+    def __init__(self, components):
+        self.components = components
+        self.time_sensor = None
+        self._always = []
+        self._minutes = {}
+        self._bitmaps = []
+        self._any_minute = 0
+        # components which read each sensor, so a changed reading only
+        # re-evaluates the components which depend on it
+        self._reads = {}
+        self._dependents = {}
+
+        for index, component in enumerate(components):
+            for trigger in getattr(component, 'ifs', []):
+                for sensor, method_name in getattr(
+                        trigger, 'sensor_reads', tuple)():
+                    key = (id(sensor), method_name)
+                    self._reads.setdefault(key, (sensor, method_name))
+                    dependents = self._dependents.setdefault(key, [])
+                    if index not in dependents:
+                        dependents.append(index)
+            minutes = self._component_minutes(component)
+            if minutes is None:
+                self._always.append(index)
+                continue
+            self._any_minute |= minutes
+            bucketed = _bitmap_bits(minutes, self.max_bucketed_minutes)
+            if bucketed is None:
+                self._bitmaps.append((index, minutes))
+                continue
+            for minute in bucketed:
+                self._minutes.setdefault(minute, []).append(index)
+
+        logger.debug(f'scheduled {len(components) - len(self._always)} of '
+                f'{len(components)} components by time')
+
+    def _component_minutes(self, component):
+        # components with else actions must run every time their triggers do
+        # not pass, and edge triggered components must see their triggers
+        # fail, so they cannot be skipped
+        if getattr(component, 'elses', None) or getattr(component, 'edge',
+                False):
+            return None
+        minutes = None
+        for trigger in getattr(component, 'ifs', []):
+            time_sensor = getattr(trigger, 'time_sensor', None)
+            if time_sensor is None:
+                continue
+            if self.time_sensor is None:
+                self.time_sensor = time_sensor
+            elif time_sensor is not self.time_sensor:
+                continue
+            trigger_minutes = trigger.minutes_of_week()
+            if trigger_minutes is None:
+                continue
+            if minutes is None:
+                minutes = trigger_minutes
+            else:
+                minutes &= trigger_minutes
+        return minutes
+
+    def candidates(self, now=None):
+        if not self._minutes and not self._bitmaps:
+            return [self.components[i] for i in self._always]
+        if now is None:
+            minute = self.time_sensor.get_current_tick().minute_of_week
+        else:
+            minute = _minute_of_week(now)
+        indexes = heapq.merge(self._always, self._minutes.get(minute, ()),
+                [i for i, minutes in self._bitmaps if minutes >> minute & 1])
+        return [self.components[i] for i in indexes]
+
+    def sensor_reads(self):
+        return list(self._reads.values())
+
+    def dependents(self, sensor, method_name):
+        indexes = self._dependents.get((id(sensor), method_name), ())
+        return [self.components[i] for i in indexes]
+
+    def next_run(self, now=None):
+        # earliest minute after now at which any component could pass its
+        # triggers, or None if none ever will. this is a lower bound, running
+        # at that minute may still find nothing to do
+        if now is None:
+            if self.time_sensor is None:
+                now = datetime.datetime.now().astimezone()
+            else:
+                now = self.time_sensor.get_current_datetime()
+        now = now.replace(second=0, microsecond=0)
+        next_runs = [self._next_always(self.components[i], now)
+                for i in self._always]
+        if self._any_minute:
+            next_runs.append(self._next_scheduled(now))
+        next_runs = [next_run for next_run in next_runs if next_run is not None]
+        return min(next_runs, default=None)
+
+    def _next_scheduled(self, now):
+        minute = _minute_of_week(now)
+        # any bit after the current minute, or else the first next week
+        later = self._any_minute >> (minute + 1)
+        if later:
+            minutes = (later & -later).bit_length()
+        else:
+            first = (self._any_minute & -self._any_minute).bit_length() - 1
+            minutes = first + _minutes_per_week - minute
+        return now + datetime.timedelta(minutes=minutes)
+
+    def _next_always(self, component, now):
+        if getattr(component, 'elses', None) or getattr(component, 'edge',
+                False):
+            return now + datetime.timedelta(minutes=1)
+        ifs = getattr(component, 'ifs', [])
+        clock = [trigger for trigger in ifs if getattr(trigger, 'clock', False)]
+        if clock:
+            # every clock trigger must pass, so the latest of their next fire
+            # times is the earliest the component can run
+            next_runs = []
+            for trigger in clock:
+                next_fire_time = getattr(trigger, 'next_fire_time', None)
+                if next_fire_time is None:
+                    return now + datetime.timedelta(minutes=1)
+                next_run = next_fire_time(now)
+                if next_run is None:
+                    return None
+                next_runs.append(next_run)
+            return max(next_runs)
+        minutes = min((getattr(trigger, 'poll_minutes', 1) for trigger in ifs),
+                default=1)
+        return now + datetime.timedelta(minutes=minutes)
+
+_minutes_per_week = 7 * 1440
+
+def _minute_of_week(now):
+    return 1440*(now.isoweekday() - 1) + 60*now.hour + now.minute
+
+def _bitmap_bits(bitmap, limit):
+    # the set bits of the bitmap, or None when there are more than limit
+    bits = []
+    while bitmap:
+        if len(bits) == limit:
+            return None
+        low = bitmap & -bitmap
+        bits.append(low.bit_length() - 1)
+        bitmap ^= low
+    return bits
@@ -1,20 +1,40 @@
 import astral
+import asyncio
 import astral.sun
 import datetime
+import logging
 import requests
+import threading
+import time
 import zoneinfo
 
-from .utils import cache_value, ObjectMetaclass
+from .utils import (cache_value, lazy_value, run_in_thread, AsyncMixin,
+        ObjectMetaclass)
 
-class _Sensor(metaclass=ObjectMetaclass):
-    pass
+logger = logging.getLogger(__name__)
+
+class _Sensor(AsyncMixin, metaclass=ObjectMetaclass):
+
+    # seconds between background polls and most calls allowed per hour, None
+    # when the sensor is not worth polling. sensors with the same rate limit
+    # key share one rate limit, None when it only applies to this sensor
+    poll_interval = None
+    rate_limit = None
+    rate_limit_key = None
 
 class AQISensor(_Sensor):
 
     aqi_url = 'https://www.airnowapi.org/aq/observation/latLong/current'
     timeout = 5 # seconds
 
-    def __init__(self, api_key, latitude, longitude):
+    # observations are hourly, airnow allows 500 requests per hour
+    poll_interval = 15 * 60
+    rate_limit = 500
+
+    def __init__(self, api_key, latitude, longitude, session=None,
+            cache_store=None):
+        self.session = session or requests
+        self.cache_store = cache_store
         self.location = (latitude, longitude)
         self.params = {
                 'latitude': latitude,
@@ -23,10 +43,15 @@ class AQISensor(_Sensor):
                 'format': 'application/json',
         }
 
+    @property
+    def cache_key(self):
+        return f'aqi:{self.location}'
+
     @cache_value(minutes=15, fallback_on_error=True)
     def get_aqi(self):
         try:
-            resp = requests.get(self.aqi_url, params=self.params, timeout=self.timeout)
+            resp = self.session.get(self.aqi_url, params=self.params,
+                    timeout=self.timeout)
             resp.raise_for_status()
             data = resp.json()
         except Exception as e:
@@ -54,21 +79,49 @@ class SunSensor(_Sensor):
 
     # TODO: test timezone
 
+    # number of days of sunrise/sunset times kept from the requested date, so
+    # cold starts only compute a few days
+    table_days = 4
+
     def __init__(self, latitude, longitude, time_sensor):
         self.observer = astral.Observer(latitude=latitude, longitude=longitude)
         self.time_sensor = time_sensor
-
-    @cache_value(hours=12)
-    def get_sunrise(self):
-        now = self.time_sensor.get_current_datetime()
-        return astral.sun.sunrise(self.observer, date=now,
-                tzinfo=self.time_sensor.tzinfo)
-
-    @cache_value(hours=12)
-    def get_sunset(self):
-        now = self.time_sensor.get_current_datetime()
-        return astral.sun.sunset(self.observer, date=now,
-                tzinfo=self.time_sensor.tzinfo)
+        self._table = {}
+
+    def get_sunrise(self, date=None):
+        return self._lookup(0, date)
+
+    def get_sunset(self, date=None):
+        return self._lookup(1, date)
+
+    def _lookup(self, index, date=None):
+        if date is None:
+            date = self.time_sensor.get_current_datetime().date()
+        times = self._table.get(date)
+        if times is None:
+            self._table = self._extend_table(date)
+            times = self._table[date]
+        if isinstance(times[index], Exception):
+            raise times[index]
+        return times[index]
+
+    def _extend_table(self, start):
+        # days already computed are reused and days before start are dropped
+        table = {}
+        tzinfo = self.time_sensor.tzinfo
+        for days in range(self.table_days):
+            date = start + datetime.timedelta(days=days)
+            table[date] = self._table.get(date) or tuple(
+                    self._compute(fn, date, tzinfo)
+                    for fn in (astral.sun.sunrise, astral.sun.sunset))
+        return table
+
+    def _compute(self, fn, date, tzinfo):
+        try:
+            return fn(self.observer, date=date, tzinfo=tzinfo)
+        except ValueError as e:
+            # sun does not rise or set on this day near the poles
+            return e
 
 class TimeSensor(_Sensor):
 
@@ -81,6 +134,7 @@ class TimeSensor(_Sensor):
         self.longitude = longitude
         self.timezone = timezone
         self._tzinfo = None
+        self._tick = None
 
     def _get_timezone(self):
         if self.timezone:
@@ -90,8 +144,25 @@ class TimeSensor(_Sensor):
                 lng=self.longitude, lat=self.latitude)
 
     def get_current_datetime(self):
+        if self._tick is not None:
+            return self._tick.datetime
         return datetime.datetime.now(tz=self.tzinfo)
 
+    def get_current_tick(self):
+        if self._tick is not None:
+            return self._tick
+        return Tick(self.get_current_datetime())
+
+    def freeze(self, now=None):
+        # every trigger checked while frozen sees the same minute, even when
+        # a run crosses a minute boundary
+        self._tick = None
+        self._tick = Tick(now or self.get_current_datetime())
+        return self._tick
+
+    def unfreeze(self):
+        self._tick = None
+
     @property
     def tzinfo(self):
         # TODO: test
@@ -103,16 +174,45 @@ class TimeSensor(_Sensor):
                 self._tzinfo = datetime.timezone.utc
         return self._tzinfo
 
+class Tick(object):
+
+    __slots__ = ('datetime', 'date', 'isoweekday', 'minute_of_day',
+            'minute_of_week')
+
+    def __init__(self, now):
+        self.datetime = now
+        self.date = now.date()
+        self.isoweekday = now.isoweekday()
+        self.minute_of_day = 60*now.hour + now.minute
+        self.minute_of_week = 1440*(self.isoweekday - 1) + self.minute_of_day
+
 class WeatherSensor(_Sensor):
 
-    def __init__(self, api_key, latitude, longitude, data_cache_seconds=None):
-        import pyowm
-        self.owm_mgr = pyowm.OWM(api_key).weather_manager()
+    # openweathermap updates every 10 minutes, free accounts allow 60 requests
+    # per minute
+    poll_interval = 10 * 60
+    rate_limit = 3600
+
+    def __init__(self, api_key, latitude, longitude, data_cache_seconds=None,
+            cache_store=None):
+        def _connect():
+            import pyowm
+            return pyowm.OWM(api_key).weather_manager()
+        self._owm_mgr = lazy_value(_connect)
         self.location = (latitude, longitude)
+        self.cache_store = cache_store
 
         if data_cache_seconds is not None:
             self._weather = cache_value(seconds=data_cache_seconds)(self._weather)
 
+    @property
+    def cache_key(self):
+        return f'weather:{self.location}'
+
+    @property
+    def owm_mgr(self):
+        return self._owm_mgr.get()
+
     def _weather(self):
         return self.owm_mgr.weather_at_coords(*self.location).weather
 
@@ -130,6 +230,9 @@ class WeatherSensor(_Sensor):
 class WebhookSensor(_Sensor):
 
     def __init__(self):
+        self.reset()
+
+    def reset(self):
         self.path = None
         self.method = None
 
@@ -156,3 +259,98 @@ class DeviceSensor(_Sensor):
     @property
     def name(self):
         return f'{super().name} {self.device.name}'
+
+    @property
+    def poll_interval(self):
+        return getattr(self.device, 'poll_interval', None)
+
+    @property
+    def rate_limit(self):
+        return getattr(self.device, 'rate_limit', None)
+
+    @property
+    def rate_limit_key(self):
+        return getattr(self.device, 'rate_limit_key', None)
+
+class SensorReadings(object):
+
+    # snapshot of sensor values for a single run of all components, reads
+    # which were not prefetched or failed to prefetch are made live. values
+    # pushed by a background poller are kept between runs until they expire
+
+    def __init__(self):
+        self._values = {}
+        self._polled = {}
+        self._lock = threading.Lock()
+
+    def read(self, sensor, method_name):
+        key = (id(sensor), method_name)
+        with self._lock:
+            if key in self._values:
+                return self._values[key][1]
+            if self._is_polled(key):
+                # keep the value for the rest of the run even if a newer one
+                # is pushed meanwhile
+                self._values[key] = self._polled[key][:2]
+                return self._values[key][1]
+        return getattr(sensor, method_name)()
+
+    def push(self, sensor, method_name, value, max_age=None):
+        # returns whether the value differs from the last one pushed
+        key = (id(sensor), method_name)
+        expires = None if max_age is None else time.monotonic() + max_age
+        with self._lock:
+            previous = self._polled.get(key)
+            self._polled[key] = (sensor, value, expires)
+        return previous is None or previous[1] != value
+
+    def _is_polled(self, key):
+        polled = self._polled.get(key)
+        return polled is not None and (
+                polled[2] is None or polled[2] > time.monotonic())
+
+    def prefetch(self, reads, executor=None):
+        reads = self._missing(reads)
+        if len(reads) > 1 and executor is None:
+            import concurrent.futures
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=len(reads),
+                    thread_name_prefix='pydomotic-prefetch') as executor:
+                return self.prefetch(reads, executor=executor)
+        if executor is None:
+            for sensor, method_name in reads:
+                self._fetch(sensor, method_name)
+        else:
+            futures = [executor.submit(self._fetch, sensor, method_name)
+                    for sensor, method_name in reads]
+            for future in futures:
+                future.result()
+
+    async def prefetch_async(self, reads):
+        reads = self._missing(reads)
+        await asyncio.gather(*(run_in_thread(self._fetch, sensor, method_name)
+            for sensor, method_name in reads))
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def _missing(self, reads):
+        missing = {}
+        with self._lock:
+            for sensor, method_name in reads:
+                key = (id(sensor), method_name)
+                if key not in self._values and not self._is_polled(key):
+                    missing[key] = (sensor, method_name)
+        return list(missing.values())
+
+    def _fetch(self, sensor, method_name):
+        try:
+            value = getattr(sensor, method_name)()
+        except Exception as e:
+            logger.debug(f'failed to prefetch {method_name}, ignoring: '
+                    f'[{e.__class__.__name__}] {e}')
+            return
+        with self._lock:
+            # hold a reference to the sensor so its id cannot be reused
+            self._values[(id(sensor), method_name)] = (sensor, value)
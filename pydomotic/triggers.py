@@ -4,26 +4,70 @@ import croniter
 import inspect
 import random
 
-from .utils import ObjectMetaclass
+from .utils import ObjectMetaclass, run_in_thread
 
 class _Trigger(metaclass=ObjectMetaclass):
 
+    # local triggers only depend on the clock or incoming request and are
+    # cheap enough to check more than once per run
+    local = False
+    readings = None
+
+    # clock triggers only depend on the time, so they can be checked for any
+    # past minute when catching up on missed runs
+    clock = False
+
+    # rough relative cost of a single check, cheaper triggers are checked first
+    cost = 1
+
+    # how often a sensor driven trigger is worth checking when nothing else
+    # wakes the handler
+    poll_minutes = 1
+
     @abc.abstractmethod
     def check(self):
         pass
 
+    def sensor_reads(self):
+        return ()
+
+    def minutes_of_week(self):
+        # bitmap of the minutes of the week this trigger can pass, or None
+        # when unknown
+        return None
+
+    def _read(self, sensor, method_name):
+        if self.readings is None:
+            return getattr(sensor, method_name)()
+        return self.readings.read(sensor, method_name)
+
+    async def check_async(self):
+        return await run_in_thread(self.check)
+
 class AQITrigger(_Trigger):
 
-    def __init__(self, check_func, aqi_sensor):
+    cost = 10
+
+    # readings are cached for 15 minutes, checking sooner sees the same value
+    poll_minutes = 15
+
+    def __init__(self, check_func, aqi_sensor, readings=None):
         self.check_func = check_func
         self.aqi_sensor = aqi_sensor
+        self.readings = readings
+
+    def sensor_reads(self):
+        return ((self.aqi_sensor, 'get_aqi'),)
 
     def check(self):
-        aqi = self.aqi_sensor.get_aqi()
+        aqi = self._read(self.aqi_sensor, 'get_aqi')
         return self.check_func(aqi)
 
 class IsoWeekdayTrigger(_Trigger):
 
+    local = True
+    clock = True
+
     # TODO: test timezone
 
     def __init__(self, isoweekdays, time_sensor):
@@ -31,47 +75,151 @@ class IsoWeekdayTrigger(_Trigger):
         self.time_sensor = time_sensor
 
     def check(self):
-        now = self.time_sensor.get_current_datetime()
-        return now.isoweekday() in self.isoweekdays
+        tick = self.time_sensor.get_current_tick()
+        return tick.isoweekday in self.isoweekdays
+
+    def minutes_of_week(self):
+        return _minutes_of_week(self.isoweekdays, _all_day)
 
 class TimeTrigger(_Trigger):
 
+    local = True
+    clock = True
+
     # TODO: test timezone
 
     def __init__(self, times, time_sensor):
-        self.times = times
+        self._times = _bitmap(times, size=_minutes_per_day)
         self.time_sensor = time_sensor
 
+    @property
+    def times(self):
+        return _bitmap_values(self._times)
+
     def check(self):
-        now = self.time_sensor.get_current_datetime()
-        now_minutes = 60*now.hour + now.minute
-        for minutes in self.times:
-            if minutes == now_minutes:
-                return True
-        return False
+        tick = self.time_sensor.get_current_tick()
+        return bool(self._times >> tick.minute_of_day & 1)
+
+    def minutes_of_week(self):
+        return _minutes_of_week(range(1, 8), self._times)
 
 class DateTrigger(_Trigger):
 
+    local = True
+    clock = True
+
     def __init__(self, dates, time_sensor):
         self.dates = dates
         self.time_sensor = time_sensor
 
     def check(self):
-        today = self.time_sensor.get_current_datetime().date()
-        for date in self.dates:
-            if date == today:
-                return True
-        return False
+        return self.time_sensor.get_current_tick().date in self.dates
+
+    def minutes_of_week(self):
+        isoweekdays = {date.isoweekday() for date in self.dates}
+        return _minutes_of_week(isoweekdays, _all_day)
 
 class CronTrigger(_Trigger):
 
+    local = True
+    clock = True
+
     def __init__(self, cron, time_sensor):
         self.cron = cron
         self.time_sensor = time_sensor
+        self._fields = _compile_cron(cron)
 
     def check(self):
-        now = self.time_sensor.get_current_datetime()
-        return croniter.croniter.match(self.cron, now)
+        now = self.time_sensor.get_current_tick().datetime
+        if self._fields is None:
+            return croniter.croniter.match(self.cron, now)
+        return _match_cron(self._fields, now)
+
+    def next_fire_time(self, now=None):
+        # first matching minute after now, or None if there is none
+        if now is None:
+            now = self.time_sensor.get_current_datetime()
+        if self._fields is None:
+            return croniter.croniter(self.cron, now).get_next(
+                    datetime.datetime)
+
+        minutes, hours = self._fields[:2]
+        start = now.replace(second=0, microsecond=0) + datetime.timedelta(
+                minutes=1)
+        date = start.date()
+        # five years covers every combination of weekday and leap day
+        for _ in range(5 * 366):
+            if _day_matches(self._fields, date):
+                first = date == start.date()
+                for hour in range(start.hour if first else 0, 24):
+                    if not hours >> hour & 1:
+                        continue
+                    from_minute = start.minute if (
+                            first and hour == start.hour) else 0
+                    minute = _next_bit(minutes, from_minute)
+                    if minute is not None:
+                        return datetime.datetime.combine(date,
+                                datetime.time(hour, minute),
+                                tzinfo=now.tzinfo)
+            date += datetime.timedelta(days=1)
+        return None
+
+    def minutes_of_week(self):
+        if self._fields is None:
+            return None
+        minutes, hours, _, _, weekdays, day_or = self._fields
+        if day_or:
+            isoweekdays = range(1, 8)
+        else:
+            isoweekdays = [isoweekday for isoweekday in range(1, 8)
+                    if weekdays >> isoweekday % 7 & 1]
+        day = 0
+        for hour in _bitmap_values(hours):
+            day |= minutes << 60*hour
+        return _minutes_of_week(isoweekdays, day)
+
+def _compile_cron(cron):
+    # compile standard five field cron expressions into a bitmap per field,
+    # anything else is left to croniter
+    try:
+        fields, nth_weekdays = croniter.croniter.expand(cron)
+    except Exception:
+        return None
+    if len(fields) != 5 or nth_weekdays:
+        return None
+    bitmaps = []
+    for field, (low, high) in zip(fields, _cron_field_ranges):
+        if field == ['*']:
+            bitmaps.append(_bitmap(range(low, high + 1)))
+        elif all(isinstance(value, int) for value in field):
+            bitmaps.append(_bitmap(value % 7 if high == 6 else value
+                for value in field))
+        else:
+            return None
+    # day of month and day of week are or-ed together when both are set
+    day_or = fields[2] != ['*'] and fields[4] != ['*']
+    return (*bitmaps, day_or)
+
+_cron_field_ranges = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+def _match_cron(fields, now):
+    minutes, hours, _, _, _, _ = fields
+    return bool(minutes >> now.minute & 1 and hours >> now.hour & 1 and
+            _day_matches(fields, now))
+
+def _day_matches(fields, date):
+    _, _, days, months, weekdays, day_or = fields
+    if not months >> date.month & 1:
+        return False
+    day = days >> date.day & 1
+    weekday = weekdays >> date.isoweekday() % 7 & 1
+    return bool(day or weekday) if day_or else bool(day and weekday)
+
+def _next_bit(bitmap, start):
+    bitmap >>= start
+    if not bitmap:
+        return None
+    return start + (bitmap & -bitmap).bit_length() - 1
 
 class RandomTrigger(_Trigger):
 
@@ -83,8 +231,15 @@ class RandomTrigger(_Trigger):
 
 class _SunTrigger(_Trigger):
 
+    local = True
+    clock = True
+    cost = 2
+
     def __init__(self, timedeltas, time_sensor, sun_sensor):
-        self.timedeltas = timedeltas
+        # offsets are always less than a day from the sun time, so they fit
+        # in a bitmap centered on zero
+        self._timedeltas = _bitmap(timedeltas, offset=_minutes_per_day,
+                size=2*_minutes_per_day)
         self.time_sensor = time_sensor
         self.sun_sensor = sun_sensor
         self.sun_sensor_method = getattr(self.sun_sensor,
@@ -93,9 +248,36 @@ class _SunTrigger(_Trigger):
     def check(self):
         sun_time = self.sun_sensor_method()
         sun_minutes = 60*sun_time.hour + sun_time.minute
-        now = self.time_sensor.get_current_datetime()
-        now_minutes = 60*now.hour + now.minute
-        return now_minutes - sun_minutes in self.timedeltas
+        tick = self.time_sensor.get_current_tick()
+        delta = tick.minute_of_day - sun_minutes
+        return bool(self._timedeltas >> (delta + _minutes_per_day) & 1)
+
+    @property
+    def timedeltas(self):
+        return _bitmap_values(self._timedeltas, offset=_minutes_per_day)
+
+    def next_fire_time(self, now=None):
+        # first minute after now, or None if the sun does not rise or set
+        if now is None:
+            now = self.time_sensor.get_current_tick().datetime
+        now = now.astimezone(self.time_sensor.tzinfo).replace(second=0,
+                microsecond=0)
+        for days in range(3):
+            date = now.date() + datetime.timedelta(days=days)
+            try:
+                sun_time = self.sun_sensor_method(date=date)
+            except ValueError:
+                continue
+            sun_minutes = 60*sun_time.hour + sun_time.minute
+            for delta in self.timedeltas:
+                minutes = sun_minutes + delta
+                if not 0 <= minutes < _minutes_per_day:
+                    continue
+                fire_time = datetime.datetime.combine(date, datetime.time(
+                    minutes // 60, minutes % 60), tzinfo=now.tzinfo)
+                if fire_time > now:
+                    return fire_time
+        return None
 
 class SunriseTrigger(_SunTrigger):
 
@@ -107,26 +289,40 @@ class SunsetTrigger(_SunTrigger):
 
 class TemperatureTrigger(_Trigger):
 
-    def __init__(self, check_func, weather_sensor):
+    cost = 10
+
+    def __init__(self, check_func, weather_sensor, readings=None):
         self.check_func = check_func
         self.weather_sensor = weather_sensor
+        self.readings = readings
+
+    def sensor_reads(self):
+        return ((self.weather_sensor, 'current_temperature'),)
 
     def check(self):
-        temp = self.weather_sensor.current_temperature()
+        temp = self._read(self.weather_sensor, 'current_temperature')
         return self.check_func(temp)
 
 class RadonTrigger(_Trigger):
 
-    def __init__(self, check_func, radon_sensor):
+    cost = 10
+
+    def __init__(self, check_func, radon_sensor, readings=None):
         self.check_func = check_func
         self.radon_sensor = radon_sensor
+        self.readings = readings
+
+    def sensor_reads(self):
+        return ((self.radon_sensor, 'current_radon'),)
 
     def check(self):
-        radon = self.radon_sensor.current_radon()
+        radon = self._read(self.radon_sensor, 'current_radon')
         return self.check_func(radon)
 
 class WebhookTrigger(_Trigger):
 
+    local = True
+
     # TODO: test webhook trigger
 
     def __init__(self, path, webhook_sensor):
@@ -136,3 +332,28 @@ class WebhookTrigger(_Trigger):
     def check(self):
         return self.webhook_sensor.path == self.path and \
                 self.webhook_sensor.method == 'POST'
+
+_minutes_per_day = 24 * 60
+
+_all_day = (1 << _minutes_per_day) - 1
+
+def _minutes_of_week(isoweekdays, day):
+    # bitmap of the minutes of the week, the day bitmap of minutes is repeated
+    # for each of the given days
+    week = 0
+    for isoweekday in set(isoweekdays):
+        week |= day << _minutes_per_day*(isoweekday - 1)
+    return week
+
+def _bitmap(values, offset=0, size=None):
+    # values outside of size can never match so are dropped
+    bitmap = 0
+    for value in values:
+        bit = value + offset
+        if bit >= 0 and (size is None or bit < size):
+            bitmap |= 1 << bit
+    return bitmap
+
+def _bitmap_values(bitmap, offset=0):
+    return [bit - offset for bit in range(bitmap.bit_length())
+            if bitmap >> bit & 1]
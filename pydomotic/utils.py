@@ -1,9 +1,20 @@
 import abc
+import asyncio
+import collections
+import contextlib
 import functools
 import importlib
 import logging
+import os
+import pickle
 import re
+import requests
+import requests.adapters
+import sqlite3
+import stat
+import threading
 import time
+import urllib3
 
 from .exceptions import PyDomoticMethodImportError
 
@@ -11,38 +22,245 @@ logger = logging.getLogger(__name__)
 
 class _timed_cache(object):
 
-    def __init__(self):
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
         self.reset()
 
-    def set(self, last_call, value):
-        self.last_call = last_call
-        self.value = value
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, last_call, value):
+        with self.lock:
+            self.entries[key] = (last_call, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                evicted, _ = self.entries.popitem(last=False)
+                self.key_locks.pop(evicted, None)
+
+    def key_lock(self, key):
+        # concurrent callers for the same key wait on a single call instead
+        # of each calling the api
+        with self.lock:
+            lock = self.key_locks.get(key)
+            if lock is None:
+                lock = self.key_locks[key] = threading.Lock()
+            return lock
 
     def reset(self):
-        self.last_call = 0
-        self.value = None
+        with self.lock:
+            self.entries = collections.OrderedDict()
+            self.key_locks = {}
+
+_kwargs_mark = object()
+def _cache_key(args, kwargs):
+    key = args
+    if kwargs:
+        key += (_kwargs_mark,) + tuple(sorted(kwargs.items()))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
 
-def cache_value(hours=0, minutes=0, seconds=0, fallback_on_error=False):
-    # XXX: cache stored per class rather than per instance
+def _cache_store_key(owner, fn, args, kwargs):
+    # values are only persisted for objects with a cache_store and a cache_key
+    # which is the same between processes
+    if owner is None:
+        if not args:
+            return None, None
+        owner, args = args[0], args[1:]
+    store = getattr(owner, 'cache_store', None)
+    prefix = getattr(owner, 'cache_key', None)
+    if store is None or prefix is None:
+        return None, None
+    return store, f'{prefix}:{fn.__name__}:{args!r}:{sorted(kwargs.items())!r}'
+
+def cache_value(hours=0, minutes=0, seconds=0, fallback_on_error=False,
+        maxsize=128):
+    # values are keyed on all arguments, including self, so each instance and
+    # each set of arguments are cached separately
     seconds += 60 * 60 * hours + 60 * minutes
-    cache = _timed_cache()
+    cache = _timed_cache(maxsize)
     def _rate_limit(fn):
+        owner = getattr(fn, '__self__', None)
         @functools.wraps(fn)
         def _call(*args, **kwargs):
+            key = _cache_key(args, kwargs)
+            if key is None:
+                return fn(*args, **kwargs)
+            entry = cache.get(key)
+            if entry is not None and time.time() - entry[0] < seconds:
+                return entry[1]
+            with cache.key_lock(key):
+                return _load(key, args, kwargs)
+        def _load(key, args, kwargs):
+            # the value may have been loaded while waiting for the lock
             now = time.time()
-            if now - cache.last_call < seconds:
-                return cache.value
+            entry = cache.get(key)
+            if entry is not None and now - entry[0] < seconds:
+                return entry[1]
+            store, store_key = _cache_store_key(owner, fn, args, kwargs)
+            if store is not None:
+                stored = store.get(store_key)
+                if stored is not None and (entry is None or stored[0] > entry[0]):
+                    entry = stored
+                    cache.set(key, *entry)
+                    if now - entry[0] < seconds:
+                        return entry[1]
             try:
-                cache.set(now, fn(*args, **kwargs))
+                value = fn(*args, **kwargs)
             except Exception as e:
-                if not fallback_on_error or cache.last_call == 0:
+                if not fallback_on_error or entry is None:
                     raise e
                 logger.info(f'falling back to cached value: [{e.__class__.__name__}] {e}')
-            return cache.value
+                return entry[1]
+            cache.set(key, now, value)
+            if store is not None:
+                store.set(store_key, now, value)
+            return value
         _call.clear_cache = cache.reset
         return _call
     return _rate_limit
 
+def private_directory(directory):
+    # creates the directory for the current user only, returning False when
+    # it already exists and others can access it or it is not a directory
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if not hasattr(os, 'getuid'):
+        return True
+    st = os.lstat(directory)
+    return (stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and
+            not st.st_mode & 0o077)
+
+class FileCacheStore(object):
+
+    # sqlite database of cached values shared between processes, so that short
+    # lived processes like cron jobs can reuse each other's api responses
+
+    filename = 'pydomotic-cache.sqlite3'
+    timeout = 5  # seconds
+
+    def __init__(self, directory):
+        # cached values are unpickled, so only trust a directory no other user
+        # can write to
+        if not private_directory(directory):
+            raise PermissionError(f'directory {directory} is not private to '
+                    'the current user')
+        self.path = os.path.join(directory, self.filename)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache ('
+                    'key TEXT PRIMARY KEY, '
+                    'stored_at REAL NOT NULL, '
+                    'value BLOB NOT NULL)')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                        'SELECT stored_at, value FROM cache WHERE key = ?',
+                        (key,)).fetchone()
+            if row is None:
+                return None
+            return row[0], pickle.loads(row[1])
+        except Exception as e:
+            logger.debug(f'failed to read cache file, ignoring: '
+                    f'[{e.__class__.__name__}] {e}')
+            return None
+
+    def set(self, key, stored_at, value):
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            with self._connect() as conn:
+                conn.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?)',
+                        (key, stored_at, data))
+        except Exception as e:
+            logger.debug(f'failed to write cache file, ignoring: '
+                    f'[{e.__class__.__name__}] {e}')
+
+class lazy_value(object):
+
+    def __init__(self, load):
+        self._load = load
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._value = None
+
+    def get(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._value = self._load()
+                    self._loaded = True
+        return self._value
+
+class HTTPSession(requests.Session):
+
+    retry_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, pool_size=10, retries=0, backoff_seconds=0,
+            timeout=None):
+        super().__init__()
+        self.timeout = timeout
+        adapter = requests.adapters.HTTPAdapter(
+                pool_connections=pool_size,
+                pool_maxsize=pool_size,
+                max_retries=urllib3.util.Retry(
+                    total=retries,
+                    backoff_factor=backoff_seconds,
+                    status_forcelist=self.retry_statuses,
+                    raise_on_status=False,
+                ),
+        )
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().request(method, url, **kwargs)
+
+async def run_in_thread(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+            None, functools.partial(fn, *args, **kwargs))
+
+class _async_proxy(object):
+
+    def __init__(self, obj):
+        self._obj = obj
+
+    def __getattr__(self, attr):
+        method = getattr(self._obj, attr)
+        if not callable(method):
+            raise AttributeError(f'{attr} is not callable')
+        @functools.wraps(method)
+        async def _call(*args, **kwargs):
+            return await run_in_thread(method, *args, **kwargs)
+        return _call
+
+class AsyncMixin(object):
+
+    @property
+    def aio(self):
+        # awaitable versions of every method, run on the event loop's executor
+        # since the underlying 3rd party libraries are all blocking
+        return _async_proxy(self)
+
 _camel_to_snake_re_1 = re.compile('(.)([A-Z][a-z]+)')
 _camel_to_snake_re_2 = re.compile('([a-z0-9])([A-Z])')
 def _camel_to_snake(name):
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import pytest
 
@@ -128,3 +129,134 @@ def test_components_logging(caplog, mock_true_trigger, mock_false_trigger,
         assert logger == 'pydomotic.components', 'wrong logger found'
         assert level == logging.DEBUG, 'wrong level found'
         assert message == exp_log, 'wrong message found'
+
+@pytest.mark.parametrize('passes', (True, False))
+def test_component_run_async(mock_true_trigger, mock_false_trigger,
+        mock_action_1, mock_action_2, passes):
+    comp = Component(
+            name='unknown',
+            ifs=[mock_true_trigger if passes else mock_false_trigger,
+                mock_true_trigger],
+            thens=[mock_action_1],
+            elses=[mock_action_2],
+    )
+    asyncio.run(comp.run_async())
+    assert mock_true_trigger.check_called is passes, (
+            'wrong true trigger.check')
+    assert mock_action_1.run_called is passes, 'wrong then action.run'
+    assert mock_action_2.run_called is not passes, 'wrong else action.run'
+
+def test_component_run_async_checks_cheap_triggers_first(mock_true_trigger,
+        mock_false_trigger, mock_action_1, mock_action_2):
+    mock_true_trigger.cost = 10
+    mock_false_trigger.local = True
+    comp = Component(
+            name='unknown',
+            ifs=[mock_true_trigger, mock_false_trigger],
+            thens=[mock_action_1],
+            elses=[mock_action_2],
+    )
+    asyncio.run(comp.run_async())
+    assert comp.ifs == [mock_false_trigger, mock_true_trigger], (
+            'cheaper trigger should be checked first')
+
+    mock_true_trigger.check_called = False
+    asyncio.run(comp.run_async())
+    assert mock_false_trigger.check_called, 'false trigger.check not called'
+    assert not mock_true_trigger.check_called, 'true trigger.check called'
+    assert mock_action_2.run_called, 'else action.run not called'
+
+def test_component_run_async_actions_in_order(mock_true_trigger):
+    order = []
+    class _SlowAction(object):
+        def __init__(self, name):
+            self.name = name
+        async def run_async(self):
+            order.append(('start', self.name))
+            await asyncio.sleep(0.01)
+            order.append(('end', self.name))
+    actions = [_SlowAction(f'action {i}') for i in range(3)]
+    comp = Component(
+            name='unknown',
+            ifs=[mock_true_trigger],
+            thens=actions,
+            elses=[],
+    )
+    asyncio.run(comp.run_async())
+    assert order == [(event, action.name)
+            for action in actions for event in ('start', 'end')], (
+            'actions should run one after another')
+
+def test_component_run_async_raises(mock_true_trigger, mock_raising_action,
+        mock_action_1):
+    comp = Component(
+            name='unknown',
+            ifs=[mock_true_trigger],
+            thens=[mock_raising_action, mock_action_1],
+            elses=[],
+    )
+    with pytest.raises(AssertionError):
+        asyncio.run(comp.run_async())
+    assert mock_raising_action.run_called, 'raising action.run not called'
+    assert mock_action_1.run_called, 'action.run not called'
+
+def test_component_sorts_triggers(mock_true_trigger, mock_false_trigger,
+        mock_action_1, mock_action_2):
+    comp = Component(
+            name='unknown',
+            ifs=[mock_true_trigger, mock_false_trigger],
+            thens=[mock_action_1],
+            elses=[mock_action_2],
+    )
+    comp.run()
+    assert comp.ifs == [mock_false_trigger, mock_true_trigger], (
+            'failing trigger should be checked first')
+
+    mock_true_trigger.check_called = False
+    comp.run()
+    assert not mock_true_trigger.check_called, 'true trigger.check called'
+    assert mock_action_2.run_called, 'else action.run not called'
+
+def test_component_sorts_triggers_by_cost(mock_true_trigger,
+        mock_false_trigger, mock_action_1, mock_action_2):
+    mock_false_trigger.cost = 10
+    comp = Component(
+            name='unknown',
+            ifs=[mock_false_trigger, mock_true_trigger],
+            thens=[mock_action_1],
+            elses=[mock_action_2],
+    )
+    comp.run()
+    assert comp.ifs == [mock_true_trigger, mock_false_trigger], (
+            'cheaper trigger should be checked first')
+
+@pytest.mark.parametrize('run', ('run', 'run_async'))
+def test_component_edge(run, mock_true_trigger, mock_action_1,
+        mock_action_2):
+    comp = Component('edge', [mock_true_trigger], [mock_action_1],
+            [mock_action_2], edge=True)
+    def _run(passes):
+        mock_true_trigger.returns = passes
+        mock_action_1.run_called = mock_action_2.run_called = False
+        if run == 'run':
+            comp.run()
+        else:
+            asyncio.run(comp.run_async())
+        return mock_action_1.run_called, mock_action_2.run_called
+
+    assert _run(True) == (True, False), 'first check should run actions'
+    assert _run(True) == (False, False), 'unchanged triggers ran actions'
+    assert _run(False) == (False, True), 'else actions not run on change'
+    assert _run(False) == (False, False), 'unchanged triggers ran actions'
+    assert _run(True) == (True, False), 'then actions not run on change'
+
+def test_component_edge_failure(mock_true_trigger, mock_action_1):
+    comp = Component('edge', [mock_true_trigger], [mock_action_1], [],
+            edge=True)
+    mock_action_1.raises = True
+    with pytest.raises(AssertionError):
+        comp.run()
+    mock_action_1.raises = False
+    mock_action_1.run_called = False
+    comp.run()
+    assert mock_action_1.run_called, 'failed actions should be retried'
@@ -4,6 +4,7 @@ import random
 import zoneinfo
 
 from pydomotic.providers.airthings import AirthingsAPI
+from pydomotic.sensors import Tick
 from pydomotic.utils import ObjectMetaclass
 
 class _MockDevice(object):
@@ -35,21 +36,39 @@ def mock_devices():
     return _MockDevice(), _MockDevice(), _MockDevice()
 
 @pytest.fixture
-def patch_s3(monkeypatch):
-    def patch(exception, body):
+def patch_s3(monkeypatch, tmp_path):
+    monkeypatch.setattr('pydomotic.parsers._s3_reader.cache_directory',
+            str(tmp_path))
+    def patch(exception, body, etag=None):
         class _response(dict):
             def __getitem__(self, key):
                 return self
             def read(self):
-                return body
+                return _MockS3.body
         class _MockS3(object):
+            calls = []
             def __init__(self, service_name):
                 pass
-            def get_object(self, Bucket=None, Key=None):
+            def head_object(self, Bucket=None, Key=None):
+                return {'ETag': _MockS3.etag}
+            def get_object(self, Bucket=None, Key=None, IfNoneMatch=None):
+                _MockS3.calls.append(IfNoneMatch)
                 if exception:
                     raise exception
-                return _response()
+                if IfNoneMatch is not None and IfNoneMatch == _MockS3.etag:
+                    from botocore.exceptions import ClientError
+                    raise ClientError({
+                        'Error': {'Code': '304', 'Message': 'Not Modified'},
+                        'ResponseMetadata': {'HTTPStatusCode': 304},
+                    }, 'GetObject')
+                response = _response()
+                if _MockS3.etag:
+                    response['ETag'] = _MockS3.etag
+                return response
+        _MockS3.body = body
+        _MockS3.etag = etag
         monkeypatch.setattr('boto3.client', _MockS3)
+        return _MockS3
     return patch
 
 class _MockTrigger(metaclass=ObjectMetaclass):
@@ -144,6 +163,8 @@ class _MockTimeSensor(object):
     test_datetime = None
     def get_current_datetime(self):
         return self.test_datetime
+    def get_current_tick(self):
+        return Tick(self.test_datetime)
 
 @ pytest.fixture
 def test_tzinfo():
@@ -174,12 +195,16 @@ class _MockSunSensor(object):
         self.get_sunset_called = False
         self.sunrise = None
         self.sunset = None
-    def get_sunrise(self):
+    def get_sunrise(self, date=None):
         self.get_sunrise_called = True
-        return self.sunrise
-    def get_sunset(self):
+        return self._on_date(self.sunrise, date)
+    def get_sunset(self, date=None):
         self.get_sunset_called = True
-        return self.sunset
+        return self._on_date(self.sunset, date)
+    def _on_date(self, sun_time, date):
+        if date is None:
+            return sun_time
+        return datetime.datetime.combine(date, sun_time.timetz())
 
 @pytest.fixture
 def mock_sun_sensor():
@@ -307,6 +332,7 @@ class _MockAirthings(object):
         self.device = self._MockDevice()
         self.cache_secs = None
         self.timeout = None
+        self.location_id = None
     class _MockDevice(AirthingsAPI.device):
         name = 'device_name'
         radon = 123
@@ -320,19 +346,22 @@ class _MockAirthings(object):
             }
         def fetch_data(self):
             return self.data
-    def __call__(self, client_id, client_secret, data_cache_seconds=None, timeout=None):
+    def __call__(self, client_id, client_secret, data_cache_seconds=None,
+            timeout=None, location_id=None, session=None, cache_store=None):
         class _MockAirthingsProvider(object):
             device = self.device
             def __init__(sf, client_id, client_secret, data_cache_seconds=None,
-                    timeout=None):
+                    timeout=None, location_id=None):
                 self.client_id = client_id
                 self.client_secret = client_secret
                 self.cache_secs = data_cache_seconds
                 self.timeout = timeout
+                self.location_id = location_id
             def get_device(sf, device_id):
                 return sf.device
         self.provider = _MockAirthingsProvider(client_id, client_secret,
-                data_cache_seconds=data_cache_seconds, timeout=timeout)
+                data_cache_seconds=data_cache_seconds, timeout=timeout,
+                location_id=location_id)
         return self.provider
 
 @pytest.fixture
@@ -392,6 +421,7 @@ class _MockEcobee(object):
     def __init__(self):
         self.app_key = None
         self.refresh_token = None
+        self.cache_secs = None
         self.device_id = None
         self.device = self.device()
     class device(object):
@@ -408,15 +438,18 @@ class _MockEcobee(object):
         def get_temperature(self):
             self.get_temperature_called = True
             return self.temperature
-    def __call__(self, app_key, refresh_token):
+    def __call__(self, app_key, refresh_token, data_cache_seconds=None,
+            session=None, cache_store=None):
         class _MockEcobeeProvider(object):
             device = self.device
-            def __init__(sf, app_key, refresh_token):
+            def __init__(sf, app_key, refresh_token, data_cache_seconds=None):
                 self.app_key = app_key
                 self.refresh_token = refresh_token
+                self.cache_secs = data_cache_seconds
             def get_device(sf, device_id):
                 return sf.device
-        self.provider = _MockEcobeeProvider(app_key, refresh_token)
+        self.provider = _MockEcobeeProvider(app_key, refresh_token,
+                data_cache_seconds=data_cache_seconds)
         return self.provider
 
 @pytest.fixture
@@ -383,3 +383,23 @@ def test_context_weather_sensor_data_cache_seconds(yaml_str, wrapped):
     weather = context.sensors['weather_sensor']._weather
     assert hasattr(weather, '__wrapped__') is wrapped, 'incorrect wrapping'
     assert hasattr(weather, 'clear_cache') is wrapped, 'incorrect wrapping'
+
+def test_context_copy(mock_device):
+    context = Context.from_yaml({'timezone': 'America/Los_Angeles'})
+    context.devices = {'device': mock_device}
+    sensor = context.device_sensor('device')
+    time_sensor = context.time_sensor
+
+    copied = context.copy()
+    assert copied.time_sensor is time_sensor, (
+            'time sensor should be shared')
+    assert copied.readings is context.readings, 'readings should be shared'
+    assert copied.device_sensor('device') is sensor, (
+            'device sensors should be copied')
+
+    copied.devices = {}
+    copied.reset_devices()
+    assert context.devices == {'device': mock_device}, (
+            'original devices should not change')
+    assert context.device_sensor('device') is sensor, (
+            'original device sensors should not change')
@@ -1,6 +1,19 @@
+import asyncio
+import datetime
+import os
 import pytest
 
-from pydomotic.handlers import Handler, LambdaHandler, PyDomoticComponentRunError
+from pydomotic.actions import TurnOnAction, TurnOffAction, ExecuteCodeAction
+from pydomotic.components import Component
+from pydomotic.handlers import (AsyncHandler, Handler, LambdaHandler, CommandLineHandler,
+        PyDomoticComponentRunError, _component_sensor_reads,
+        _group_dependent_components)
+from pydomotic.providers.base import DeviceGroup
+from pydomotic.providers.noop import NoopDevice
+from pydomotic.sensors import TimeSensor
+from pydomotic.triggers import (AQITrigger, RadonTrigger, RandomTrigger,
+        TimeTrigger)
+from pydomotic.utils import FileCacheStore
 
 def test_handler___call___passes(mock_enabled_component, mock_disabled_component):
     handler = Handler()
@@ -62,3 +75,572 @@ def test_lambda_handler___call___fails_thrice(mock_thrice_failing_component,
         assert patched_sleep.times_slept == 2, 'wrong number of times slept'
     else:
         raise AssertionError('should have raised PyDomoticComponentRunError')
+
+def test_lambda_handler___call___warm_start(mock_enabled_component, caplog):
+    caplog.set_level('INFO', logger='pydomotic.handlers')
+    class LambdaContext(object):
+        memory_limit_in_mb = 256
+
+    mock_enabled_component.failures = [False, False]
+    handler = LambdaHandler()
+    handler.components = [mock_enabled_component]
+    event = {'requestContext': {'http': {'path': '/hello', 'method': 'POST'}}}
+    assert handler(event, LambdaContext()) == handler.ok_response, (
+            'wrong response')
+    assert handler.webhook_sensor.path is None, 'webhook path not reset'
+    assert handler.webhook_sensor.method is None, 'webhook method not reset'
+    handler({}, {})
+
+    assert handler.invocations == 2, 'wrong number of invocations'
+    assert mock_enabled_component.run_called == 2, (
+            'enabled component.run not called once per invocation')
+    messages = [r.message for r in caplog.records
+            if r.name == 'pydomotic.handlers']
+    assert messages[0].startswith('invocation 1: cold start (init '), (
+            'cold start not logged')
+    assert messages[0].endswith(', 256MB memory'), 'memory not logged'
+    assert messages[1].startswith('invocation 2: warm start, run '), (
+            'warm start not logged')
+
+@pytest.mark.parametrize('argv,daemon', (
+        ([], False),
+        (['--daemon'], True),
+        (['-d'], True),
+))
+def test_command_line_handler_parse_args(argv, daemon, monkeypatch):
+    monkeypatch.setattr('sys.argv', ['pydomotic'] + argv)
+    handler = CommandLineHandler()
+    assert handler.daemon is daemon, 'wrong daemon value'
+
+def test_command_line_handler_run_forever(mock_enabled_component,
+        mock_thrice_failing_component, patched_sleep, monkeypatch):
+    monkeypatch.setattr('sys.argv', ['pydomotic', '--daemon'])
+    handler = CommandLineHandler()
+    handler.components = [mock_enabled_component, mock_thrice_failing_component]
+    mock_enabled_component.failures = [False] * 3
+    mock_thrice_failing_component.failures = [True] * 6
+
+    run_components = handler.run_components
+    ticks = [0]
+    def _run_components():
+        ticks[0] += 1
+        if ticks[0] > 2:
+            raise KeyboardInterrupt
+        run_components()
+    handler.run_components = _run_components
+
+    handler()
+    assert ticks[0] == 3, 'wrong number of ticks run'
+    assert mock_enabled_component.run_called == 2, (
+            'enabled component.run not called once per tick')
+    assert mock_thrice_failing_component.run_called == 6, (
+            'failing component should not stop the daemon')
+
+@pytest.mark.parametrize('max_workers', (None, 1, 4))
+def test_handler_max_workers(max_workers, mock_enabled_component,
+        mock_disabled_component, mock_once_failing_component, patched_sleep):
+    handler = Handler(max_workers=max_workers)
+    handler.components = [mock_enabled_component, mock_disabled_component,
+            mock_once_failing_component]
+    handler()
+    assert (handler.executor is None) is (max_workers in (None, 1)), (
+            'wrong executor')
+    assert mock_enabled_component.run_called == 1, (
+            'enabled component.run not called once')
+    assert not mock_disabled_component.run_called, 'disabled component.run called'
+    assert mock_once_failing_component.run_called == 2, (
+            'failing component.run not called two times')
+    assert patched_sleep.times_slept == 1, 'wrong number of times slept'
+
+def test_handler_max_workers_env(monkeypatch):
+    monkeypatch.setenv('PYDOMOTIC_MAX_WORKERS', '3')
+    handler = Handler()
+    assert handler.max_workers == 3, 'wrong max_workers'
+
+def test_handler_max_workers_fails_thrice(mock_thrice_failing_component,
+        mock_enabled_component, patched_sleep):
+    handler = Handler(max_workers=2)
+    handler.components = [mock_thrice_failing_component, mock_enabled_component]
+    with pytest.raises(PyDomoticComponentRunError):
+        handler()
+    assert mock_thrice_failing_component.run_called == 3, (
+            'enabled component.run not called three times')
+    assert mock_enabled_component.run_called == 1, (
+            'enabled component.run not called once')
+
+def test__group_dependent_components():
+    device_a = NoopDevice('a', 'a', '')
+    device_b = NoopDevice('b', 'b', '')
+    device_c = NoopDevice('c', 'c', '')
+    device_d = NoopDevice('d', 'd', '')
+    group = DeviceGroup([device_b, device_c], 'group')
+
+    def _component(name, thens, elses=()):
+        return Component(name, [], list(thens), list(elses))
+
+    components = [
+            _component('0', [TurnOnAction(device_a)]),
+            _component('1', [TurnOnAction(device_b)]),
+            _component('2', [TurnOnAction(device_d)]),
+            _component('3', [TurnOffAction(device_a)]),
+            _component('4', [TurnOnAction(device_c)], [TurnOffAction(group)]),
+            _component('5', [ExecuteCodeAction('a.b', {})]),
+            _component('6', []),
+            _component('7', [ExecuteCodeAction('c.d', {})]),
+    ]
+    groups = _group_dependent_components(components)
+    names = [[c.name for c in group] for group in groups]
+    assert names == [['0', '3'], ['1', '4'], ['2'], ['5', '7'], ['6']], (
+            'wrong component groups')
+
+def test_command_line_handler_compile(tmp_path, monkeypatch):
+    config_file = tmp_path / 'pydomotic.yml'
+    config_file.write_text('automations:\n  a:\n    components:\n      - if:\n')
+    monkeypatch.setattr('sys.argv',
+            ['pydomotic', 'compile', '--config-file', str(config_file)])
+    handler = CommandLineHandler()
+    assert handler.command == 'compile', 'wrong command'
+    handler()
+    assert (tmp_path / 'pydomotic.yml.compiled').is_file(), (
+            'compiled file not written')
+
+def test_async_handler___call__(mock_enabled_component,
+        mock_disabled_component, mock_once_failing_component, monkeypatch):
+    slept = []
+    async def sleep(secs):
+        slept.append(secs)
+    monkeypatch.setattr(asyncio, 'sleep', sleep)
+
+    handler = AsyncHandler()
+    handler.components = [mock_enabled_component, mock_disabled_component,
+            mock_once_failing_component]
+    handler()
+    assert mock_enabled_component.run_called == 1, (
+            'enabled component.run not called once')
+    assert not mock_disabled_component.run_called, 'disabled component.run called'
+    assert mock_once_failing_component.run_called == 2, (
+            'failing component.run not called two times')
+    assert slept == [0.25], 'wrong number of times slept'
+
+def test_async_handler___call___fails_thrice(mock_thrice_failing_component,
+        monkeypatch):
+    async def sleep(secs):
+        pass
+    monkeypatch.setattr(asyncio, 'sleep', sleep)
+
+    handler = AsyncHandler()
+    handler.components = [mock_thrice_failing_component]
+    with pytest.raises(PyDomoticComponentRunError):
+        handler()
+    assert mock_thrice_failing_component.run_called == 3, (
+            'enabled component.run not called three times')
+
+def test__component_sensor_reads(mock_aqi_sensor, mock_radon_sensor,
+        mock_time_sensor):
+    now = mock_time_sensor.get_current_datetime()
+    now_minutes = 60 * now.hour + now.minute
+    aqi = AQITrigger(lambda a: True, mock_aqi_sensor)
+    components = [
+            Component('now', [TimeTrigger([now_minutes], mock_time_sensor),
+                aqi], [], []),
+            Component('later', [TimeTrigger([now_minutes + 1],
+                mock_time_sensor), RadonTrigger(lambda r: True,
+                    mock_radon_sensor)], [], []),
+            Component('random', [RandomTrigger(0), aqi], [], []),
+    ]
+    reads = _component_sensor_reads(components)
+    assert reads == [(mock_aqi_sensor, 'get_aqi')] * 2, 'wrong sensor reads'
+
+@pytest.mark.parametrize('max_workers', (1, 2))
+def test_handler_prefetches_sensor_reads(max_workers, mock_aqi_sensor):
+    handler = Handler(max_workers=max_workers)
+    readings = handler.context.readings
+    seen = []
+    def check_func(aqi):
+        seen.append(aqi)
+        mock_aqi_sensor.aqi += 1
+        return True
+    handler.components = [Component(str(i), [AQITrigger(check_func,
+        mock_aqi_sensor, readings=readings)], [], []) for i in range(3)]
+    handler()
+    assert seen == [0, 0, 0], 'all triggers should see the prefetched value'
+    assert readings.read(mock_aqi_sensor, 'get_aqi') == 3, (
+            'readings should be cleared after run')
+
+def test_handler_runs_scheduled_components(mock_time_sensor, mock_action_1,
+        mock_action_2):
+    now = mock_time_sensor.get_current_datetime()
+    now_minutes = 60 * now.hour + now.minute
+    handler = Handler()
+    handler.components = [
+            Component('now', [TimeTrigger([now_minutes], mock_time_sensor)],
+                [mock_action_1], []),
+            Component('later', [TimeTrigger([now_minutes + 1],
+                mock_time_sensor)], [mock_action_2], []),
+    ]
+    handler()
+    assert mock_action_1.run_called, 'scheduled component not run'
+    assert not mock_action_2.run_called, 'unscheduled component run'
+    assert [c.name for c in handler.schedule.candidates()] == ['now'], (
+            'wrong candidates')
+
+    handler.components = handler.components[1:]
+    assert handler.schedule.candidates() == [], (
+            'schedule not rebuilt when components change')
+
+_test_reload_yaml = """
+triggers:
+  timezone: America/Los_Angeles
+devices:
+  switch-A:
+    provider: noop
+    id: '012'
+automations:
+  mornings:
+    components:
+      - if:
+          time: 8:00am
+        then:
+          turn-on: switch-A
+"""
+
+@pytest.mark.parametrize('env,reload', (
+    ('', False),
+    ('false', False),
+    ('1', True),
+    ('true', True),
+    ('YES', True),
+))
+def test_handler_reload_env(env, reload, monkeypatch):
+    monkeypatch.setenv('PYDOMOTIC_CONFIG_RELOAD', env)
+    assert Handler().reload == reload, 'wrong reload setting'
+
+def test_handler_reload_config(tmp_path, caplog):
+    config_file = tmp_path / 'pydomotic.yml'
+    config_file.write_text(_test_reload_yaml)
+    handler = Handler(config_file=str(config_file), reload=True)
+    version = handler.context.config_version
+    assert handler.components[0].ifs[0].times == [480], 'wrong time'
+
+    handler()
+    assert handler.components[0].ifs[0].times == [480], 'wrong time'
+
+    config_file.write_text(_test_reload_yaml.replace('8:00am', '9:00am'))
+    os.utime(config_file, ns=(0, version + 1))
+    handler()
+    assert handler.components[0].ifs[0].times == [540], (
+            'changed config not reloaded')
+
+    components = handler.components
+    config_file.write_text('automations: [')
+    os.utime(config_file, ns=(0, version + 2))
+    assert not handler.reload_config(), 'broken config should not be loaded'
+    assert handler.components is components, 'previous config not kept'
+    assert 'failed to reload configuration' in caplog.text, 'error not logged'
+
+def test_handler_freezes_time():
+    time_sensor = TimeSensor(timezone='America/Los_Angeles')
+    seen = []
+    class _Component(object):
+        name = 'recorder'
+        enabled = True
+        def run(self):
+            seen.append(time_sensor.get_current_datetime())
+    handler = Handler()
+    handler.context._time_sensor = time_sensor
+    handler.components = [_Component(), _Component()]
+    handler()
+    assert len(seen) == 2 and seen[0] is seen[1], (
+            'components should see the same time')
+    assert time_sensor.get_current_datetime() is not seen[0], (
+            'time should be unfrozen after run')
+
+    seen.clear()
+    AsyncHandler.run_components(handler)
+    assert len(seen) == 2 and seen[0] is seen[1], (
+            'components should see the same time when run async')
+
+class _RecordAction(object):
+    def __init__(self, name, time_sensor, seen):
+        self.name = name
+        self.time_sensor = time_sensor
+        self.seen = seen
+    def run(self):
+        now = self.time_sensor.get_current_tick().datetime
+        self.seen.append((self.name, f'{now:%H:%M}'))
+
+def _catch_up_handler(time_sensor, seen, **kwargs):
+    def _component(name, minute, **kwargs):
+        return Component(name, [TimeTrigger([minute], time_sensor),
+            *kwargs.get('ifs', [])], [_RecordAction(name, time_sensor, seen)],
+            kwargs.get('elses', []))
+    handler = Handler(**kwargs)
+    handler.context._time_sensor = time_sensor
+    handler.components = [
+            _component('too-old', 481),
+            _component('eight-oh-four', 484),
+            _component('eight-oh-two', 482),
+            _component('now', 485),
+            _component('else', 483, elses=[_RecordAction('else', time_sensor,
+                seen)]),
+            _component('sensor', 483, ifs=[RandomTrigger(1)]),
+    ]
+    return handler
+
+def test_handler_catch_up(test_tzinfo, monkeypatch):
+    time_sensor = TimeSensor(timezone=str(test_tzinfo))
+    now = [datetime.datetime(2023, 6, 15, 8, 0, 30, tzinfo=test_tzinfo)]
+    monkeypatch.setattr(time_sensor, 'get_current_datetime', lambda: now[0])
+    seen = []
+    handler = _catch_up_handler(time_sensor, seen, catch_up=3)
+    assert handler.catch_up == 3, 'wrong catch up setting'
+
+    handler()
+    assert seen == [('else', '08:00')], (
+            'nothing should be caught up on first run')
+
+    seen.clear()
+    now[0] = datetime.datetime(2023, 6, 15, 8, 5, 10, tzinfo=test_tzinfo)
+    handler()
+    assert seen == [('eight-oh-two', '08:02'), ('eight-oh-four', '08:04'),
+            ('now', '08:05'), ('else', '08:05')], 'wrong components caught up'
+
+    seen.clear()
+    handler()
+    assert seen == [('now', '08:05'), ('else', '08:05')], (
+            'same minute should not be caught up')
+
+def test_handler_catch_up_disabled(test_tzinfo, monkeypatch):
+    time_sensor = TimeSensor(timezone=str(test_tzinfo))
+    now = [datetime.datetime(2023, 6, 15, 8, 0, tzinfo=test_tzinfo)]
+    monkeypatch.setattr(time_sensor, 'get_current_datetime', lambda: now[0])
+    monkeypatch.delenv('PYDOMOTIC_CATCH_UP_MINUTES', raising=False)
+    seen = []
+    handler = _catch_up_handler(time_sensor, seen)
+    assert handler.catch_up == 0, 'catch up should be disabled by default'
+    handler()
+    now[0] = datetime.datetime(2023, 6, 15, 8, 5, tzinfo=test_tzinfo)
+    handler()
+    assert seen == [('else', '08:00'), ('now', '08:05'), ('else', '08:05')], (
+            'nothing should be caught up')
+
+def test_handler_catch_up_persisted(test_tzinfo, tmp_path, monkeypatch):
+    time_sensor = TimeSensor(timezone=str(test_tzinfo))
+    now = [datetime.datetime(2023, 6, 15, 8, 3, tzinfo=test_tzinfo)]
+    monkeypatch.setattr(time_sensor, 'get_current_datetime', lambda: now[0])
+    monkeypatch.setenv('PYDOMOTIC_CATCH_UP_MINUTES', '10')
+    seen = []
+    handler = _catch_up_handler(time_sensor, seen)
+    handler.context.cache_store = FileCacheStore(str(tmp_path))
+    handler()
+
+    seen.clear()
+    now[0] = datetime.datetime(2023, 6, 15, 8, 5, tzinfo=test_tzinfo)
+    handler = _catch_up_handler(time_sensor, seen)
+    handler.context.cache_store = FileCacheStore(str(tmp_path))
+    handler()
+    assert seen == [('eight-oh-four', '08:04'), ('now', '08:05'),
+            ('else', '08:05')], (
+            'last run not loaded from cache store')
+
+@pytest.mark.parametrize('argv,warns', (
+        (['--catch-up', '5'], True),
+        (['--daemon', '--catch-up', '5'], False),
+        ([], False),
+))
+def test_command_line_handler_catch_up_without_cache(argv, warns, monkeypatch,
+        caplog):
+    monkeypatch.setattr('sys.argv', ['pydomotic'] + argv)
+    monkeypatch.delenv('PYDOMOTIC_CATCH_UP_MINUTES', raising=False)
+    CommandLineHandler()
+    assert ('no cache directory is configured' in caplog.text) is warns, (
+            'wrong catch up warning')
+
+def test_handler_catch_up_with_cache(tmp_path, caplog):
+    config_file = tmp_path / 'pydomotic.yml'
+    config_file.write_text(f'cache:\n  directory: {tmp_path}\n')
+    handler = Handler(config_file=str(config_file), catch_up=5)
+    assert handler.context.cache_store is not None, 'cache store not parsed'
+    assert 'no cache directory is configured' not in caplog.text, (
+            'catch up warning logged with a cache directory')
+
+@pytest.mark.parametrize('argv,sleep', (
+        (['--daemon'], False),
+        (['--daemon', '--sleep'], True),
+        (['-d', '-s'], True),
+))
+def test_command_line_handler_parse_args_sleep(argv, sleep, monkeypatch):
+    monkeypatch.setattr('sys.argv', ['pydomotic'] + argv)
+    handler = CommandLineHandler()
+    assert handler.sleep is sleep, 'wrong sleep value'
+
+@pytest.mark.parametrize('reload,next_run,expect', (
+        (False, 200, [200]),
+        (False, 7200, [3600, 3600]),
+        (False, None, [3600]),
+        (True, 200, [20, 60, 60, 60]),
+))
+def test_command_line_handler_sleep_until_next_run(reload, next_run, expect,
+        monkeypatch):
+    monkeypatch.setattr('sys.argv', ['pydomotic', '--daemon', '--sleep'])
+    handler = CommandLineHandler()
+    handler.reload = reload
+    clock, slept = [1000.0], []
+    def sleep(seconds):
+        slept.append(seconds)
+        clock[0] += seconds
+        if len(slept) >= len(expect) and next_run is None:
+            raise KeyboardInterrupt
+    monkeypatch.setattr('time.time', lambda: clock[0])
+    monkeypatch.setattr('time.sleep', sleep)
+    if next_run is not None:
+        next_run = datetime.datetime.fromtimestamp(1000 + next_run,
+                tz=datetime.timezone.utc)
+    handler.next_run = lambda: next_run
+    reloads = []
+    handler.reload_config = lambda: reloads.append(True) and False
+
+    try:
+        handler.sleep_until_next_run()
+    except KeyboardInterrupt:
+        pass
+    assert slept == expect, 'wrong time slept'
+    assert len(reloads) == (len(expect) - 1 if reload else 0), (
+            'config should be checked every minute when reloading')
+
+def test_handler_start_polling(mock_aqi_sensor, mock_radon_sensor,
+        monkeypatch):
+    started = []
+    monkeypatch.setattr('pydomotic.poller.SensorPoller.start',
+            lambda self: started.append(self))
+    mock_aqi_sensor.poll_interval = 60
+    handler = Handler()
+    handler.components = [
+            Component('aqi', [AQITrigger(lambda aqi: True, mock_aqi_sensor)],
+                [], []),
+            Component('radon', [RadonTrigger(lambda radon: True,
+                mock_radon_sensor), RandomTrigger(1)], [], []),
+    ]
+    handler.start_polling()
+    assert started == [handler.poller], 'poller not started'
+    assert len(handler.poller) == 1, 'only the aqi sensor should be polled'
+    assert handler.poller.readings is handler.context.readings, (
+            'poller should push into the context readings')
+    handler.stop_polling()
+    assert handler.poller is None, 'poller not stopped'
+
+@pytest.mark.parametrize('argv,poll', (
+        (['--daemon'], False),
+        (['--daemon', '--poll'], True),
+        (['-d', '-p'], True),
+))
+def test_command_line_handler_parse_args_poll(argv, poll, monkeypatch):
+    monkeypatch.setattr('sys.argv', ['pydomotic'] + argv)
+    handler = CommandLineHandler()
+    assert handler.poll is poll, 'wrong poll value'
+
+def test_handler_run_changed(mock_aqi_sensor, mock_radon_sensor,
+        mock_action_1, mock_action_2, monkeypatch):
+    monkeypatch.setattr('pydomotic.poller.SensorPoller.start', lambda self: None)
+    mock_aqi_sensor.poll_interval = 60
+    handler = Handler()
+    aqi = AQITrigger(lambda aqi: aqi > 100, mock_aqi_sensor,
+            readings=handler.context.readings)
+    radon = RadonTrigger(lambda radon: True, mock_radon_sensor)
+    handler.components = [
+            Component('aqi', [aqi], [mock_action_1], [], edge=True),
+            Component('radon', [radon], [mock_action_2], []),
+    ]
+    handler.start_polling()
+    handler()
+    assert not mock_action_1.run_called, (
+            'event driven component should not run every minute')
+    assert mock_action_2.run_called, 'unpolled component should run'
+
+    mock_aqi_sensor.aqi = 150
+    handler.poller.run_pending()
+    mock_aqi_sensor.get_aqi_called = False
+    assert [c.name for c in handler.run_changed(timeout=0)] == ['aqi'], (
+            'changed sensor dependents not run')
+    assert mock_action_1.run_called, 'changed sensor dependents not run'
+    assert not mock_aqi_sensor.get_aqi_called, 'polled value not used'
+
+    assert handler.run_changed(timeout=0) == [], 'nothing should have changed'
+    handler.stop_polling()
+    mock_action_1.run_called = False
+    handler()
+    assert not mock_action_1.run_called, 'edge component should not run again'
+
+def test_handler_run_changed_skips_clock_gated(mock_time_sensor,
+        mock_aqi_sensor, mock_action_1, monkeypatch):
+    monkeypatch.setattr('pydomotic.poller.SensorPoller.start', lambda self: None)
+    mock_aqi_sensor.poll_interval = 60
+    now = mock_time_sensor.get_current_datetime()
+    handler = Handler()
+    time = TimeTrigger([60 * now.hour + now.minute], mock_time_sensor)
+    aqi = AQITrigger(lambda aqi: aqi > 100, mock_aqi_sensor,
+            readings=handler.context.readings)
+    handler.components = [
+            Component('clock-gated', [time, aqi], [mock_action_1], []),
+    ]
+    handler.start_polling()
+    mock_aqi_sensor.aqi = 150
+    handler()
+    assert mock_action_1.run_called, 'clock gated component should run'
+
+    mock_action_1.run_called = False
+    mock_aqi_sensor.aqi = 200
+    handler.poller.run_pending()
+    assert handler.run_changed(timeout=0) == [], (
+            'clock gated component should not run on sensor changes')
+    assert not mock_action_1.run_called, (
+            'clock gated component should not run on sensor changes')
+    handler.stop_polling()
+
+def test_handler_run_changed_retries_failures(mock_aqi_sensor,
+        mock_action_1, monkeypatch):
+    monkeypatch.setattr('pydomotic.poller.SensorPoller.start', lambda self: None)
+    monkeypatch.setattr('time.sleep', lambda seconds: None)
+    mock_aqi_sensor.poll_interval = 60
+    handler = Handler()
+    aqi = AQITrigger(lambda aqi: aqi > 100, mock_aqi_sensor,
+            readings=handler.context.readings)
+    handler.components = [Component('aqi', [aqi], [mock_action_1], [])]
+    handler.start_polling()
+
+    mock_aqi_sensor.aqi = 150
+    handler.poller.run_pending()
+    mock_action_1.raises = True
+    with pytest.raises(PyDomoticComponentRunError):
+        handler.run_changed(timeout=0)
+
+    mock_action_1.run_called = False
+    with pytest.raises(PyDomoticComponentRunError):
+        handler()
+    assert mock_action_1.run_called, 'failed component should be retried'
+
+    mock_action_1.raises = False
+    mock_action_1.run_called = False
+    handler()
+    assert mock_action_1.run_called, 'failed component should be retried'
+
+    mock_action_1.run_called = False
+    handler()
+    assert not mock_action_1.run_called, (
+            'component should not run again once it succeeds')
+    handler.stop_polling()
+
+def test_command_line_handler_sleep_runs_changed(monkeypatch):
+    monkeypatch.setattr('sys.argv', ['pydomotic', '--daemon', '--poll'])
+    handler = CommandLineHandler()
+    handler.poller = object()
+    clock, timeouts = [1000.0], []
+    monkeypatch.setattr('time.time', lambda: clock[0])
+    def run_changed(timeout=None):
+        timeouts.append(timeout)
+        clock[0] += 15
+        if len(timeouts) == 2:
+            raise ValueError('oops')
+    handler.run_changed = run_changed
+    handler.sleep_until_next_minute()
+    assert timeouts == [20, 5], 'should wait for changes until next minute'
@@ -1,5 +1,7 @@
 import datetime
 import functools
+import importlib.util
+import json
 import os
 import pytest
 
@@ -7,8 +9,11 @@ from pydomotic.actions import (TurnOnAction, TurnOffAction, SwitchAction,
         SetModeAction, ExecuteCodeAction)
 from pydomotic.components import Component
 from pydomotic.context import Context
-from pydomotic.parsers import (parse_yaml, _get_config_reader, _file_reader,
-        _s3_reader, _parse_providers, _parse_tuya_provider,
+from pydomotic.parsers import (parse_yaml, reparse_yaml, compile_yaml,
+        parse_raw_yaml, reparse_raw_yaml, _get_config_reader,
+        _file_reader, _s3_reader, _parse_http_session, _parse_cache_store,
+        _parse_providers,
+        _parse_tuya_provider,
         _parse_fujitsu_provider, _parse_airthings_provider,
         _parse_moen_provider, _parse_ecobee_provider, _parse_string,
         _parse_devices, _parse_components, _parse_triggers, _parse_trigger,
@@ -30,6 +35,7 @@ from pydomotic.sensors import (SunSensor, TimeSensor, WeatherSensor, AQISensor,
 from pydomotic.triggers import (AQITrigger, TimeTrigger, IsoWeekdayTrigger,
         DateTrigger, CronTrigger, RandomTrigger, SunriseTrigger, SunsetTrigger,
         TemperatureTrigger, RadonTrigger, WebhookTrigger)
+from pydomotic.utils import FileCacheStore, HTTPSession
 
 _test_config_file = os.path.join(
         os.path.dirname(os.path.realpath(__file__)),
@@ -80,13 +86,13 @@ _test_context.weather_sensor.current_temperature = lambda: _test_current_temp
 _test_parse_yaml_expect = [
         Component(
             name='air-purifier 0',
-            ifs=[AQITrigger, DateTrigger],
+            ifs=[DateTrigger, AQITrigger],
             thens=[TurnOnAction],
             elses=[TurnOffAction],
         ),
         Component(
             name='air-purifier 1',
-            ifs=[AQITrigger, DateTrigger],
+            ifs=[DateTrigger, AQITrigger],
             thens=[TurnOnAction],
             elses=[TurnOffAction],
         ),
@@ -170,8 +176,8 @@ _test_parse_yaml_expect = [
         ),
         Component(
             name='ranges 0',
-            ifs=[AQITrigger, IsoWeekdayTrigger, TimeTrigger, SunriseTrigger,
-                SunsetTrigger, TemperatureTrigger, CronTrigger],
+            ifs=[IsoWeekdayTrigger, TimeTrigger, CronTrigger, SunriseTrigger,
+                SunsetTrigger, AQITrigger, TemperatureTrigger],
             thens=[],
             elses=[],
         ),
@@ -330,6 +336,38 @@ def test_parse_yaml_sensor_singletons(monkeypatch):
     ), 'wrong number of sensors objects initialized'
 
 
+def test_compile_yaml(tmp_path, monkeypatch):
+    config_file = tmp_path / 'pydomotic.yml'
+    with open(_test_config_file) as f:
+        config_file.write_text(f.read())
+
+    snapshot_file = compile_yaml(str(config_file))
+    assert snapshot_file == f'{config_file}.compiled', 'wrong snapshot file'
+    assert os.path.isfile(snapshot_file), 'snapshot file not written'
+
+    def safe_load(*args, **kwargs):
+        raise AssertionError('yaml should not be parsed')
+    monkeypatch.setattr('yaml.safe_load', safe_load)
+
+    actual_comps, _ = parse_yaml(str(config_file))
+    expect_comps = _test_parse_yaml_expect
+    assert [c.name for c in actual_comps] == [c.name for c in expect_comps], (
+            'wrong components returned')
+
+def test_compile_yaml_out_of_date(tmp_path):
+    config_file = tmp_path / 'pydomotic.yml'
+    config_file.write_text('automations:\n  a:\n    components:\n      - if:\n')
+    compile_yaml(str(config_file))
+    config_file.write_text('automations:\n  b:\n    components:\n      - if:\n')
+
+    actual_comps, _ = parse_yaml(str(config_file))
+    assert [c.name for c in actual_comps] == ['b 0'], (
+            'out of date snapshot should be ignored')
+
+def test_compile_yaml_s3_raises():
+    with pytest.raises(PyDomoticConfigParsingError):
+        compile_yaml(s3='bucket/key')
+
 _test__TriggersConf = (
         ({}, Exception, Exception, Exception, Exception),
         ([], Exception, Exception, Exception, Exception),
@@ -440,6 +478,79 @@ def test__s3_reader_read(exception, patch_s3):
     expect = None if exception else body
     assert expect == actual, 'wrong body returned'
 
+def test__s3_reader_read_not_modified(patch_s3):
+    mock_s3 = patch_s3(None, b'hello world', etag='"abc"')
+    assert _s3_reader('bucket/key').read() == b'hello world', (
+            'wrong body returned')
+    reader = _s3_reader('bucket/key')
+    mock_s3.body = b'should not be downloaded'
+    assert reader.read() == b'hello world', 'cached body not returned'
+    assert reader.read_version == '"abc"', 'wrong version'
+    assert mock_s3.calls == [None, '"abc"'], 'wrong conditional requests'
+
+    mock_s3.etag = '"def"'
+    assert _s3_reader('bucket/key').read() == b'should not be downloaded', (
+            'changed body not downloaded')
+    assert mock_s3.calls[-1] == '"abc"', 'wrong conditional request'
+    assert _s3_reader('bucket/key').read() == b'should not be downloaded', (
+            'changed body not cached')
+    assert mock_s3.calls[-1] == '"def"', 'wrong conditional request'
+
+def test__s3_reader_read_no_etag(patch_s3):
+    mock_s3 = patch_s3(None, b'hello world')
+    assert _s3_reader('bucket/key').read() == b'hello world', (
+            'wrong body returned')
+    assert _s3_reader('bucket/key').read() == b'hello world', (
+            'wrong body returned')
+    assert mock_s3.calls == [None, None], 'conditional request without etag'
+
+def test_parse_yaml_s3_not_modified(patch_s3):
+    mock_s3 = patch_s3(None, b'automations:\n  a:\n    components: []\n',
+            etag='"abc"')
+    components, context = parse_yaml(s3='bucket/key')
+    assert context.config_version == '"abc"', 'wrong version'
+
+    mock_s3.body = b'should not be downloaded'
+    components, context = parse_yaml(s3='bucket/key')
+    assert context.conf == {'automations': {'a': {'components': []}}}, (
+            'cached configuration not loaded')
+    assert reparse_yaml(components, context, s3='bucket/key') is None, (
+            'unchanged configuration parsed')
+
+def test__s3_reader_cache_file(patch_s3, tmp_path, monkeypatch):
+    patch_s3(None, b'hello world', etag='"abc"')
+    reader = _s3_reader('bucket/key')
+    reader.read()
+    cache_file = reader.cache_file
+    assert os.path.dirname(cache_file) == str(tmp_path), 'wrong directory'
+    assert os.stat(cache_file).st_mode & 0o777 == 0o600, (
+            'cache file should be private')
+    with open(cache_file) as f:
+        assert json.load(f) == {'etag': '"abc"', 'body': 'hello world'}, (
+                'wrong cached data')
+
+    os.chmod(tmp_path, 0o777)
+    assert _s3_reader('bucket/key').cache_file is None, (
+            'shared directory should not be used')
+    assert _s3_reader('bucket/key')._read_cache() is None, (
+            'cache in shared directory should not be read')
+
+    os.chmod(tmp_path, 0o700)
+    link = tmp_path.parent / f'{tmp_path.name}-link'
+    link.symlink_to(tmp_path)
+    monkeypatch.setattr('pydomotic.parsers._s3_reader.cache_directory',
+            str(link))
+    assert _s3_reader('bucket/key').cache_file is None, (
+            'symlinked directory should not be used')
+
+def test__s3_reader_cache_directory_default(monkeypatch, tmp_path):
+    monkeypatch.setattr('tempfile.gettempdir', lambda: str(tmp_path))
+    cache_file = _s3_reader('bucket/key').cache_file
+    directory = tmp_path / f'pydomotic-{os.getuid()}'
+    assert os.path.dirname(cache_file) == str(directory), 'wrong directory'
+    assert directory.stat().st_mode & 0o777 == 0o700, (
+            'directory should be private')
+
 @pytest.mark.parametrize('raw_yml,exp_lat,exp_long,exp_api_key,exp_tz',
         _test__TriggersConf)
 def test__TriggersConf(raw_yml, exp_lat, exp_long, exp_api_key, exp_tz):
@@ -475,6 +586,215 @@ def test__TriggersConf(raw_yml, exp_lat, exp_long, exp_api_key, exp_tz):
     _test_property('timezone', exp_tz)
     _test_time_sensor()
 
+_test__parse_http_session = (
+        ({}, {'timeout': None}, False),
+        ({'timeout_seconds': 5}, {'timeout': 5}, False),
+        ({'timeout_seconds': 2.5}, {'timeout': 2.5}, False),
+        ({'pool_size': 4, 'retries': 3, 'backoff_seconds': 0.5},
+            {'timeout': None}, False),
+        ({'timeout_seconds': '5'}, None, True),
+        ({'pool_size': 1.5}, None, True),
+        ({'retries': True}, None, True),
+        ([], None, True),
+)
+
+@pytest.mark.parametrize('http_conf,expect,raises', _test__parse_http_session)
+def test__parse_http_session(http_conf, expect, raises):
+    try:
+        session = _parse_http_session(http_conf)
+    except PyDomoticConfigParsingError:
+        assert raises, 'should not have raised'
+        return
+    assert not raises, 'should have raised'
+    assert isinstance(session, HTTPSession), 'wrong session type'
+    assert session.timeout == expect['timeout'], 'wrong timeout'
+
+def test_parse_yaml_shares_http_session():
+    _, context = parse_yaml(_test_config_file)
+    assert isinstance(context.session, HTTPSession), 'wrong session type'
+    assert context.aqi_sensor.session is context.session, (
+            'aqi sensor should use context session')
+
+def test__parse_cache_store(tmp_path, monkeypatch):
+    assert _parse_cache_store({}) is None, 'cache store should be optional'
+
+    monkeypatch.setenv('CACHE_DIR', str(tmp_path))
+    store = _parse_cache_store({'directory': '${env:CACHE_DIR}/pydomotic'})
+    assert isinstance(store, FileCacheStore), 'wrong cache store type'
+    assert store.path.startswith(str(tmp_path / 'pydomotic')), 'wrong path'
+
+def test__parse_cache_store_shared(tmp_path, caplog):
+    os.chmod(tmp_path, 0o777)
+    try:
+        assert _parse_cache_store({'directory': str(tmp_path)}) is None, (
+                'shared cache directory should not be used')
+    finally:
+        os.chmod(tmp_path, 0o700)
+    assert 'not private' in caplog.text, 'warning not logged'
+
+@pytest.mark.parametrize('cache_conf', ([], {'directory': 10}))
+def test__parse_cache_store_raises(cache_conf):
+    with pytest.raises(PyDomoticConfigParsingError):
+        _parse_cache_store(cache_conf)
+
+def test_parse_yaml_cache_store(tmp_path):
+    _, context = parse_yaml(_test_config_file)
+    assert context.cache_store is None, 'cache store should be optional'
+
+    config_file = tmp_path / 'pydomotic.yml'
+    config_file.write_text(f"""
+cache:
+  directory: {tmp_path}
+triggers:
+  aqi:
+    api_key: 123abc
+  location:
+    latitude: 40.689
+    longitude: -74.044
+""")
+    _, context = parse_yaml(str(config_file))
+    assert isinstance(context.cache_store, FileCacheStore), (
+            'wrong cache store type')
+    assert context.aqi_sensor.cache_store is context.cache_store, (
+            'aqi sensor should use context cache store')
+
+_test_reload_yaml = """
+triggers:
+  timezone: America/Los_Angeles
+providers:
+  airthings:
+    client_id: abc
+    client_secret: '123'
+devices:
+  switch-A:
+    provider: noop
+    id: '012'
+  radon-A:
+    provider: airthings
+    id: '123'
+automations:
+  mornings:
+    components:
+      - if:
+          time: 8:00am
+        then:
+          turn-on: switch-A
+  evenings:
+    components:
+      - if:
+          radon-A:
+            radon: '>4'
+        then:
+          turn-off: switch-A
+"""
+
+def test_reparse_raw_yaml_automations(patch_airthings):
+    components, context = parse_raw_yaml(_test_reload_yaml)
+    provider = context.providers['airthings']
+    device = context.devices['switch-A']
+
+    raw_conf = _test_reload_yaml.replace('8:00am', '9:00am')
+    new_components, new_context = reparse_raw_yaml(
+            raw_conf, components, context)
+    assert new_context is not context, 'context should be copied'
+    assert new_context.readings is context.readings, (
+            'readings should be shared')
+    assert new_context.providers['airthings'] is provider, (
+            'provider should be reused')
+    assert new_context.devices['switch-A'] is device, 'device should be reused'
+    assert [c.name for c in new_components] == ['mornings 0', 'evenings 0'], (
+            'wrong components')
+    assert new_components[0] is not components[0], (
+            'changed automation should be parsed')
+    assert new_components[0].ifs[0].times == [540], 'wrong time'
+    assert new_components[1] is components[1], (
+            'unchanged automation should be reused')
+
+    # sensor trigger confs are modified while parsing
+    same_components, _ = reparse_raw_yaml(raw_conf, new_components,
+            new_context)
+    assert same_components == new_components, 'nothing should be parsed'
+
+def test_reparse_raw_yaml_devices(patch_airthings):
+    components, context = parse_raw_yaml(_test_reload_yaml)
+    provider = context.providers['airthings']
+    radon = context.devices['radon-A']
+    switch = context.devices['switch-A']
+
+    raw_conf = _test_reload_yaml.replace("id: '012'", "id: '013'")
+    new_components, new_context = reparse_raw_yaml(
+            raw_conf, components, context)
+    assert new_context.providers['airthings'] is provider, (
+            'provider should be reused')
+    assert new_context.devices['radon-A'] is radon, (
+            'unchanged device should be reused')
+    assert new_context.devices['switch-A'] is not switch, (
+            'changed device should be parsed')
+    assert new_components[0].thens[0].device is (
+            new_context.devices['switch-A']), 'components should be parsed'
+
+def test_reparse_raw_yaml_failure(patch_airthings):
+    components, context = parse_raw_yaml(_test_reload_yaml)
+    switch = context.devices['switch-A']
+
+    broken_conf = _test_reload_yaml.replace("id: '012'", "id: '013'").replace(
+            'turn-off: switch-A', 'turn-off: switch-B')
+    with pytest.raises(PyDomoticConfigParsingError):
+        reparse_raw_yaml(broken_conf, components, context)
+    assert context.devices['switch-A'] is switch, 'context should not change'
+    assert context.conf['devices']['switch-A']['id'] == '012', (
+            'context should not change')
+
+    fixed_conf = broken_conf.replace('turn-off: switch-B', 'turn-off: switch-A')
+    new_components, new_context = reparse_raw_yaml(
+            fixed_conf, components, context)
+    new_switch = new_context.devices['switch-A']
+    assert new_switch is not switch, 'changed device should be parsed'
+    assert [c.thens[0].device for c in new_components] == [
+            new_switch, new_switch], 'components should use the new device'
+
+def test_reparse_raw_yaml_providers(patch_airthings):
+    components, context = parse_raw_yaml(_test_reload_yaml)
+    provider = context.providers['airthings']
+    noop = context.devices['switch-A']
+
+    raw_conf = _test_reload_yaml.replace("client_id: abc", "client_id: def")
+    _, new_context = reparse_raw_yaml(raw_conf, components, context)
+    assert new_context.providers['airthings'] is not provider, (
+            'changed provider should be parsed')
+    assert patch_airthings.client_id == 'def', 'wrong client id'
+    assert new_context.devices['switch-A'] is noop, (
+            'noop device should be reused')
+
+def test_reparse_raw_yaml_global_settings(patch_airthings):
+    components, context = parse_raw_yaml(_test_reload_yaml)
+    raw_conf = _test_reload_yaml.replace('Los_Angeles', 'New_York')
+    _, new_context = reparse_raw_yaml(raw_conf, components, context)
+    assert new_context is not context, 'everything should be parsed'
+    assert new_context.timezone == 'America/New_York', 'wrong timezone'
+
+def test_reparse_yaml(tmp_path, patch_airthings):
+    config_file = tmp_path / 'pydomotic.yml'
+    config_file.write_text(_test_reload_yaml)
+    components, context = parse_yaml(str(config_file))
+    assert context.config_version is not None, 'version not recorded'
+    assert reparse_yaml(components, context,
+            config_file=str(config_file)) is None, 'unchanged config parsed'
+
+    config_file.write_text(_test_reload_yaml.replace('8:00am', '9:00am'))
+    os.utime(config_file, ns=(0, context.config_version + 1))
+    components, context = reparse_yaml(components, context,
+            config_file=str(config_file))
+    assert components[0].ifs[0].times == [540], 'wrong time'
+
+    config_file.write_text('automations: [')
+    os.utime(config_file, ns=(0, context.config_version + 1))
+    with pytest.raises(Exception):
+        reparse_yaml(components, context, config_file=str(config_file))
+    assert reparse_yaml(components, context,
+            config_file=str(config_file)) is None, (
+            'broken config should not be parsed again')
+
 _test__parse_providers = (
         ({}, {'noop': NoopProvider}, False),
         ({'purple': None}, {}, True),
@@ -635,6 +955,7 @@ def test__parse_tuya_provider(provider, raises, monkeypatch):
     try:
         actual = _parse_tuya_provider(provider)
         assert isinstance(actual, TuyaProvider)
+        actual.tuya
     except PyDomoticConfigParsingError:
         assert raises, 'should not have raised'
     else:
@@ -714,6 +1035,32 @@ def test__parse_ecobee_provider(provider, raises):
     else:
         assert not raises, 'should have raised'
 
+_test__parse_provider_missing_package = (
+        (_parse_tuya_provider, 'gosundpy', {
+            'username': 'username',
+            'password': 'password',
+            'access_id': 'access_id',
+            'access_key': 'access_key',
+        }),
+        (_parse_fujitsu_provider, 'pyfujitseu',
+            {'username': 'username', 'password': 'password'}),
+        (_parse_moen_provider, 'pyflowater',
+            {'username': 'username', 'password': 'password'}),
+)
+
+@pytest.mark.parametrize('parse,module_name,provider',
+        _test__parse_provider_missing_package)
+def test__parse_provider_missing_package(parse, module_name, provider,
+        monkeypatch):
+    find_spec = importlib.util.find_spec
+    def _find_spec(name, *args, **kwargs):
+        if name == module_name:
+            return None
+        return find_spec(name, *args, **kwargs)
+    monkeypatch.setattr('importlib.util.find_spec', _find_spec)
+    with pytest.raises(PyDomoticConfigParsingError, match=module_name):
+        parse(provider)
+
 _test__parse_string = (
         ('', '', False),
         ('hello', 'hello', False),
@@ -743,11 +1090,19 @@ _test__parse_devices = (
         ({'switch-A': {'id': '123abc'}}, {}, True),
         ({'switch-A': {'provider': 'noop'}}, {}, True),
         ({'switch-A': {'provider': 'purple', 'id': '123abc'}}, {}, True),
+        ({'switch-A': {'provider': 'noop', 'id': ''}}, {}, True),
+        ({'switch-A': {'provider': 'noop', 'id': ['123abc']}}, {}, True),
+        ({'switch-A': {'provider': 'noop', 'id': True}}, {}, True),
         (
             {'switch-A': {'provider': 'noop', 'id': '123abc'}},
             {'switch-A': NoopDevice},
             False,
         ),
+        (
+            {'switch-A': {'provider': 'noop', 'id': 123}},
+            {'switch-A': NoopDevice},
+            False,
+        ),
         (
             {
                 'switch-A': {'provider': 'noop', 'id': '123abc'},
@@ -828,7 +1183,7 @@ _test__parse_components = (
             [
                 Component(
                     name='automation-5 0',
-                    ifs=[AQITrigger, IsoWeekdayTrigger],
+                    ifs=[IsoWeekdayTrigger, AQITrigger],
                     thens=[TurnOnAction, TurnOnAction],
                     elses=[TurnOffAction, TurnOffAction],
                 ),
@@ -925,7 +1280,7 @@ _test__parse_components = (
                 ),
                 Component(
                     name='automation-11 0',
-                    ifs=[AQITrigger, WebhookTrigger],
+                    ifs=[WebhookTrigger, AQITrigger],
                     thens=[],
                     elses=[],
                 ),
@@ -996,15 +1351,15 @@ _test__parse_triggers = (
                 'webhook': '/hello',
             },
             [
-                AQITrigger,
                 TimeTrigger,
                 IsoWeekdayTrigger,
                 DateTrigger,
                 CronTrigger,
                 RandomTrigger,
+                WebhookTrigger,
                 SunriseTrigger,
                 SunsetTrigger,
-                WebhookTrigger,
+                AQITrigger,
             ],
             False,
         ),
@@ -1808,3 +2163,25 @@ def test__parse_device_aliases(devices, expect, raises):
         assert _group_to_dict(groups) == _group_to_dict(expect), 'wrong groups returned'
     except PyDomoticConfigParsingError:
         assert raises, 'should not have raised an exception'
+
+@pytest.mark.parametrize('edge,expect', (
+        ('', False),
+        ('edge: true', True),
+        ('edge: false', False),
+        ('edge: yes please', PyDomoticConfigParsingError),
+))
+def test_parse_component_edge(edge, expect):
+    raw_conf = f"""
+automations:
+  a:
+    components:
+      - {edge}
+        if:
+        then:
+"""
+    if expect is PyDomoticConfigParsingError:
+        with pytest.raises(PyDomoticConfigParsingError):
+            parse_raw_yaml(raw_conf)
+    else:
+        components, _ = parse_raw_yaml(raw_conf)
+        assert components[0].edge is expect, 'wrong edge setting'
@@ -0,0 +1,181 @@
+import pytest
+import threading
+
+from pydomotic.parsers import parse_raw_yaml
+from pydomotic.poller import SensorPoller, poll_interval
+from pydomotic.schedule import Schedule
+from pydomotic.sensors import (AQISensor, DeviceSensor, SensorReadings,
+        WeatherSensor)
+from pydomotic.providers.airthings import AirthingsDevice, AirthingsProvider
+from pydomotic.providers.ecobee import EcobeeDevice
+from pydomotic.providers.noop import NoopDevice
+
+class _PolledSensor(object):
+    def __init__(self, poll_interval, rate_limit=None, values=(),
+            rate_limit_key=None):
+        self.poll_interval = poll_interval
+        self.rate_limit = rate_limit
+        self.rate_limit_key = rate_limit_key
+        self.values = list(values)
+        self.calls = 0
+    def read(self):
+        self.calls += 1
+        value = self.values.pop(0)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+@pytest.mark.parametrize('sensor,expect', (
+        (_PolledSensor(None), None),
+        (_PolledSensor(60), 60),
+        (_PolledSensor(60, rate_limit=120), 60),
+        (_PolledSensor(10, rate_limit=120), 30),
+        (AQISensor('key', 0, 0), 900),
+        (WeatherSensor('key', 0, 0), 600),
+        (AirthingsDevice(None, 'name', 'desc'), 300),
+        (NoopDevice(None, 'name', 'desc'), None),
+        (DeviceSensor(AirthingsDevice(None, 'name', 'desc')), 300),
+        (DeviceSensor(EcobeeDevice(None, 'name', 'desc')), 180),
+        (DeviceSensor(NoopDevice(None, 'name', 'desc')), None),
+))
+def test_poll_interval(sensor, expect):
+    assert poll_interval(sensor) == expect, 'wrong poll interval'
+
+def test_sensor_poller_shared_rate_limit():
+    shared = [_PolledSensor(60, rate_limit=120, rate_limit_key='account')
+            for _ in range(3)]
+    other = _PolledSensor(60, rate_limit=120, rate_limit_key='other')
+    own = _PolledSensor(60, rate_limit=120)
+    poller = SensorPoller(SensorReadings(), [(sensor, 'read')
+        for sensor in shared + [other, own]])
+    assert [poller.interval(sensor) for sensor in shared] == [90] * 3, (
+            'reads sharing a rate limit should split it')
+    assert poller.interval(other) == 60, 'wrong interval for other account'
+    assert poller.interval(own) == 60, 'wrong interval for own rate limit'
+
+_test_sensor_poller_devices_yaml = """
+triggers:
+  timezone: America/Los_Angeles
+providers:
+  airthings:
+    client_id: abc
+    client_secret: '123'
+devices:
+  switch-A:
+    provider: noop
+    id: '012'
+  radon-A:
+    provider: airthings
+    id: '123'
+  radon-B:
+    provider: airthings
+    id: '456'
+automations:
+  radon:
+    components:
+      - if:
+          radon-A:
+            radon: '>4'
+          radon-B:
+            radon: '>4'
+        then:
+          turn-on: switch-A
+      - if:
+          radon-A:
+            temp: '>80'
+          switch-A:
+            temp: '>80'
+        then:
+          turn-off: switch-A
+"""
+
+def test_sensor_poller_devices(monkeypatch):
+    components, context = parse_raw_yaml(_test_sensor_poller_devices_yaml)
+    poller = SensorPoller(context.readings, Schedule(components).sensor_reads())
+    radon_a = context.device_sensor('radon-A')
+    radon_b = context.device_sensor('radon-B')
+    assert isinstance(radon_a, DeviceSensor), 'wrong sensor type'
+    assert len(poller) == 3, 'airthings device reads should be polled'
+    assert poller.polls(radon_a, 'current_radon'), 'radon not polled'
+    assert poller.polls(radon_a, 'current_temperature'), (
+            'temperature not polled')
+    assert poller.polls(radon_b, 'current_radon'), 'radon not polled'
+    assert not poller.polls(context.device_sensor('switch-A'),
+            'current_temperature'), 'noop device should not be polled'
+
+    # every read on the account shares its rate limit
+    monkeypatch.setattr(AirthingsDevice, 'rate_limit', 12)
+    assert poller.interval(radon_a) == 900, 'wrong interval'
+    assert poller.interval(radon_b) == 900, 'wrong interval'
+
+    provider = AirthingsProvider('def', '456')
+    other = DeviceSensor(provider.get_device('789', 'radon-C', None))
+    poller.add(other, 'current_radon')
+    assert poller.interval(other) == 300, (
+            'other accounts should have their own rate limit')
+
+def test_sensor_poller_run_pending():
+    readings = SensorReadings()
+    fast = _PolledSensor(60, values=[1, 2, ValueError('oops'), 4])
+    slow = _PolledSensor(300, values=['a', 'b'])
+    never = _PolledSensor(None)
+    poller = SensorPoller(readings, [(fast, 'read'), (slow, 'read'),
+        (fast, 'read'), (never, 'read')])
+    assert len(poller) == 2, 'wrong number of sensors polled'
+
+    assert poller.run_pending(now=1000) == 60, 'wrong time until next poll'
+    assert (fast.calls, slow.calls) == (1, 1), 'all sensors should be polled'
+    assert readings.read(fast, 'read') == 1, 'value not pushed'
+    readings.clear()
+
+    assert poller.run_pending(now=1030) == 30, 'wrong time until next poll'
+    assert (fast.calls, slow.calls) == (1, 1), 'nothing should be polled'
+
+    assert poller.run_pending(now=1060) == 60, 'wrong time until next poll'
+    assert (fast.calls, slow.calls) == (2, 1), 'fast sensor not polled'
+    assert readings.read(fast, 'read') == 2, 'value not pushed'
+    readings.clear()
+
+    poller.run_pending(now=1120)
+    assert fast.calls == 3, 'failed poll should be retried'
+    assert readings.read(fast, 'read') == 2, (
+            'last value should be kept after a failed poll')
+
+    poller.run_pending(now=1300)
+    assert (fast.calls, slow.calls) == (4, 2), 'wrong sensors polled'
+
+def test_sensor_poller_thread():
+    readings = SensorReadings()
+    polled = threading.Event()
+    class _Sensor(object):
+        poll_interval = 3600
+        def read(self):
+            polled.set()
+            return 42
+    sensor = _Sensor()
+    poller = SensorPoller(readings, [(sensor, 'read')])
+    poller.start()
+    try:
+        assert polled.wait(5), 'sensor not polled in the background'
+    finally:
+        poller.stop()
+    assert poller._thread is None, 'thread not stopped'
+    assert readings.read(sensor, 'read') == 42, 'value not pushed'
+
+def test_sensor_poller_nothing_to_poll():
+    poller = SensorPoller(SensorReadings(), [(_PolledSensor(None), 'read')])
+    assert poller.run_pending() is None, 'nothing should be due'
+    poller.start()
+    assert poller._thread is None, 'thread should not be started'
+
+def test_sensor_poller_on_change():
+    readings, changed = SensorReadings(), []
+    sensor = _PolledSensor(60, values=[1, 1, 2, ValueError('oops'), 2])
+    poller = SensorPoller(readings, [(sensor, 'read')],
+            on_change=lambda *read: changed.append(read))
+    assert poller.polls(sensor, 'read'), 'sensor should be polled'
+    for minute in range(5):
+        poller.run_pending(now=60 * minute)
+    assert sensor.calls == 5, 'wrong number of polls'
+    assert changed == [(sensor, 'read')] * 2, (
+            'should only be called when the value changes')
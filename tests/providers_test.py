@@ -1,10 +1,17 @@
-from pydomotic.providers.airthings import AirthingsProvider, AirthingsDevice
+import pytest
+import requests
+import time
+
+from pydomotic.providers.airthings import (AirthingsProvider, AirthingsDevice,
+        AirthingsAPI, AirthingsError)
 from pydomotic.providers.base import DeviceGroup
-from pydomotic.providers.ecobee import EcobeeProvider, EcobeeDevice
+from pydomotic.providers.ecobee import (EcobeeProvider, EcobeeDevice,
+        EcobeeAPI, EcobeeError)
 from pydomotic.providers.fujitsu import FujitsuProvider, FujitsuDevice
 from pydomotic.providers.moen import MoenProvider, MoenDevice
 from pydomotic.providers.noop import NoopProvider, NoopDevice
 from pydomotic.providers.tuya import TuyaProvider, TuyaDevice
+from pydomotic.sensors import DeviceSensor, SensorReadings
 
 def test_fujitsu_provider(patch_fujitsu):
     patch_provider = patch_fujitsu.provider
@@ -13,11 +20,18 @@ def test_fujitsu_provider(patch_fujitsu):
     usr, pwd, tkn, dsn, name, desc = 'usr', 'pwd', 'tkn', 'dsn', 'name', 'desc'
 
     provider = FujitsuProvider(usr, pwd, tokenpath=tkn)
+    assert patch_provider.username is None, 'api should be created lazily'
+
+    device = provider.get_device(dsn, name, desc)
+    assert patch_provider.username is None, 'api should be created lazily'
+    assert patch_device.dsn is None, 'device should be created lazily'
+
+    provider.fujitsu
     assert patch_provider.username == usr, 'wrong username'
     assert patch_provider.password == pwd, 'wrong password'
     assert patch_provider.tokenpath == tkn, 'wrong tokenpath'
 
-    device = provider.get_device(dsn, name, desc)
+    device.device
     assert patch_device == patch_fujitsu.device, 'wrong device'
     assert patch_device.dsn == dsn, 'wrong dsn'
     assert patch_device.api == provider.fujitsu, 'wrong api'
@@ -54,6 +68,8 @@ def test_fujitsu_device(patch_fujitsu):
 def test_tuya_provider(patch_gosundpy):
     usr, pwd, a_id, a_key, name, desc = 'usr', 'pwd', 'id', 'key', 'name', 'desc'
     provider = TuyaProvider(usr, pwd, a_id, a_key)
+    assert patch_gosundpy.username is None, 'api should be created lazily'
+    provider.tuya
     assert patch_gosundpy.username == usr, 'wrong username'
     assert patch_gosundpy.password == pwd, 'wrong password'
     assert patch_gosundpy.access_id == a_id, 'wrong access_id'
@@ -83,20 +99,24 @@ def test_tuya_provider_device_status_cache(patch_gosundpy):
     cache_secs = None
     provider = TuyaProvider('u', 'p', 'ai', 'ak',
             status_cache_seconds=cache_secs)
+    provider.tuya
     assert patch_gosundpy.cache_secs == cache_secs, 'wrong caching value'
 
     cache_secs = 50
     provider = TuyaProvider('u', 'p', 'ai', 'ak',
             status_cache_seconds=cache_secs)
+    provider.tuya
     assert patch_gosundpy.cache_secs == cache_secs, 'wrong caching value'
 
 def test_tuya_provider_timeout(patch_gosundpy):
     timeout = None
     provider = TuyaProvider('u', 'p', 'ai', 'ak', timeout=timeout)
+    provider.tuya
     assert patch_gosundpy.timeout == timeout, 'wrong timeout value'
 
     timeout = 50
     provider = TuyaProvider('u', 'p', 'ai', 'ak', timeout=timeout)
+    provider.tuya
     assert patch_gosundpy.timeout == timeout, 'wrong timeout value'
 
 def test_tuya_device(patch_gosundpy):
@@ -173,9 +193,75 @@ def test_airthings_provider_timeout(patch_airthings):
     provider = AirthingsProvider('i', 's', timeout=timeout)
     assert patch_airthings.timeout == timeout, 'wrong timeout value'
 
+def test_airthings_provider_location_id(patch_airthings):
+    provider = AirthingsProvider('i', 's', location_id='location')
+    assert patch_airthings.location_id == 'location', 'wrong location_id'
+
+@pytest.fixture
+def patch_airthings_requests(monkeypatch):
+    calls = []
+    class _response(object):
+        def __init__(self, data):
+            self.data = data
+        def raise_for_status(self):
+            pass
+        def json(self):
+            return self.data
+    def post(url, **kwargs):
+        calls.append(url)
+        return _response({'access_token': 'token', 'expires_in': 3600})
+    def get(url, **kwargs):
+        calls.append(url)
+        if '/locations/' in url:
+            return _response({'devices': [
+                {'id': 'a', 'data': {'temp': 0}},
+                {'id': 'b', 'data': {'temp': 100}},
+                {'id': '2930012345', 'data': {'temp': 10}},
+            ]})
+        return _response({'data': {'temp': 0}})
+    monkeypatch.setattr('requests.post', post)
+    monkeypatch.setattr('requests.get', get)
+    return calls
+
+def test_airthings_api_reuses_auth_token(patch_airthings_requests, monkeypatch):
+    api = AirthingsAPI('client_id', 'client_secret')
+    for _ in range(3):
+        api.fetch_data('a')
+    auth_calls = [c for c in patch_airthings_requests
+            if c == AirthingsAPI._auth_token_url]
+    assert len(auth_calls) == 1, 'auth token should be reused'
+    assert len(patch_airthings_requests) == 4, 'wrong number of requests'
+
+    now = time.time()
+    monkeypatch.setattr('time.time', lambda: now + 3600 - 30)
+    api.fetch_data('a')
+    auth_calls = [c for c in patch_airthings_requests
+            if c == AirthingsAPI._auth_token_url]
+    assert len(auth_calls) == 2, 'auth token should be refreshed before expiry'
+
+def test_airthings_api_location_id(patch_airthings_requests):
+    api = AirthingsAPI('client_id', 'client_secret', location_id='loc')
+    device_a, device_b = api.get_device('a'), api.get_device('b')
+    assert device_a.get_temperature() == 32, 'wrong temperature'
+    assert device_b.get_temperature() == 212, 'wrong temperature'
+    assert device_a.get_temperature() == 32, 'wrong temperature'
+    assert len(patch_airthings_requests) == 2, (
+            'all devices should be fetched in one request')
+    assert api.get_device(2930012345).get_temperature() == 50, (
+            'numeric device ids should match')
+
+    with pytest.raises(AirthingsError):
+        api.get_device('c').get_temperature()
+
 def test_moen_provider(patch_moen):
     usr, pwd, name, desc = 'usr', 'pwd', 'name', 'desc'
     provider = MoenProvider(usr, pwd)
+    assert patch_moen.username is None, 'api should be created lazily'
+
+    device = provider.get_device(patch_moen.device_id, name, desc)
+    assert patch_moen.username is None, 'api should be created lazily'
+
+    provider.flo
     assert patch_moen.username == usr, 'wrong username'
     assert patch_moen.password == pwd, 'wrong password'
 
@@ -233,6 +319,90 @@ def test_ecobee_device(patch_ecobee):
     device.current_temperature()
     assert patch_ecobee.device.get_temperature_called, 'device.get_temperature not called'
 
+def test_ecobee_provider_data_cache(patch_ecobee):
+    cache_secs = None
+    provider = EcobeeProvider('key', 'token', data_cache_seconds=cache_secs)
+    assert patch_ecobee.cache_secs == cache_secs, 'wrong caching value'
+
+    cache_secs = 50
+    provider = EcobeeProvider('key', 'token', data_cache_seconds=cache_secs)
+    assert patch_ecobee.cache_secs == cache_secs, 'wrong caching value'
+
+def _ecobee_capability(temperature, humidity):
+    return [
+            {'type': 'temperature', 'value': str(temperature * 10)},
+            {'type': 'humidity', 'value': str(humidity)},
+    ]
+
+_test_ecobee_thermostat = {
+        'thermostatList': [
+            {
+                'remoteSensors': [
+                    {'id': 'ei:0', 'capability': _ecobee_capability(70, 40)},
+                    {'id': 'rs:100', 'capability': _ecobee_capability(65, 45)},
+                ],
+            },
+            {
+                'remoteSensors': [
+                    {'id': 'rs:101', 'capability': _ecobee_capability(60, 50)},
+                ],
+            },
+        ],
+}
+
+@pytest.fixture
+def patch_ecobee_requests(monkeypatch):
+    calls = []
+    def request(method, url, params=None, headers=None):
+        calls.append((method, url))
+        class _response(object):
+            def raise_for_status(self):
+                pass
+            def json(self):
+                if url == EcobeeAPI.token_url:
+                    return {'expires_in': 3600, 'access_token': 'token',
+                            'token_type': 'Bearer'}
+                return _test_ecobee_thermostat
+        return _response()
+    monkeypatch.setattr('requests.request', request)
+    return calls
+
+@pytest.mark.parametrize('cache_secs,requests_made', ((None, 2), (0, 5)))
+def test_ecobee_api_sensor_reads(cache_secs, requests_made,
+        patch_ecobee_requests):
+    api = EcobeeAPI('app_key', 'refresh_token', data_cache_seconds=cache_secs)
+    devices = [api.get_device(i) for i in ('ei:0', 'rs:100', 'rs:101')]
+    assert [d.get_temperature() for d in devices] == [70, 65, 60], (
+            'wrong temperatures')
+    assert [d.get_humidity() for d in devices[:1]] == [40], 'wrong humidity'
+    assert len(patch_ecobee_requests) == requests_made, (
+            'wrong number of requests made')
+
+def test_ecobee_api_concurrent_sensor_reads(patch_ecobee_requests,
+        monkeypatch):
+    request = requests.request
+    def slow_request(*args, **kwargs):
+        time.sleep(0.05)
+        return request(*args, **kwargs)
+    monkeypatch.setattr('requests.request', slow_request)
+
+    api = EcobeeAPI('app_key', 'refresh_token')
+    sensors = [DeviceSensor(EcobeeDevice(api.get_device(i), f'device-{i}', ''))
+            for i in ('ei:0', 'rs:100', 'rs:101') for _ in range(4)]
+    readings = SensorReadings()
+    readings.prefetch([(sensor, 'current_temperature') for sensor in sensors])
+    assert [readings.read(sensor, 'current_temperature')
+            for sensor in sensors[::4]] == [70, 65, 60], 'wrong temperatures'
+    assert patch_ecobee_requests == [
+            ('POST', EcobeeAPI.token_url),
+            ('GET', EcobeeAPI.thermostat_url),
+    ], 'concurrent reads should share one token and thermostat request'
+
+def test_ecobee_api_sensor_not_found(patch_ecobee_requests):
+    api = EcobeeAPI('app_key', 'refresh_token')
+    with pytest.raises(EcobeeError):
+        api.get_device('rs:999').get_temperature()
+
 def test_device_group(mock_devices):
     group = DeviceGroup(mock_devices, 'group_name')
     assert len(group.devices) == len(mock_devices), 'wrong number of devices'
@@ -0,0 +1,150 @@
+import datetime
+import pytest
+
+from pydomotic.components import Component
+from pydomotic.schedule import Schedule
+from pydomotic.triggers import (AQITrigger, IsoWeekdayTrigger, RadonTrigger,
+        RandomTrigger, SunriseTrigger, TimeTrigger)
+
+@pytest.mark.parametrize('max_bucketed_minutes', (0, 32, 10080))
+def test_schedule_candidates(mock_time_sensor, mock_action_1, mock_action_2,
+        max_bucketed_minutes, monkeypatch):
+    monkeypatch.setattr(Schedule, 'max_bucketed_minutes', max_bucketed_minutes)
+    # 1982-02-04 10:20 is a thursday
+    now = mock_time_sensor.get_current_datetime()
+    at_620 = TimeTrigger([620], time_sensor=mock_time_sensor)
+    at_621 = TimeTrigger([621], time_sensor=mock_time_sensor)
+    thursday = IsoWeekdayTrigger((4,), time_sensor=mock_time_sensor)
+    friday = IsoWeekdayTrigger((5,), time_sensor=mock_time_sensor)
+    components = [
+            Component('now', [at_620], [mock_action_1], []),
+            Component('later', [at_621], [mock_action_1], []),
+            Component('random', [RandomTrigger(0.5)], [mock_action_1], []),
+            Component('else', [at_621], [mock_action_1], [mock_action_2]),
+            Component('thursday', [thursday, at_620], [mock_action_1], []),
+            Component('friday', [friday, at_620], [mock_action_1], []),
+            Component('never', [friday, thursday], [mock_action_1], []),
+    ]
+    schedule = Schedule(components)
+    assert schedule.time_sensor is mock_time_sensor, 'wrong time sensor'
+
+    actual = [c.name for c in schedule.candidates()]
+    assert actual == ['now', 'random', 'else', 'thursday'], (
+            'wrong candidates')
+
+    later = now + datetime.timedelta(minutes=1)
+    actual = [c.name for c in schedule.candidates(later)]
+    assert actual == ['later', 'random', 'else'], 'wrong candidates'
+
+def test_schedule_candidates_time_range(mock_time_sensor, mock_action_1):
+    # 1982-02-04 10:20 is a thursday
+    now = mock_time_sensor.get_current_datetime()
+    mornings = TimeTrigger(range(360, 660), time_sensor=mock_time_sensor)
+    evenings = TimeTrigger(range(1080, 1320), time_sensor=mock_time_sensor)
+    friday = IsoWeekdayTrigger((5,), time_sensor=mock_time_sensor)
+    schedule = Schedule([
+            Component('mornings', [mornings], [mock_action_1], []),
+            Component('evenings', [evenings], [mock_action_1], []),
+            Component('friday', [friday, evenings], [mock_action_1], []),
+    ])
+    assert not schedule._minutes, 'large ranges should not be bucketed'
+    assert [c.name for c in schedule.candidates()] == ['mornings'], (
+            'wrong candidates')
+    later = now.replace(day=5, hour=18)
+    assert [c.name for c in schedule.candidates(later)] == [
+            'evenings', 'friday'], 'wrong candidates'
+    assert schedule.next_run() == now.replace(minute=21, second=0), (
+            'wrong next run')
+    assert schedule.next_run(now.replace(hour=11)) == now.replace(hour=18,
+            minute=0, second=0), 'wrong next run'
+
+def test_schedule_candidates_unscheduled(mock_enabled_component,
+        mock_disabled_component):
+    components = [mock_enabled_component, mock_disabled_component]
+    schedule = Schedule(components)
+    assert schedule.time_sensor is None, 'should not have time sensor'
+    assert schedule.candidates() == components, 'wrong candidates'
+
+def test_schedule_next_run(mock_time_sensor, mock_action_1, test_datetime):
+    # 1982-02-04 10:20 is a thursday
+    at_8am = TimeTrigger([480], time_sensor=mock_time_sensor)
+    at_8pm = TimeTrigger([1200], time_sensor=mock_time_sensor)
+    monday = IsoWeekdayTrigger((1,), time_sensor=mock_time_sensor)
+    schedule = Schedule([
+            Component('8am', [at_8am], [mock_action_1], []),
+            Component('8pm', [at_8pm, monday], [mock_action_1], []),
+    ])
+    expect = test_datetime.replace(day=5, hour=8, minute=0)
+    assert schedule.next_run() == expect, 'wrong next run'
+
+    schedule.components[0].ifs[0] = at_8pm
+    schedule = Schedule(schedule.components)
+    expect = test_datetime.replace(hour=20, minute=0)
+    assert schedule.next_run() == expect, 'wrong next run'
+    now = test_datetime.replace(day=7, hour=20, minute=0, second=30)
+    expect = test_datetime.replace(day=8, hour=20, minute=0)
+    assert schedule.next_run(now) == expect, 'next run should wrap week'
+
+def test_schedule_next_run_unscheduled(mock_time_sensor, mock_sun_sensor,
+        mock_aqi_sensor, mock_action_1, mock_action_2, test_datetime):
+    mock_time_sensor.tzinfo = test_datetime.tzinfo
+    at_8pm = TimeTrigger([1200], time_sensor=mock_time_sensor)
+    aqi = AQITrigger(lambda aqi: True, mock_aqi_sensor)
+    mock_sun_sensor.sunrise = test_datetime.replace(hour=6, minute=45)
+    sunrise = SunriseTrigger([-15], time_sensor=mock_time_sensor,
+            sun_sensor=mock_sun_sensor)
+    minutes = lambda m: test_datetime + datetime.timedelta(minutes=m)
+
+    schedule = Schedule([Component('aqi', [aqi], [mock_action_1], [])])
+    assert schedule.time_sensor is None, 'should not have time sensor'
+    assert schedule.next_run(test_datetime) == minutes(15), 'aqi should poll'
+
+    schedule = Schedule([Component('sunrise', [sunrise], [mock_action_1], [])])
+    expect = test_datetime.replace(day=5, hour=6, minute=30)
+    assert schedule.next_run() == expect, 'wrong sunrise run'
+
+    schedule = Schedule([
+            Component('aqi', [aqi], [mock_action_1], []),
+            Component('random', [RandomTrigger(0.5)], [mock_action_1], []),
+    ])
+    assert schedule.next_run(test_datetime) == minutes(1), (
+            'random should poll')
+
+    schedule = Schedule([
+            Component('else', [at_8pm], [mock_action_1], [mock_action_2]),
+    ])
+    assert schedule.next_run(test_datetime) == minutes(1), (
+            'else should run every minute')
+
+    assert Schedule([]).next_run() is None, 'empty schedule should not run'
+
+def test_schedule_dependents(mock_time_sensor, mock_aqi_sensor,
+        mock_radon_sensor, mock_action_1):
+    at_620 = TimeTrigger([620], time_sensor=mock_time_sensor)
+    aqi = AQITrigger(lambda aqi: True, mock_aqi_sensor)
+    also_aqi = AQITrigger(lambda aqi: False, mock_aqi_sensor)
+    radon = RadonTrigger(lambda radon: True, mock_radon_sensor)
+    components = [
+            Component('aqi', [aqi, also_aqi], [mock_action_1], []),
+            Component('time', [at_620], [mock_action_1], []),
+            Component('both', [radon, at_620, aqi], [mock_action_1], []),
+    ]
+    schedule = Schedule(components)
+    assert schedule.sensor_reads() == [(mock_aqi_sensor, 'get_aqi'),
+            (mock_radon_sensor, 'current_radon')], 'wrong sensor reads'
+    actual = [c.name for c in schedule.dependents(mock_aqi_sensor, 'get_aqi')]
+    assert actual == ['aqi', 'both'], 'wrong aqi dependents'
+    actual = [c.name for c in schedule.dependents(mock_radon_sensor,
+        'current_radon')]
+    assert actual == ['both'], 'wrong radon dependents'
+    assert schedule.dependents(mock_time_sensor, 'get_aqi') == [], (
+            'unknown sensor should have no dependents')
+
+def test_schedule_edge_components(mock_time_sensor, mock_action_1):
+    later = TimeTrigger([621], time_sensor=mock_time_sensor)
+    schedule = Schedule([
+            Component('edge', [later], [mock_action_1], [], edge=True),
+            Component('level', [later], [mock_action_1], []),
+    ])
+    actual = [c.name for c in schedule.candidates()]
+    assert actual == ['edge'], 'edge components should always be checked'
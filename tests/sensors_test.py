@@ -1,7 +1,8 @@
 import datetime
 import pytest
 
-from pydomotic.sensors import AQISensor, AQISensorError, SunSensor, TimeSensor
+from pydomotic.sensors import (AQISensor, AQISensorError, SensorReadings,
+        SunSensor, TimeSensor)
 
 _test_latitude, _test_longitude, _test_tz_pst, _test_tz_utc, _test_tz_est = (
         40.68968910058536, -74.04450029112631,
@@ -87,6 +88,31 @@ def test_sun_sensor_get_sunset(mock_time_sensor):
     assert actual.hour == 17, 'wrong hour returned'
     assert actual.minute == 18, 'wrong minute returned'
 
+def test_sun_sensor_day_boundary(mock_time_sensor):
+    sensor = SunSensor(latitude=45.58, longitude=-122.11,
+            time_sensor=mock_time_sensor)
+    assert sensor.get_sunrise().day == 4, 'wrong day returned'
+    assert len(sensor._table) == SunSensor.table_days, 'wrong table size'
+
+    mock_time_sensor.test_datetime += datetime.timedelta(hours=14)
+    assert sensor.get_sunrise().day == 5, 'stale day returned after midnight'
+    assert sensor.get_sunset().day == 5, 'stale day returned after midnight'
+
+    assert len(sensor._table) == SunSensor.table_days, (
+            'table should not be extended within the window')
+
+    mock_time_sensor.test_datetime += datetime.timedelta(days=5)
+    actual = sensor.get_sunset()
+    assert actual.date() == mock_time_sensor.test_datetime.date(), (
+            'table not extended')
+    assert len(sensor._table) == SunSensor.table_days, 'wrong table size'
+    assert min(sensor._table) == actual.date(), 'past days not dropped'
+
+def test_sun_sensor_polar(mock_time_sensor):
+    sensor = SunSensor(latitude=89, longitude=0, time_sensor=mock_time_sensor)
+    with pytest.raises(ValueError):
+        sensor.get_sunrise()
+
 _test_TimeSensor_tzinfo = (
         ({
             'latitude': None,
@@ -139,3 +165,78 @@ def test_TimeSensor_tzinfo(kwargs, expect, raises):
     else:
         assert not raises, 'should not have raised exception'
         assert expect == str(tzinfo)
+
+def test_TimeSensor_freeze(test_datetime):
+    sensor = TimeSensor(timezone=_test_tz_pst)
+    tick = sensor.freeze(test_datetime)
+    assert sensor.get_current_datetime() is test_datetime, (
+            'frozen datetime not returned')
+    assert sensor.get_current_tick() is tick, 'frozen tick not returned'
+    assert tick.date == datetime.date(1982, 2, 4), 'wrong date'
+    assert tick.isoweekday == 4, 'wrong isoweekday'
+    assert tick.minute_of_day == 620, 'wrong minute of day'
+    assert tick.minute_of_week == 3*1440 + 620, 'wrong minute of week'
+
+    sensor.unfreeze()
+    now = sensor.get_current_datetime()
+    assert now.year > 1982, 'current datetime not returned'
+    assert sensor.freeze().datetime >= now, 'current datetime not frozen'
+
+def test_sensor_readings(mock_aqi_sensor):
+    readings = SensorReadings()
+    mock_aqi_sensor.aqi = 50
+    readings.prefetch([(mock_aqi_sensor, 'get_aqi')] * 3)
+    assert mock_aqi_sensor.get_aqi_called, 'sensor.get_aqi not called'
+
+    mock_aqi_sensor.aqi = 100
+    assert readings.read(mock_aqi_sensor, 'get_aqi') == 50, (
+            'should read prefetched value')
+
+    readings.clear()
+    assert readings.read(mock_aqi_sensor, 'get_aqi') == 100, (
+            'should read live value after clear')
+
+def test_sensor_readings_push(mock_aqi_sensor, monkeypatch):
+    readings = SensorReadings()
+    now = [100.0]
+    monkeypatch.setattr('time.monotonic', lambda: now[0])
+    readings.push(mock_aqi_sensor, 'get_aqi', 50, max_age=60)
+    mock_aqi_sensor.aqi = 100
+    readings.prefetch([(mock_aqi_sensor, 'get_aqi')])
+    assert not mock_aqi_sensor.get_aqi_called, 'pushed value should be used'
+    assert readings.read(mock_aqi_sensor, 'get_aqi') == 50, (
+            'should read pushed value')
+
+    readings.push(mock_aqi_sensor, 'get_aqi', 75, max_age=60)
+    assert readings.read(mock_aqi_sensor, 'get_aqi') == 50, (
+            'value should not change during a run')
+    readings.clear()
+    assert readings.read(mock_aqi_sensor, 'get_aqi') == 75, (
+            'pushed value should outlive a run')
+
+    readings.clear()
+    now[0] += 61
+    assert readings.read(mock_aqi_sensor, 'get_aqi') == 100, (
+            'expired value should be read live')
+
+def test_sensor_readings_concurrent(mock_aqi_sensor, mock_radon_sensor):
+    import concurrent.futures
+    readings = SensorReadings()
+    mock_aqi_sensor.aqi, mock_radon_sensor.radon = 10, 20
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        readings.prefetch([(mock_aqi_sensor, 'get_aqi'),
+            (mock_radon_sensor, 'current_radon')], executor=executor)
+    mock_aqi_sensor.aqi, mock_radon_sensor.radon = 0, 0
+    assert readings.read(mock_aqi_sensor, 'get_aqi') == 10, 'wrong aqi'
+    assert readings.read(mock_radon_sensor, 'current_radon') == 20, (
+            'wrong radon')
+
+def test_sensor_readings_prefetch_fails(mock_aqi_sensor):
+    readings = SensorReadings()
+    mock_aqi_sensor.aqi = None
+    mock_aqi_sensor.get_aqi = lambda: 1 / mock_aqi_sensor.aqi
+    readings.prefetch([(mock_aqi_sensor, 'get_aqi')])
+
+    mock_aqi_sensor.aqi = 2
+    assert readings.read(mock_aqi_sensor, 'get_aqi') == 0.5, (
+            'failed prefetch should be read live')
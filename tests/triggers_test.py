@@ -1,4 +1,6 @@
+import croniter
 import datetime
+import pytest
 
 from pydomotic.triggers import (AQITrigger, IsoWeekdayTrigger, TimeTrigger,
         DateTrigger, CronTrigger, RandomTrigger, SunriseTrigger, SunsetTrigger,
@@ -53,6 +55,14 @@ def test_time_trigger_does_not_fire_different_minute(mock_time_sensor):
     fires = trigger.check()
     assert not fires, 'trigger fired'
 
+def test_time_trigger_all_day(mock_time_sensor):
+    trigger = TimeTrigger(range(1440), time_sensor=mock_time_sensor)
+    for minute in range(0, 1440, 7):
+        mock_time_sensor.test_datetime = mock_time_sensor.test_datetime.replace(
+                hour=minute // 60, minute=minute % 60)
+        assert trigger.check(), f'trigger did not fire at minute {minute}'
+    assert trigger.times == list(range(1440)), 'wrong times'
+
 def test_date_trigger_fires(mock_time_sensor):
     trigger = DateTrigger([datetime.date(1982, 2, 4)],
             time_sensor=mock_time_sensor)
@@ -123,6 +133,14 @@ def test_sunrise_trigger_does_not_fire(mock_time_sensor, mock_sun_sensor, test_d
     assert mock_sun_sensor.get_sunrise_called, 'sensor.get_sunrise not called'
     assert not mock_sun_sensor.get_sunset_called, 'sensor.get_sunset called'
 
+def test_sunrise_trigger_negative_timedelta(mock_time_sensor, mock_sun_sensor,
+        test_datetime):
+    mock_sun_sensor.sunrise = test_datetime + datetime.timedelta(minutes=30)
+    trigger = SunriseTrigger([-30, 3000], time_sensor=mock_time_sensor,
+            sun_sensor=mock_sun_sensor)
+    assert trigger.check(), 'trigger did not fire'
+    assert trigger.timedeltas == [-30], 'wrong timedeltas'
+
 def test_sunset_trigger_fires(mock_time_sensor, mock_sun_sensor, test_datetime):
     mock_sun_sensor.sunset = test_datetime - datetime.timedelta(minutes=75)
     trigger = SunsetTrigger([75], time_sensor=mock_time_sensor,
@@ -160,3 +178,102 @@ def test_aqi_trigger_does_not_fire(mock_weather_sensor):
     assert not fires, 'trigger fired'
     assert mock_weather_sensor.current_temperature_called, (
             'sensor.current_temperature not called')
+
+_test_minutes_of_week = (
+        lambda ts: TimeTrigger([620, 1439], time_sensor=ts),
+        lambda ts: IsoWeekdayTrigger((2, 7), time_sensor=ts),
+        lambda ts: DateTrigger([datetime.date(1982, 2, 5)], time_sensor=ts),
+        lambda ts: CronTrigger('*/15 8-9 * * mon-fri', time_sensor=ts),
+        lambda ts: CronTrigger('0 10 * * sun', time_sensor=ts),
+        lambda ts: CronTrigger('0 10 1 * sun', time_sensor=ts),
+        lambda ts: CronTrigger('30 * * * *', time_sensor=ts),
+)
+
+@pytest.mark.parametrize('make_trigger', _test_minutes_of_week)
+def test_trigger_minutes_of_week(make_trigger, mock_time_sensor):
+    trigger = make_trigger(mock_time_sensor)
+    minutes = trigger.minutes_of_week()
+    # 1982-02-01 is a monday
+    start = datetime.datetime(1982, 2, 1, tzinfo=mock_time_sensor.tzinfo)
+    for minute in range(0, 7 * 24 * 60, 5):
+        mock_time_sensor.test_datetime = start + datetime.timedelta(
+                minutes=minute)
+        if trigger.check():
+            assert minutes >> minute & 1, f'minute {minute} should be scheduled'
+
+@pytest.mark.parametrize('make_trigger,expect', (
+        (lambda ts: TimeTrigger([620], time_sensor=ts),
+            {620 + 1440*i for i in range(7)}),
+        (lambda ts: IsoWeekdayTrigger((1,), time_sensor=ts), set(range(1440))),
+        (lambda ts: CronTrigger('0 10 * * sun', time_sensor=ts), {9240}),
+        (lambda ts: CronTrigger('*/30 8-9 * * mon', time_sensor=ts),
+            {480, 510, 540, 570}),
+))
+def test_trigger_minutes_of_week_values(make_trigger, expect,
+        mock_time_sensor):
+    actual = make_trigger(mock_time_sensor).minutes_of_week()
+    assert actual == sum(1 << minute for minute in expect), (
+            'wrong minutes of week')
+
+def test_trigger_minutes_of_week_unknown():
+    assert RandomTrigger(0.5).minutes_of_week() is None, (
+            'random trigger minutes should be unknown')
+
+_test_cron_expressions = (
+        '* * * * *',
+        '*/15 8-9 * * mon-fri',
+        '0 10 * * sun',
+        '0 0 * * 7',
+        '0 10 1 * sun',
+        '5,35 */2 1-10 jan,jun *',
+        '0 0 L * *',
+        '0 0 * * mon#2',
+        '* * * * * 30',
+)
+
+@pytest.mark.parametrize('cron', _test_cron_expressions)
+def test_cron_trigger_matches_croniter(cron, mock_time_sensor):
+    trigger = CronTrigger(cron, time_sensor=mock_time_sensor)
+    start = datetime.datetime(1982, 1, 1, tzinfo=mock_time_sensor.tzinfo)
+    for minute in range(0, 370 * 24 * 60, 499):
+        now = start + datetime.timedelta(minutes=minute)
+        mock_time_sensor.test_datetime = now
+        assert trigger.check() == croniter.croniter.match(cron, now), (
+                f'wrong check at {now}')
+
+@pytest.mark.parametrize('cron', _test_cron_expressions + ('0 12 29 2 *',))
+def test_cron_trigger_next_fire_time(cron, mock_time_sensor):
+    trigger = CronTrigger(cron, time_sensor=mock_time_sensor)
+    # croniter skips hours across daylight savings changes
+    now = datetime.datetime(1982, 2, 4, 10, 20, tzinfo=datetime.timezone.utc)
+    expect = croniter.croniter(cron, now).get_next(datetime.datetime)
+    if len(cron.split()) == 5:
+        expect = expect.replace(second=0)
+    for _ in range(5):
+        actual = trigger.next_fire_time(now)
+        assert actual == expect, f'wrong next fire time after {now}'
+        now = actual
+        expect = croniter.croniter(cron, now).get_next(datetime.datetime)
+
+def test_cron_trigger_next_fire_time_never(mock_time_sensor):
+    trigger = CronTrigger('0 0 30 2 *', time_sensor=mock_time_sensor)
+    assert trigger.next_fire_time() is None, 'should never fire'
+
+@pytest.mark.parametrize('timedeltas,hour,minute,expect', (
+        ([0], 5, 0, (4, 6, 45)),
+        ([0], 6, 45, (5, 6, 45)),
+        ([-30, 30], 7, 0, (4, 7, 15)),
+        ([-30, 30], 7, 15, (5, 6, 15)),
+        ([-420], 0, 0, None),
+        ([1100], 6, 0, None),
+))
+def test_sunrise_trigger_next_fire_time(timedeltas, hour, minute, expect,
+        mock_time_sensor, mock_sun_sensor, test_datetime):
+    mock_sun_sensor.sunrise = test_datetime.replace(hour=6, minute=45)
+    trigger = SunriseTrigger(timedeltas, time_sensor=mock_time_sensor,
+            sun_sensor=mock_sun_sensor)
+    now = test_datetime.replace(hour=hour, minute=minute)
+    if expect is not None:
+        day, hour, minute = expect
+        expect = test_datetime.replace(day=day, hour=hour, minute=minute)
+    assert trigger.next_fire_time(now) == expect, 'wrong next fire time'
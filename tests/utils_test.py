@@ -1,8 +1,12 @@
+import asyncio
+import os
 import pytest
+import threading
 import time
 
-from pydomotic.utils import (cache_value, _camel_to_snake, ObjectMetaclass,
-        import_method)
+from pydomotic.utils import (cache_value, lazy_value, AsyncMixin, FileCacheStore,
+        HTTPSession,
+        _camel_to_snake, ObjectMetaclass, import_method)
 
 import testdata.custom_code
 
@@ -73,6 +77,193 @@ def test_cache_value_fallback():
         fn()
     assert fn() == 3, 'wrong value returned'
 
+def test_cache_value_keyed_by_arguments():
+    calls = []
+
+    @cache_value(seconds=60)
+    def test_fn(a, b=None):
+        calls.append((a, b))
+        return len(calls)
+
+    assert test_fn(1) == 1, 'wrong value returned'
+    assert test_fn(2) == 2, 'wrong value returned'
+    assert test_fn(1) == 1, 'wrong value returned'
+    assert test_fn(1, b=2) == 3, 'wrong value returned'
+    assert test_fn(1, b=2) == 3, 'wrong value returned'
+    assert test_fn([1]) == 4, 'unhashable arguments should not be cached'
+    assert test_fn([1]) == 5, 'unhashable arguments should not be cached'
+
+def test_cache_value_keyed_by_instance():
+    class MyClass(object):
+        def __init__(self, value):
+            self.value = value
+        @cache_value(seconds=60)
+        def get_value(self):
+            return self.value
+
+    obj_1, obj_2 = MyClass(1), MyClass(2)
+    assert obj_1.get_value() == 1, 'wrong value returned'
+    assert obj_2.get_value() == 2, 'wrong value returned'
+    obj_1.value = obj_2.value = 3
+    assert obj_1.get_value() == 1, 'wrong value returned'
+    assert obj_2.get_value() == 2, 'wrong value returned'
+
+def test_cache_value_concurrent_calls():
+    calls = []
+    started = threading.Event()
+
+    @cache_value(seconds=60)
+    def test_fn(a):
+        calls.append(a)
+        started.set()
+        time.sleep(0.05)
+        return a
+
+    threads = [threading.Thread(target=test_fn, args=(1,)) for _ in range(5)]
+    threads.append(threading.Thread(target=test_fn, args=(2,)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(calls) == [1, 2], (
+            'concurrent calls with the same arguments should wait on one call')
+
+def test_cache_value_maxsize():
+    calls = []
+
+    @cache_value(seconds=60, maxsize=2)
+    def test_fn(a):
+        calls.append(a)
+        return a
+
+    for a in (1, 2, 1, 3, 1, 2):
+        test_fn(a)
+    assert calls == [1, 2, 3, 2], 'least recently used value not evicted'
+
+def test_file_cache_store(tmp_path):
+    store = FileCacheStore(str(tmp_path / 'cache'))
+    assert store.get('key') is None, 'empty store should return None'
+    store.set('key', 100.5, {'value': [1, 2]})
+    assert store.get('key') == (100.5, {'value': [1, 2]}), 'wrong entry'
+
+    other = FileCacheStore(str(tmp_path / 'cache'))
+    assert other.get('key') == (100.5, {'value': [1, 2]}), (
+            'entry not shared between stores')
+    other.set('key', 200, 'new')
+    assert store.get('key') == (200, 'new'), 'entry not replaced'
+
+    store.set('unpicklable', 0, lambda: None)
+    assert store.get('unpicklable') is None, 'unpicklable value stored'
+
+def test_file_cache_store_private(tmp_path):
+    FileCacheStore(str(tmp_path / 'cache'))
+    assert (tmp_path / 'cache').stat().st_mode & 0o777 == 0o700, (
+            'cache directory should be private')
+
+    shared = tmp_path / 'shared'
+    shared.mkdir()
+    os.chmod(shared, 0o777)
+    with pytest.raises(PermissionError):
+        FileCacheStore(str(shared))
+    assert not (shared / FileCacheStore.filename).exists(), (
+            'shared directory should not be used')
+
+    (tmp_path / 'link').symlink_to(tmp_path / 'cache')
+    with pytest.raises(PermissionError):
+        FileCacheStore(str(tmp_path / 'link'))
+
+def test_cache_value_file_cache_store(tmp_path):
+    store = FileCacheStore(str(tmp_path))
+    def make_class():
+        # a new class for every process, with its own in memory cache
+        class MyClass(object):
+            cache_key = 'my-class'
+            def __init__(self, value):
+                self.cache_store = store
+                self.value = value
+                self.get_bound = cache_value(seconds=60)(self.get_bound)
+            @cache_value(seconds=60)
+            def get_value(self, arg):
+                return self.value + arg
+            def get_bound(self):
+                return self.value
+        return MyClass
+
+    obj_1 = make_class()(1)
+    assert obj_1.get_value(10) == 11, 'wrong value returned'
+    assert obj_1.get_bound() == 1, 'wrong value returned'
+
+    obj_2 = make_class()(2)
+    assert obj_2.get_value(10) == 11, 'value not read from store'
+    assert obj_2.get_value(20) == 22, 'arguments not part of store key'
+    assert obj_2.get_bound() == 1, 'value not read from store'
+
+    obj_3 = make_class()(3)
+    obj_3.cache_key = 'other'
+    assert obj_3.get_value(10) == 13, 'cache key not part of store key'
+
+def test_cache_value_file_cache_store_expired(tmp_path, monkeypatch):
+    store = FileCacheStore(str(tmp_path))
+    store.set("my-class:get_value:():[]", time.time() - 120, 'stale')
+    class MyClass(object):
+        cache_key = 'my-class'
+        cache_store = store
+        fail = False
+        @cache_value(seconds=60, fallback_on_error=True)
+        def get_value(self):
+            if self.fail:
+                raise ValueError
+            return 'fresh'
+
+    obj = MyClass()
+    obj.fail = True
+    assert obj.get_value() == 'stale', 'should fall back to stored value'
+    obj.get_value.clear_cache()
+    obj.fail = False
+    assert obj.get_value() == 'fresh', 'expired value returned'
+    assert store.get("my-class:get_value:():[]")[1] == 'fresh', (
+            'store not updated')
+
+def test_lazy_value():
+    calls = []
+    def load():
+        calls.append(1)
+        return 'value'
+
+    value = lazy_value(load)
+    assert not calls, 'value should not be loaded until requested'
+    assert value.get() == 'value', 'wrong value returned'
+    assert value.get() == 'value', 'wrong value returned'
+    assert len(calls) == 1, 'value should only be loaded once'
+
+def test_async_mixin():
+    class Thing(AsyncMixin):
+        value = 'hello'
+        def get(self, suffix):
+            return threading.current_thread(), self.value + suffix
+
+    thread, value = asyncio.run(Thing().aio.get(' world'))
+    assert value == 'hello world', 'wrong value returned'
+    assert thread is not threading.main_thread(), 'should run in a thread'
+
+@pytest.mark.parametrize('timeout,kwargs,expect', (
+        (None, {}, None),
+        (5, {}, 5),
+        (5, {'timeout': None}, 5),
+        (5, {'timeout': 2}, 2),
+))
+def test_http_session_timeout(timeout, kwargs, expect, monkeypatch):
+    requested = {}
+    def request(self, method, url, **kw):
+        requested.update(kw)
+    monkeypatch.setattr('requests.Session.request', request)
+    session = HTTPSession(pool_size=2, retries=3, timeout=timeout)
+    session.get('https://example.com', **kwargs)
+    assert requested['timeout'] == expect, 'wrong timeout used'
+
+    adapter = session.get_adapter('https://example.com')
+    assert adapter.max_retries.total == 3, 'wrong number of retries'
+
 _test__camel_to_snake = (
         ('ABCTrigger', 'abc_trigger'),
         ('AbcTrigger', 'abc_trigger'),